@@ -19,15 +19,20 @@ Credit Scoring API — Основной модуль FastAPI
 Автор: [Ваше имя]
 Год: 2025
 """
+import asyncio
 import os.path
 import json
 import logging
+import threading
 import time
 from datetime import datetime
 from pathlib import Path
-from typing import Dict, Any
+from typing import Dict, Any, Literal
 import pandas as pd
-from fastapi import FastAPI, HTTPException, Depends, status, Request, Response
+from pydantic import ValidationError
+from fastapi import (
+    FastAPI, HTTPException, Depends, status, Request, Response, Query
+)
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.responses import JSONResponse, FileResponse
 import uvicorn
@@ -42,9 +47,15 @@ from shared.auth import (
     verify_password
 )
 from shared.data_processing import preprocess_data
-from shared.config import DATA_SOURCE, HOST, PORT
+from shared.config import (
+    DATA_SOURCE, HOST, PORT, BATCH_PREDICT_MAX_ROWS, REPORT_JOB_WORKERS,
+    DECISION_THRESHOLD, RETRAIN_SCHEDULER, MODEL_WARMUP, PREDICT_MICROBATCH,
+    COMPARE_MAX_CONCURRENT, COMPARE_MAX_QUEUE, COMPARISON_REPORT_MAX_CONCURRENT,
+    COMPARISON_REPORT_MAX_QUEUE, REPORT_MAX_QUEUE, TRAIN_FINAL_MAX_QUEUE
+)
+from shared.model_store import get_artifact_path
 from shared.models import (
-    LoanRequest, FeedbackRequest, FeedbackDB, User,
+    LoanRequest, LoanBatchRequest, FeedbackRequest, FeedbackDB, User,
     LoginRequest as AuthLoginRequest, Token, TokenRefresh, UserInfo
 )
 from app.services.model_comparison import (
@@ -53,9 +64,27 @@ from app.services.model_comparison import (
 from app.services.reporting import (
     generate_model_comparison_pdf, generate_explanation_pdf
 )
-from app.services.model_training import train_ensemble_model
+from app.services.admission import AdmissionLimiter, Overloaded
+from app.services.artifacts import get_artifact_pdf, is_artifact_id
+from app.services.batching import MicroBatcher
+from app.services.inference import InferenceExecutor
+from app.services.jobs import (
+    ReportJobQueue, get_job_status, request_job_cancel,
+    JOB_QUEUED, JOB_DONE, JOB_FAILED, JOB_CANCELLED
+)
+from app.services.latency import LatencyHistograms, PROMETHEUS_CONTENT_TYPE
+from app.services.training_jobs import (
+    make_training_task, terminate_training_processes
+)
 from app.services.retrain import retrain_model_from_feedback
-from app.services.utils import explain_prediction, predict_loan_status
+from app.services.scheduler import (
+    RetrainInProgress, RetrainScheduler, retrain_lock
+)
+from app.services.utils import (
+    explain_prediction, predict_loan_status, predict_loan_status_batch,
+    get_explanation_cache_stats, get_loaded_model_version, get_model_bundle,
+    warm_up_model
+)
 
 
 # --- 📝 Настройка структурированного логирования ---
@@ -85,9 +114,18 @@ app_metrics: Dict[str, Any] = {
     "requests_by_endpoint": {},
     "errors_total": 0,
     "errors_by_endpoint": {},
-    "response_times": []
 }
 
+# Гистограммы времени ответа по эндпоинту и коду ответа
+# (p50/p95/p99 в /metrics, текстовый формат в /metrics/prometheus)
+latency = LatencyHistograms()
+
+
+def _route_label(request: Request) -> str:
+    """Эндпоинт для гистограмм: метод и шаблон пути (/jobs/{job_id}, а не ID)."""
+    route = request.scope.get("route")
+    return f"{request.method} {getattr(route, 'path', '<unmatched>')}"
+
 
 # --- 📥 Загрузка данных ---
 """
@@ -114,6 +152,120 @@ except Exception as e:
     raise
 
 
+# --- 🧮 Предобработанные данные для обучения ---
+"""
+df не меняется после старта, поэтому preprocess_data выполняется
+один раз, а X, y используются /compare, отчётом сравнения
+и /train-final. Вызывающие не должны изменять X, y.
+"""
+_training_data = None
+_training_data_lock = threading.Lock()
+
+
+def get_training_data():
+    """Возвращает (X, y) — результат preprocess_data для df."""
+    global _training_data
+
+    with _training_data_lock:
+        if _training_data is None:
+            _training_data = preprocess_data(df.copy())
+        return _training_data
+
+
+# --- ⏳ Очередь фоновых задач отчётов ---
+"""
+PDF-отчёты рендерятся в отдельном пуле потоков, чтобы медленный
+WeasyPrint не занимал потоки обработки запросов.
+"""
+report_jobs = ReportJobQueue(
+    max_workers=REPORT_JOB_WORKERS, max_queue=REPORT_MAX_QUEUE
+)
+
+# Отчёты сравнения обучают все модели — своя, более узкая очередь,
+# чтобы они не занимали потоки PDF-отчётов по заемщикам
+comparison_jobs = ReportJobQueue(
+    max_workers=COMPARISON_REPORT_MAX_CONCURRENT,
+    max_queue=COMPARISON_REPORT_MAX_QUEUE
+)
+
+# Обучение ансамбля — по одной задаче за раз: все задачи
+# сохраняют модель в одни и те же файлы
+training_jobs = ReportJobQueue(max_workers=1, max_queue=TRAIN_FINAL_MAX_QUEUE)
+
+# Синхронное сравнение моделей (/compare): не больше
+# COMPARE_MAX_CONCURRENT одновременно, остальные ждут или получают 429
+compare_limiter = AdmissionLimiter(
+    "compare", COMPARE_MAX_CONCURRENT, COMPARE_MAX_QUEUE
+)
+
+
+def _overloaded(error: Overloaded) -> HTTPException:
+    """Ответ на отклонённый запрос: 429/503 с заголовком Retry-After."""
+    return HTTPException(
+        status_code=int(error.status_code),
+        detail=str(error),
+        headers={"Retry-After": str(error.retry_after)}
+    )
+
+# Автоматическое дообучение при накоплении фидбэков
+# (включается RETRAIN_SCHEDULER=true)
+retrain_scheduler = RetrainScheduler()
+
+# Вызовы модели (/predict, /predict/batch, /explain, SHAP для /report)
+# выполняются в отдельном пуле, а не в общем пуле потоков Starlette
+inference_executor = InferenceExecutor()
+
+# Одиночные прогнозы /predict считаются пакетами
+# (отключается PREDICT_MICROBATCH=false)
+predict_batcher = MicroBatcher(
+    predict_loan_status_batch, executor=inference_executor
+)
+
+
+# --- 🔥 Готовность воркера ---
+"""
+Модель загружается и прогревается в фоновом потоке при старте
+(см. warm_up_model; при MODEL_WARMUP=false — только загружается).
+Пока загрузка и прогрев не закончены, /health/ready отвечает 503,
+и балансировщик не направляет на воркер трафик; /health/live
+отвечает сразу.
+
+Если при старте модели ещё не было, прогрев повторяется, когда
+она появится (по запросу /health/ready).
+"""
+_readiness: Dict[str, Any] = {
+    "running": False,
+    "warmup": None,
+    "error": None
+}
+_readiness_lock = threading.Lock()
+
+
+def _warm_up():
+    """Загружает и прогревает модель в фоне (поток model-warmup)."""
+    try:
+        if MODEL_WARMUP:
+            _readiness["warmup"] = warm_up_model()
+        else:
+            # Без прогрева готовность означает «модель загружена»
+            get_model_bundle()
+        _readiness["error"] = None
+    except Exception as e:
+        logger.error(f"Прогрев модели не удался: {e}")
+        _readiness["error"] = str(e)
+    finally:
+        _readiness["running"] = False
+
+
+def _start_warm_up():
+    """Запускает прогрев, если он ещё не идёт."""
+    with _readiness_lock:
+        if _readiness["running"]:
+            return
+        _readiness["running"] = True
+    threading.Thread(target=_warm_up, name="model-warmup", daemon=True).start()
+
+
 # --- 🚀 Инициализация FastAPI ---
 """
 FastAPI — современный фреймворк для создания API.
@@ -129,9 +281,18 @@ async def lifespan(app: FastAPI):
     """Lifecycle events для FastAPI"""
     # Startup
     logger.info("Приложение запускается", extra={"version": "2.0.0"})
+    _start_warm_up()
+    if RETRAIN_SCHEDULER:
+        retrain_scheduler.start()
     yield
     # Shutdown
     logger.info("Приложение останавливается")
+    retrain_scheduler.stop()
+    report_jobs.shutdown(wait=False)
+    comparison_jobs.shutdown(wait=False)
+    training_jobs.shutdown(wait=False)
+    inference_executor.shutdown(wait=False)
+    terminate_training_processes()
 
 
 app = FastAPI(
@@ -209,6 +370,7 @@ async def metrics_middleware(request: Request, call_next):
     - Измеряет время обработки запросов
     - Логирует все HTTP запросы в структурированном формате
     - Отслеживает ошибки
+    - Учитывает время ответа в гистограммах по эндпоинту и коду ответа
     - Добавляет заголовок X-Process-Time с временем обработки
     
     Args:
@@ -218,7 +380,7 @@ async def metrics_middleware(request: Request, call_next):
     Returns:
         Response: HTTP ответ с добавленным заголовком X-Process-Time
     """
-    start_time = time.time()
+    start_time = time.perf_counter()
     
     # Собираем метрики: увеличиваем счетчик общего количества запросов
     app_metrics["requests_total"] += 1
@@ -232,7 +394,7 @@ async def metrics_middleware(request: Request, call_next):
         # Выполняем следующий обработчик в цепочке
         response = await call_next(request)
         # Вычисляем время обработки запроса
-        process_time = time.time() - start_time
+        process_time = time.perf_counter() - start_time
         
         # Логируем успешный запрос в структурированном формате
         logger.info(
@@ -246,10 +408,8 @@ async def metrics_middleware(request: Request, call_next):
             }
         )
         
-        # Сохраняем время ответа для статистики (ограничиваем до 1000 последних)
-        app_metrics["response_times"].append(process_time)
-        if len(app_metrics["response_times"]) > 1000:
-            app_metrics["response_times"] = app_metrics["response_times"][-1000:]
+        # Учитываем время ответа в гистограмме (постоянная стоимость на запрос)
+        latency.observe(_route_label(request), response.status_code, process_time)
         
         # Добавляем заголовок с временем обработки для клиента
         response.headers["X-Process-Time"] = str(round(process_time, 3))
@@ -257,7 +417,8 @@ async def metrics_middleware(request: Request, call_next):
         return response
     except Exception as e:
         # Обработка ошибок: логируем и увеличиваем счетчики ошибок
-        process_time = time.time() - start_time
+        process_time = time.perf_counter() - start_time
+        latency.observe(_route_label(request), 500, process_time)
         app_metrics["errors_total"] += 1
         app_metrics["errors_by_endpoint"][endpoint] = \
             app_metrics["errors_by_endpoint"].get(endpoint, 0) + 1
@@ -337,6 +498,56 @@ def health_check():
     }
 
 
+@app.get("/health/live", tags=["Мониторинг"])
+def liveness_check():
+    """
+    Liveness probe: процесс жив и обрабатывает запросы.
+
+    Отвечает сразу, не дожидаясь загрузки модели. Не требует авторизации.
+
+    Returns:
+        dict: {"status": "alive"}
+    """
+    return {"status": "alive"}
+
+
+@app.get("/health/ready", tags=["Мониторинг"])
+def readiness_check():
+    """
+    Readiness probe: воркер готов к скорингу.
+
+    Готов — когда прогрев закончен и модель загружена (при
+    MODEL_WARMUP=false — когда модель загружена). Если модели ещё
+    нет, воркер не готов; когда она появится, загрузка и прогрев
+    запускаются заново. Не требует авторизации.
+
+    Returns:
+        JSONResponse: 200 {"status": "ready", "model_version", "warmup"}
+            или 503 {"status": "warming_up" | "not_ready", "error"}
+    """
+    model_version = get_loaded_model_version()
+    if model_version is None and not _readiness["running"] and (
+        get_artifact_path("model").exists()
+    ):
+        _start_warm_up()
+
+    if _readiness["running"]:
+        return JSONResponse(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            content={"status": "warming_up"}
+        )
+    if model_version is None:
+        return JSONResponse(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            content={"status": "not_ready", "error": _readiness["error"]}
+        )
+    return {
+        "status": "ready",
+        "model_version": model_version,
+        "warmup": _readiness["warmup"]
+    }
+
+
 @app.get("/health/detailed", tags=["Мониторинг"])
 def detailed_health_check(db: Session = Depends(get_db)):
     """
@@ -380,12 +591,13 @@ def detailed_health_check(db: Session = Depends(get_db)):
     
     # Проверка моделей
     try:
-        from shared.config import ENSEMBLE_MODEL_PATH, FEATURE_NAMES_PATH
-        model_exists = ENSEMBLE_MODEL_PATH.exists()
-        features_exists = FEATURE_NAMES_PATH.exists()
+        from shared.model_store import get_artifact_path, get_current_version
+        model_exists = get_artifact_path("model").exists()
+        features_exists = get_artifact_path("feature_names").exists()
         
         health_status["checks"]["models"] = {
             "status": "healthy" if (model_exists and features_exists) else "unhealthy",
+            "version": get_current_version(),
             "ensemble_model": model_exists,
             "feature_names": features_exists,
             "message": "Модели найдены" if (model_exists and features_exists) else "Модели не найдены"
@@ -455,8 +667,13 @@ def get_metrics(current_user: User = Depends(require_role(["admin"]))):
     - Общее количество запросов
     - Количество запросов по эндпоинтам
     - Количество ошибок
-    - Среднее время ответа
+    - Время ответа: среднее и p50/p95/p99 в целом, по эндпоинтам
+        и кодам ответа (по гистограммам, всех воркеров в
+        multiprocess-режиме)
     - Время работы приложения
+    - Статистику кэша объяснений (попадания, промахи, память)
+    - Статистику микропакетов /predict (пакеты, средний размер)
+    - Состояние пула инференса (глубина очереди, выполняющиеся вызовы)
     
     Требует роль: admin
     
@@ -466,11 +683,7 @@ def get_metrics(current_user: User = Depends(require_role(["admin"]))):
     Returns:
         dict: Метрики производительности
     """
-    avg_response_time = (
-        sum(app_metrics["response_times"]) / len(app_metrics["response_times"])
-        if app_metrics["response_times"] else 0
-    )
-    
+    latency_summary = latency.summary()
     uptime = (datetime.utcnow() - app_metrics["start_time"]).total_seconds()
     
     return {
@@ -480,13 +693,44 @@ def get_metrics(current_user: User = Depends(require_role(["admin"]))):
         "requests_by_endpoint": app_metrics["requests_by_endpoint"],
         "errors_total": app_metrics["errors_total"],
         "errors_by_endpoint": app_metrics["errors_by_endpoint"],
-        "response_time_avg": round(avg_response_time, 3),
-        "response_time_min": round(min(app_metrics["response_times"]), 3) if app_metrics["response_times"] else 0,
-        "response_time_max": round(max(app_metrics["response_times"]), 3) if app_metrics["response_times"] else 0,
+        "response_time_avg": round(latency_summary["avg"], 3),
+        "response_time_p50": latency_summary["p50"],
+        "response_time_p95": latency_summary["p95"],
+        "response_time_p99": latency_summary["p99"],
+        "latency_by_endpoint": latency_summary["by_endpoint"],
+        "explanation_cache": get_explanation_cache_stats(),
+        "predict_batching": predict_batcher.stats(),
+        "inference": inference_executor.stats(),
+        "admission": {
+            "compare": compare_limiter.stats(),
+            "report_jobs": report_jobs.stats(),
+            "comparison_jobs": comparison_jobs.stats(),
+            "training_jobs": training_jobs.stats()
+        },
         "timestamp": datetime.utcnow().isoformat()
     }
 
 
+@app.get("/metrics/prometheus", tags=["Мониторинг"])
+def get_prometheus_metrics():
+    """
+    Гистограммы времени ответа в текстовом формате Prometheus.
+
+    Метрика http_request_duration_seconds с метками endpoint
+    (метод и шаблон пути) и status (код ответа). Квантили
+    считаются на стороне Prometheus, например:
+        histogram_quantile(0.99, sum by (le, endpoint)
+            (rate(http_request_duration_seconds_bucket[5m])))
+
+    Не требует авторизации (для сборщика Prometheus): содержит
+    только шаблоны путей, коды ответа и время.
+
+    Returns:
+        Response: text/plain в формате Prometheus
+    """
+    return Response(content=latency.render(), media_type=PROMETHEUS_CONTENT_TYPE)
+
+
 # --- 🔐 Эндпоинты авторизации ---
 @app.post("/login", response_model=Token, tags=["Авторизация"])
 def login(
@@ -621,37 +865,53 @@ def get_me(current_user: User = Depends(get_current_user)):
     )
 
 
-@app.post(path="/train-final", tags=["ML Модели"])
+@app.post(
+    path="/train-final",
+    status_code=status.HTTP_202_ACCEPTED,
+    tags=["ML Модели"]
+)
 def train_final_api(
     current_user: User = Depends(require_role(["admin"]))
 ):
     """
-    Обучает ансамблевую модель на основе текущих данных.
+    Ставит в очередь обучение ансамблевой модели на текущих данных.
     Требует роль: admin
 
     Этапы:
         1. Предобработка данных (OHE, feature engineering)
         2. Обучение VotingClassifier (RF + XGBoost + CatBoost)
+            в отдельном процессе, по одной модели
         3. Сохранение модели, фичей и background_data
 
+    Ход обучения (модель, время) — в /jobs/{job_id} (поле progress),
+    итоговые метрики — в /jobs/{job_id}/result, отмена —
+    POST /jobs/{job_id}/cancel.
+
     Returns:
-        dict: Результат обучения (модель, точность)
+        dict: Описание задачи (см. _job_accepted)
     """
-    X, y = preprocess_data(df.copy())
-    result = train_ensemble_model(X, y)
+    X, y = get_training_data()
+    try:
+        job_id = training_jobs.submit(
+            "train_final",
+            make_training_task(X, y, DECISION_THRESHOLD),
+            owner_id=current_user.id
+        )
+    except Overloaded as e:
+        raise _overloaded(e)
     logger.info(
-        "Ансамбль обучен",
+        "Обучение ансамбля поставлено в очередь",
         extra={
             "username": current_user.username,
             "user_id": current_user.id,
-            "accuracy": result['accuracy']
+            "job_id": job_id
         }
     )
-    return result
+    return _job_accepted(job_id)
 
 
 @app.post(path="/predict", tags=["Прогнозирование"])
-def predict_api(
+async def predict_api(
     request: LoanRequest,
     current_user: User = Depends(get_current_user)
 ):
@@ -659,6 +919,10 @@ def predict_api(
     Выполняет прогноз статуса кредита.
     Требует авторизацию: любая роль
 
+    Конкурентные запросы считаются одним вызовом ансамбля
+    (см. app/services/batching.py) в пуле инференса; обработчик
+    ждёт результат, не занимая поток.
+
     Args:
         request (LoanRequest): Данные заемщика
         current_user: Текущий пользователь
@@ -666,8 +930,17 @@ def predict_api(
     Returns:
         dict: Прогноз, вероятности, решение
     """
-    input_df = pd.DataFrame([request.model_dump()])
-    result = predict_loan_status(input_df)
+    try:
+        if PREDICT_MICROBATCH:
+            result = await asyncio.wrap_future(
+                predict_batcher.submit(request.model_dump())
+            )
+        else:
+            result = await inference_executor.run(
+                predict_loan_status, pd.DataFrame([request.model_dump()])
+            )
+    except Overloaded as e:
+        raise _overloaded(e)
     logger.info(
         "Прогноз выполнен",
         extra={
@@ -686,26 +959,159 @@ def predict_api(
     }
 
 
+def _score_applicants(applicants: list) -> tuple:
+    """
+    Валидирует строки пакета и скорит валидные одним вызовом ансамбля.
+
+    Выполняется в пуле инференса: построчная валидация больших
+    пакетов тоже занимает процессор.
+
+    Returns:
+        tuple: (results, succeeded) — результаты по строкам в порядке
+            applicants и количество успешно оценённых строк
+    """
+    # Построчная валидация: ошибки не отклоняют весь пакет
+    results = [None] * len(applicants)
+    valid_indices = []
+    valid_rows = []
+    for i, applicant in enumerate(applicants):
+        try:
+            valid_rows.append(LoanRequest.model_validate(applicant).model_dump())
+            valid_indices.append(i)
+        except ValidationError as e:
+            results[i] = {
+                "index": i,
+                "errors": e.errors(include_url=False, include_input=False)
+            }
+
+    # Один проход предобработки и predict_proba по всем валидным строкам;
+    # строки с некорректными фичами (inf/NaN) получают ошибку по строке
+    predictions = predict_loan_status_batch(
+        pd.DataFrame(valid_rows), skip_invalid=True
+    )
+    succeeded = 0
+    for i, result in zip(valid_indices, predictions):
+        if "error" in result:
+            results[i] = {
+                "index": i,
+                "errors": [{
+                    "type": "value_error", "loc": [], "msg": result["error"]
+                }]
+            }
+            continue
+        succeeded += 1
+        results[i] = {
+            "index": i,
+            "prediction": result["prediction"],
+            "status": "repaid" if result["prediction"] == 0 else "default",
+            "decision": "approve" if result["prediction"] == 0 else "reject",
+            "probability_repaid": result["probability_repaid"],
+            "probability_default": result["probability_default"]
+        }
+    return results, succeeded
+
+
+@app.post(path="/predict/batch", tags=["Прогнозирование"])
+async def predict_batch_api(
+    request: LoanBatchRequest,
+    current_user: User = Depends(get_current_user)
+):
+    """
+    Выполняет пакетный прогноз статуса кредита для списка заемщиков.
+    Требует авторизацию: любая роль
+
+    Каждая строка валидируется отдельно: невалидные строки получают
+    поле "errors", валидные скорятся одним вызовом ансамбля
+    в пуле инференса (см. _score_applicants). Строка, для которой
+    предобработка дала бесконечные фичи (например, person_income=0),
+    тоже получает "errors" и не отклоняет пакет.
+    Порядок результатов совпадает с порядком заемщиков в запросе.
+
+    Args:
+        request (LoanBatchRequest): Список данных заемщиков
+        current_user: Текущий пользователь
+
+    Returns:
+        dict: Результаты по строкам и сводка:
+            {
+                "results": [
+                    {"index": 0, "prediction": 0, "status": "repaid", ...},
+                    {"index": 1, "errors": [...]}
+                ],
+                "total": 2,
+                "succeeded": 1,
+                "failed": 1
+            }
+
+    Raises:
+        HTTPException: 413, если пакет превышает BATCH_PREDICT_MAX_ROWS
+        HTTPException: 429, если очередь пула инференса заполнена
+    """
+    if len(request.applicants) > BATCH_PREDICT_MAX_ROWS:
+        raise HTTPException(
+            status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+            detail=(
+                f"Слишком большой пакет: {len(request.applicants)} строк. "
+                f"Максимум: {BATCH_PREDICT_MAX_ROWS}"
+            )
+        )
+
+    try:
+        results, succeeded = await inference_executor.run(
+            _score_applicants, request.applicants
+        )
+    except Overloaded as e:
+        raise _overloaded(e)
+
+    logger.info(
+        "Пакетный прогноз выполнен",
+        extra={
+            "username": current_user.username,
+            "user_id": current_user.id,
+            "role": current_user.role,
+            "total": len(results),
+            "succeeded": succeeded
+        }
+    )
+    return {
+        "results": results,
+        "total": len(results),
+        "succeeded": succeeded,
+        "failed": len(results) - succeeded
+    }
+
+
 @app.post(path="/explain", tags=["Прогнозирование"])
-def explain_api(
+async def explain_api(
     request: LoanRequest,
+    render: Literal["none", "png", "svg", "both"] = Query(
+        default="png",
+        description="Формат waterfall-графика: none — только SHAP-значения"
+    ),
     current_user: User = Depends(require_role(["analyst", "admin", "user"]))
 ):
     """
     Генерирует объяснение решения с помощью SHAP.
     Требует роль: analyst, admin, user
 
-    Использует универсальный Explainer для ансамблевой модели.
+    Использует TreeSHAP для ансамблевой модели. График строится
+    только если он запрошен (render != none), и не более одного
+    раза: PNG и SVG кодируются с одного холста. Расчёт выполняется
+    в пуле инференса.
 
     Args:
         request (LoanRequest): Данные заемщика
+        render (str): none / png / svg / both (по умолчанию png)
         current_user: Текущий пользователь
 
     Returns:
-        dict: Объяснение с SHAP-значениями и base_value
+        dict: Объяснение с SHAP-значениями и base_value; при render
+            png / both — shap_image_base64, при svg / both — shap_image_svg
     """
     try:
-        result = explain_prediction(request.model_dump())
+        result = await inference_executor.run(
+            explain_prediction, request.model_dump(), render=render
+        )
         logger.info(
             "Объяснение сгенерировано",
             extra={
@@ -714,17 +1120,23 @@ def explain_api(
             }
         )
         return result
+    except Overloaded as e:
+        raise _overloaded(e)
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Ошибка: {str(e)}")
 
 
-@app.post(path="/report", tags=["Отчёты"])
+@app.post(
+    path="/report",
+    status_code=status.HTTP_202_ACCEPTED,
+    tags=["Отчёты"]
+)
 def generate_report(
     request: LoanRequest,
     current_user: User = Depends(require_role(["analyst", "admin"]))
 ):
     """
-    Генерирует PDF-отчёт с полным объяснением решения.
+    Ставит в очередь генерацию PDF-отчёта с полным объяснением решения.
     Требует роль: analyst, admin
 
     Отчёт включает:
@@ -733,39 +1145,63 @@ def generate_report(
         - Текстовое объяснение
         - График SHAP waterfall
 
+    SHAP и WeasyPrint выполняются в фоновом пуле (ReportJobQueue;
+    SHAP — через пул инференса, при его заполненной очереди задача
+    ждёт, а не завершается ошибкой), эндпоинт сразу возвращает
+    ID задачи. Статус — GET /jobs/{job_id},
+    готовый PDF — GET /jobs/{job_id}/result или /download/{job_id}.
+
+    Каждый отчёт и его график сохраняются в отдельную директорию
+    reports/artifacts/<job_id>/, поэтому параллельные запросы
+    (в том числе из разных воркеров) не перезаписывают друг друга.
+
     Args:
         request (LoanRequest): Данные заемщика
         current_user: Текущий пользователь
 
     Returns:
-        dict: Путь к PDF-файлу
+        dict: Описание задачи (см. _job_accepted)
     """
-    try:
-        result = explain_prediction(request.model_dump())
-        
-        # Используем абсолютный путь для файла отчёта
-        from shared.config import REPORTS_DIR
-        report_filename = str(REPORTS_DIR / "explanation_report.pdf")
-        
+    data = request.model_dump()
+    # ORM-объект пользователя не передаётся в поток задачи
+    username, user_id = current_user.username, current_user.id
+
+    def task(artifact_dir, set_stage):
+        # PNG для отчёта сохраняется в директорию артефакта
+        set_stage("explaining")
+        # Принятый отчёт ждёт места в очереди инференса, а не отклоняется
+        result = inference_executor.call_background(
+            explain_prediction,
+            data,
+            render="png",
+            image_path=artifact_dir / "shap_waterfall.png"
+        )
+
+        set_stage("rendering_pdf")
         pdf_path = generate_explanation_pdf(
-            request.model_dump(),
+            data,
             result,
-            filename=report_filename
+            filename=artifact_dir / "explanation_report.pdf"
         )
         logger.info(
             "PDF-отчёт сгенерирован",
             extra={
-                "username": current_user.username,
-                "user_id": current_user.id,
+                "username": username,
+                "user_id": user_id,
                 "pdf_path": pdf_path
             }
         )
-        return {"report_path": pdf_path}
-    except Exception as e:
-        raise HTTPException(
-            status_code=500,
-            detail=f"Ошибка при генерации отчёта: {str(e)}"
-        )
+        return {
+            "report_id": artifact_dir.name,
+            "download_url": f"/download/{artifact_dir.name}",
+            "report_path": pdf_path
+        }
+
+    try:
+        job_id = report_jobs.submit("report", task, owner_id=user_id)
+    except Overloaded as e:
+        raise _overloaded(e)
+    return _job_accepted(job_id)
 
 
 @app.post(path='/feedback', tags=["Обратная связь"])
@@ -801,6 +1237,8 @@ def feedback_api(
                 "feedback_id": feedback.id
             }
         )
+        # Проверка условий дообучения — в потоке планировщика
+        retrain_scheduler.notify()
         return {"status": "success", "id": feedback.id}
     except Exception as e:
         db.rollback()
@@ -876,6 +1314,10 @@ def get_feedback_list(
 
 @app.post(path="/retrain", tags=["ML Модели"])
 def retrain_api(
+    full: bool = Query(False, description="Переобучить ансамбль с нуля на всех фидбэках"),
+    replay: bool = Query(
+        None, description="Добавить выборку базового датасета (по умолчанию RETRAIN_REPLAY)"
+    ),
     current_user: User = Depends(require_role(["admin", "analyst"])),
     db: Session = Depends(get_db)
 ):
@@ -884,25 +1326,42 @@ def retrain_api(
     Требует роль: admin, analyst
 
     Процесс:
-        1. Загрузка фидбэков
+        1. Загрузка фидбэков, поступивших после прошлого дообучения
         2. Предобработка
-        3. Дообучение ансамбля
-        4. Сохранение
+        3. Инкрементальное дообучение ансамбля (или полное при full=true),
+           при replay=true — вместе с выборкой базового датасета
+        4. Сохранение модели и водяного знака
 
     Returns:
-        dict: Результат дообучения
+        dict: Результат дообучения (status: retrained | up_to_date | deferred;
+            deferred — новых фидбэков мало или в них один класс,
+            они войдут в следующее дообучение)
+
+    Raises:
+        HTTPException 409: Дообучение уже выполняется
+            (вручную или планировщиком)
     """
     try:
-        result = retrain_model_from_feedback(db)
+        with retrain_lock():
+            result = retrain_model_from_feedback(db, full=full, replay=replay)
         logger.info(
             "Модель дообучена",
             extra={
                 "username": current_user.username,
                 "user_id": current_user.id,
-                "accuracy_on_feedback": result['accuracy_on_feedback']
+                "status": result["status"],
+                "mode": result.get("mode"),
+                "samples_used": result["samples_used"],
+                "replay_samples": result.get("replay_samples"),
+                "accuracy_on_feedback": result.get("accuracy_on_feedback")
             }
         )
         return result
+    except RetrainInProgress:
+        raise HTTPException(
+            status_code=status.HTTP_409_CONFLICT,
+            detail="Дообучение уже выполняется. Повторите запрос позже."
+        )
     except ValueError as e:
         # Ошибки валидации данных (нет данных, недостаточно данных и т.д.)
         error_msg = str(e)
@@ -940,29 +1399,44 @@ def compare_models_api(
     Требует роль: analyst, admin
 
     Обучает несколько моделей (RF, XGBoost, CatBoost, Ensemble)
-    и возвращает их точность.
+    и возвращает их точность. Результат кэшируется по отпечатку
+    данных и гиперпараметров: модели переобучаются только при
+    их изменении.
+
+    Одновременно выполняется не больше COMPARE_MAX_CONCURRENT
+    сравнений; сверх очереди — 429, после долгого ожидания — 503
+    (с заголовком Retry-After).
 
     Returns:
-        dict: Результаты сравнения
+        dict: Результаты сравнения и отпечаток (fingerprint)
     """
-    X, y = preprocess_data(df.copy())
-    result = compare_models(X, y)
+    try:
+        with compare_limiter.slot():
+            X, y = get_training_data()
+            result = compare_models(X, y)
+    except Overloaded as e:
+        raise _overloaded(e)
     logger.info(
         "Сравнение моделей выполнено",
         extra={
             "username": current_user.username,
-            "user_id": current_user.id
+            "user_id": current_user.id,
+            "fingerprint": result["fingerprint"]
         }
     )
-    return {"models": result["results"]}
+    return {"models": result["results"], "fingerprint": result["fingerprint"]}
 
 
-@app.post(path="/generate-comparison-report", tags=["Отчёты"])
+@app.post(
+    path="/generate-comparison-report",
+    status_code=status.HTTP_202_ACCEPTED,
+    tags=["Отчёты"]
+)
 def generate_comparison_report(
     current_user: User = Depends(require_role(["analyst", "admin"]))
 ):
     """
-    Генерирует PDF-отчёт с сравнением моделей.
+    Ставит в очередь генерацию PDF-отчёта с сравнением моделей.
     Требует роль: analyst, admin
 
     Включает:
@@ -970,44 +1444,232 @@ def generate_comparison_report(
         - ROC-AUC график
         - Информацию о моделях
 
+    Обучение моделей и рендеринг PDF выполняются в фоновом пуле,
+    эндпоинт сразу возвращает ID задачи (см. /report).
+
     Returns:
-        dict: Путь к PDF-файлу
+        dict: Описание задачи (см. _job_accepted)
     """
-    try:
-        X, y = preprocess_data(df.copy())
+    # ORM-объект пользователя не передаётся в поток задачи
+    username, user_id = current_user.username, current_user.id
+
+    def task(artifact_dir, set_stage):
+        set_stage("training_models")
+        X, y = get_training_data()
         result = compare_models(X, y)
 
+        set_stage("plotting")
         roc_path = generate_roc_auc_plot(
             result["X_test"],
             result["y_test"],
-            result["trained_models"]
+            result["trained_models"],
+            filename=artifact_dir / "roc_auc.png"
         )
 
-        # Используем абсолютный путь для файла отчёта
-        from shared.config import REPORTS_DIR
-        report_filename = str(REPORTS_DIR / "model_comparison_report.pdf")
-        
+        set_stage("rendering_pdf")
         pdf_path = generate_model_comparison_pdf(
             result["results"],
             roc_path,
-            filename=report_filename
+            filename=artifact_dir / "model_comparison_report.pdf"
         )
 
         logger.info(
             "Отчёт сравнения моделей сгенерирован",
             extra={
-                "username": current_user.username,
-                "user_id": current_user.id,
+                "username": username,
+                "user_id": user_id,
                 "pdf_path": pdf_path
             }
         )
-        return {"report_path": pdf_path}
+        return {
+            "report_id": artifact_dir.name,
+            "download_url": f"/download/{artifact_dir.name}",
+            "report_path": pdf_path
+        }
 
-    except Exception as e:
+    try:
+        job_id = comparison_jobs.submit(
+            "comparison_report", task, owner_id=user_id
+        )
+    except Overloaded as e:
+        raise _overloaded(e)
+    return _job_accepted(job_id)
+
+
+# --- ⏳ Фоновые задачи отчётов ---
+def _job_accepted(job_id: str) -> dict:
+    """
+    Ответ на постановку задачи в очередь.
+
+    Returns:
+        dict: {
+            "job_id": str,
+            "status": "queued",
+            "status_url": "/jobs/<job_id>",
+            "result_url": "/jobs/<job_id>/result"
+        }
+    """
+    return {
+        "job_id": job_id,
+        "status": JOB_QUEUED,
+        "status_url": f"/jobs/{job_id}",
+        "result_url": f"/jobs/{job_id}/result"
+    }
+
+
+def _get_user_job(job_id: str, current_user: User) -> dict:
+    """
+    Возвращает статус задачи, если она принадлежит пользователю
+    (администратор видит все задачи).
+
+    Raises:
+        HTTPException: 404, если задача не найдена или чужая
+    """
+    job = get_job_status(job_id)
+    if job is None or (
+        current_user.role != "admin" and job["owner_id"] != current_user.id
+    ):
         raise HTTPException(
-            status_code=500,
-            detail=f"Ошибка при генерации отчёта: {str(e)}"
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail=f"Задача {job_id} не найдена или срок её хранения истёк"
         )
+    return job
+
+
+@app.get("/jobs/{job_id}", tags=["Отчёты"])
+def get_job(
+    job_id: str,
+    current_user: User = Depends(get_current_user)
+):
+    """
+    Статус фоновой задачи (отчёт или обучение модели).
+    Требует авторизацию: автор задачи или admin
+
+    Args:
+        job_id: ID задачи из /report, /generate-comparison-report
+            или /train-final
+        current_user: Текущий пользователь
+
+    Returns:
+        dict: Статус задачи:
+            {
+                "job_id": str,
+                "job_type": "report" | "comparison_report" | "train_final",
+                "status": "queued" | "running" | "done" | "failed"
+                    | "cancelled",
+                "stage": str,   # например, rendering_pdf, fitting:xgb
+                "created_at": str,
+                "started_at": str | None,
+                "finished_at": str | None,
+                "result": dict | None,
+                "error": str | None,
+                "progress": dict   # только train_final: ход обучения
+                                   # по моделям (см. make_training_task)
+            }
+    """
+    job = _get_user_job(job_id, current_user)
+    job.pop("owner_id", None)
+    return job
+
+
+@app.get("/jobs/{job_id}/result", tags=["Отчёты"])
+def get_job_result(
+    job_id: str,
+    current_user: User = Depends(get_current_user)
+):
+    """
+    Результат фоновой задачи: PDF-отчёт или метрики обучения.
+    Требует авторизацию: автор задачи или admin
+
+    Args:
+        job_id: ID задачи
+        current_user: Текущий пользователь
+
+    Returns:
+        FileResponse: Файл PDF (отчёты)
+        dict: Метрики обученной модели (train_final):
+            {"model": str, "accuracy": float, "decision_threshold": float}
+
+    Raises:
+        HTTPException: 404 — задача не найдена,
+            409 — задача ещё выполняется или отменена,
+            500 — задача завершилась с ошибкой
+    """
+    job = _get_user_job(job_id, current_user)
+
+    if job["status"] == JOB_FAILED:
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail=f"Ошибка при выполнении задачи: {job['error']}"
+        )
+    if job["status"] == JOB_CANCELLED:
+        raise HTTPException(
+            status_code=status.HTTP_409_CONFLICT,
+            detail=f"Задача {job_id} отменена"
+        )
+    if job["job_type"] == "train_final":
+        if job["status"] != JOB_DONE:
+            raise HTTPException(
+                status_code=status.HTTP_409_CONFLICT,
+                detail=f"Обучение ещё выполняется: {job['stage']}"
+            )
+        return job["result"]
+
+    file_path = get_artifact_pdf(job_id)
+    if job["status"] != JOB_DONE or file_path is None:
+        raise HTTPException(
+            status_code=status.HTTP_409_CONFLICT,
+            detail=f"Отчёт ещё не готов: {job['stage']}"
+        )
+
+    return FileResponse(
+        path=str(file_path),
+        filename=f"{file_path.stem}_{job_id[:8]}.pdf",
+        media_type="application/pdf"
+    )
+
+
+@app.post("/jobs/{job_id}/cancel", tags=["Отчёты"])
+def cancel_job(
+    job_id: str,
+    current_user: User = Depends(get_current_user)
+):
+    """
+    Отменяет фоновую задачу.
+    Требует авторизацию: автор задачи или admin
+
+    Задача в очереди не запускается. Обучение модели прерывается
+    сразу (процесс обучения завершается), кроме стадии сохранения
+    модели; отчёты — на следующей стадии.
+
+    Args:
+        job_id: ID задачи
+        current_user: Текущий пользователь
+
+    Returns:
+        dict: {"job_id": str, "cancel_requested": True}
+
+    Raises:
+        HTTPException: 404 — задача не найдена,
+            409 — задача уже завершена
+    """
+    job = _get_user_job(job_id, current_user)
+
+    if not request_job_cancel(job_id):
+        raise HTTPException(
+            status_code=status.HTTP_409_CONFLICT,
+            detail=f"Задача {job_id} уже завершена: {job['status']}"
+        )
+    logger.info(
+        "Запрошена отмена задачи",
+        extra={
+            "username": current_user.username,
+            "user_id": current_user.id,
+            "job_id": job_id,
+            "job_type": job["job_type"]
+        }
+    )
+    return {"job_id": job_id, "cancel_requested": True}
 
 
 @app.get("/download/{filename}", tags=["Отчёты"])
@@ -1018,23 +1680,55 @@ def download_file(
     """
     Скачивание сгенерированных отчётов.
     
-    Поддерживаемые файлы:
-    - explanation_report.pdf
-    - model_comparison_report.pdf
+    Поддерживается:
+    - ID отчёта из /report или /generate-comparison-report
+      (только отчёты текущего пользователя; admin — любые)
+    - explanation_report.pdf, model_comparison_report.pdf
+      (общие файлы прежних версий API)
     
     Требует авторизацию: любая роль
     
     Args:
-        filename: Имя файла для скачивания
+        filename: ID отчёта или имя файла для скачивания
         current_user: Текущий пользователь
     
     Returns:
         FileResponse: Файл PDF
     
     Raises:
-        HTTPException: Если файл не найден
+        HTTPException: 404, если файл не найден, истёк срок хранения
+            или отчёт принадлежит другому пользователю
     """
     from shared.config import REPORTS_DIR
+
+    # Отчёт по ID: reports/artifacts/<id>/*.pdf — только автору задачи
+    # (или admin), как и /jobs/{id}/result
+    if is_artifact_id(filename):
+        job = _get_user_job(filename, current_user)
+        file_path = get_artifact_pdf(filename)
+        if job["status"] != JOB_DONE:
+            raise HTTPException(
+                status_code=status.HTTP_409_CONFLICT,
+                detail=f"Отчёт {filename} ещё не готов: {job['stage']}"
+            )
+        if file_path is None:
+            raise HTTPException(
+                status_code=status.HTTP_404_NOT_FOUND,
+                detail=f"Отчёт {filename} не найден или срок его хранения истёк"
+            )
+        logger.info(
+            "Файл скачан",
+            extra={
+                "username": current_user.username,
+                "user_id": current_user.id,
+                "report_id": filename
+            }
+        )
+        return FileResponse(
+            path=str(file_path),
+            filename=f"{file_path.stem}_{filename[:8]}.pdf",
+            media_type="application/pdf"
+        )
     
     # Безопасность: проверяем, что файл находится в директории reports
     allowed_files = ["explanation_report.pdf", "model_comparison_report.pdf"]
@@ -0,0 +1,149 @@
+# app/services/admission.py
+"""
+Модуль ограничения нагрузки на тяжёлые эндпоинты (admission control)
+
+Модуль реализует:
+- Ограничение числа одновременных вызовов эндпоинта и длины
+    очереди ожидающих (AdmissionLimiter)
+- Немедленный отказ при заполненной очереди (Overloaded → 429)
+    и отказ по истечении ожидания в очереди (Overloaded → 503);
+    в обоих случаях клиент получает Retry-After
+
+Зачем:
+    /compare и /generate-comparison-report обучают по несколько
+    моделей. Десятки одновременных вызовов занимали все ядра, и
+    задержка скоринга росла для всех пользователей. Теперь лишние
+    вызовы отклоняются сразу, а не копятся.
+
+Очереди фоновых задач ограничиваются так же (см. max_queue
+в ReportJobQueue, app/services/jobs.py).
+
+Ограничения действуют в пределах одного воркера API.
+
+Автор: [Кочнева Арина]
+Год: 2025
+"""
+
+import logging
+import threading
+from contextlib import contextmanager
+from http import HTTPStatus
+
+from shared.config import (
+    ADMISSION_QUEUE_TIMEOUT_SECONDS, ADMISSION_RETRY_AFTER_SECONDS
+)
+
+
+logger = logging.getLogger(__name__)
+
+
+class Overloaded(Exception):
+    """
+    Запрос отклонён: очередь эндпоинта заполнена или ожидание истекло.
+
+    Args:
+        message (str): Описание причины
+        status_code (int): 429 (очередь заполнена) или 503
+            (ожидание в очереди истекло)
+        retry_after (int): Через сколько секунд повторить запрос
+    """
+
+    def __init__(self, message: str,
+                 status_code: int = HTTPStatus.TOO_MANY_REQUESTS,
+                 retry_after: int = ADMISSION_RETRY_AFTER_SECONDS):
+        super().__init__(message)
+        self.status_code = status_code
+        self.retry_after = retry_after
+
+
+class AdmissionLimiter:
+    """
+    Ограничение одновременных вызовов эндпоинта с очередью.
+
+    Не больше max_concurrent вызовов выполняются одновременно,
+    не больше max_queue ждут свободного места (до queue_timeout
+    секунд). Остальные отклоняются сразу.
+
+    Args:
+        name (str): Имя эндпоинта (для сообщений и метрик)
+        max_concurrent (int): Одновременных вызовов
+        max_queue (int): Ожидающих вызовов
+        queue_timeout (float): Максимальное ожидание в очереди, секунды
+        retry_after (int): Значение Retry-After при отказе, секунды
+
+    Пример:
+        >>> limiter = AdmissionLimiter("compare", max_concurrent=1, max_queue=2)
+        >>> with limiter.slot():
+        ...     compare_models(X, y)
+    """
+
+    def __init__(self, name: str, max_concurrent: int, max_queue: int,
+                 queue_timeout: float = ADMISSION_QUEUE_TIMEOUT_SECONDS,
+                 retry_after: int = ADMISSION_RETRY_AFTER_SECONDS):
+        self.name = name
+        self.max_concurrent = max_concurrent
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+        self.retry_after = retry_after
+        self._cond = threading.Condition()
+        self._running = 0
+        self._waiting = 0
+        self._rejected = 0
+
+    def _reject(self, message: str, status_code: int):
+        self._rejected += 1
+        logger.warning(f"{self.name}: запрос отклонён — {message}")
+        raise Overloaded(
+            f"Сервер занят ({self.name}): {message}. "
+            f"Повторите через {self.retry_after} с",
+            status_code=status_code,
+            retry_after=self.retry_after
+        )
+
+    @contextmanager
+    def slot(self):
+        """
+        Занимает место для вызова на время блока with.
+
+        Raises:
+            Overloaded: 429, если очередь заполнена; 503, если место
+                не освободилось за queue_timeout
+        """
+        with self._cond:
+            if self._running >= self.max_concurrent:
+                if self._waiting >= self.max_queue:
+                    self._reject(
+                        f"очередь заполнена ({self.max_queue})",
+                        HTTPStatus.TOO_MANY_REQUESTS
+                    )
+                self._waiting += 1
+                try:
+                    admitted = self._cond.wait_for(
+                        lambda: self._running < self.max_concurrent,
+                        self.queue_timeout
+                    )
+                finally:
+                    self._waiting -= 1
+                if not admitted:
+                    self._reject(
+                        f"ожидание в очереди дольше {self.queue_timeout:g} с",
+                        HTTPStatus.SERVICE_UNAVAILABLE
+                    )
+            self._running += 1
+        try:
+            yield
+        finally:
+            with self._cond:
+                self._running -= 1
+                self._cond.notify()
+
+    def stats(self) -> dict:
+        """Метрики ограничения для /metrics."""
+        with self._cond:
+            return {
+                "running": self._running,
+                "waiting": self._waiting,
+                "rejected": self._rejected,
+                "max_concurrent": self.max_concurrent,
+                "max_queue": self.max_queue
+            }
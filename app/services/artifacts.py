@@ -0,0 +1,142 @@
+# app/services/artifacts.py
+"""
+Модуль хранения артефактов отчётов
+
+Модуль реализует:
+- Выделение уникальной директории под каждый отчёт
+    (reports/artifacts/<id>/)
+- Поиск PDF-отчёта по ID для /download/{id}
+- Политику хранения: удаление артефактов старше TTL
+
+Зачем:
+    Раньше все запросы писали в общие reports/explanation_report.pdf
+    и reports/images/shap_waterfall.png, и параллельные отчёты
+    перезаписывали друг друга. С ID-директориями отчёты можно
+    генерировать одновременно в нескольких воркерах.
+
+Автор: [Кочнева Арина]
+Год: 2025
+"""
+
+import logging
+import re
+import shutil
+import time
+import uuid
+
+from shared.config import (
+    ARTIFACTS_DIR, ARTIFACT_TTL_SECONDS, ARTIFACT_CLEANUP_INTERVAL_SECONDS
+)
+
+
+logger = logging.getLogger(__name__)
+
+# ID артефакта — uuid4 в hex; защищает /download от обхода путей
+ARTIFACT_ID_PATTERN = re.compile(r"^[0-9a-f]{32}$")
+
+# Время последней очистки (в рамках процесса)
+_last_cleanup = 0.0
+
+
+def create_artifact_dir() -> tuple:
+    """
+    Создаёт директорию для артефактов нового отчёта.
+
+    Попутно (не чаще ARTIFACT_CLEANUP_INTERVAL_SECONDS) удаляет
+    просроченные артефакты.
+
+    Returns:
+        tuple: (artifact_id, directory)
+            - artifact_id (str): Уникальный ID отчёта
+            - directory (Path): reports/artifacts/<artifact_id>/
+
+    Пример:
+        >>> artifact_id, directory = create_artifact_dir()
+        >>> generate_explanation_pdf(data, result, filename=directory / "report.pdf")
+    """
+    global _last_cleanup
+
+    now = time.time()
+    if now - _last_cleanup >= ARTIFACT_CLEANUP_INTERVAL_SECONDS:
+        _last_cleanup = now
+        cleanup_expired_artifacts()
+
+    artifact_id = uuid.uuid4().hex
+    directory = ARTIFACTS_DIR / artifact_id
+    directory.mkdir(parents=True)
+    return artifact_id, directory
+
+
+def is_artifact_id(value: str) -> bool:
+    """Проверяет, что строка является ID артефакта."""
+    return bool(ARTIFACT_ID_PATTERN.match(value))
+
+
+def get_artifact_dir(artifact_id: str):
+    """
+    Возвращает директорию артефакта.
+
+    Args:
+        artifact_id (str): ID отчёта
+
+    Returns:
+        Path или None: Директория или None, если ID некорректен
+            или артефакт удалён
+    """
+    if not is_artifact_id(artifact_id):
+        return None
+    directory = ARTIFACTS_DIR / artifact_id
+    if not directory.is_dir():
+        return None
+    return directory
+
+
+def get_artifact_pdf(artifact_id: str):
+    """
+    Возвращает путь к PDF-отчёту артефакта.
+
+    Args:
+        artifact_id (str): ID отчёта
+
+    Returns:
+        Path или None: Путь к PDF или None, если ID некорректен,
+            артефакт удалён или отчёт ещё не сформирован
+    """
+    directory = get_artifact_dir(artifact_id)
+    if directory is None:
+        return None
+    return next(iter(sorted(directory.glob("*.pdf"))), None)
+
+
+def cleanup_expired_artifacts(ttl_seconds: int = ARTIFACT_TTL_SECONDS) -> int:
+    """
+    Удаляет директории артефактов старше ttl_seconds.
+
+    Возраст определяется по времени изменения директории.
+    Безопасна при одновременном запуске в нескольких воркерах.
+
+    Args:
+        ttl_seconds (int): Время хранения артефакта в секундах
+
+    Returns:
+        int: Количество удалённых артефактов
+    """
+    if not ARTIFACTS_DIR.exists():
+        return 0
+
+    expire_before = time.time() - ttl_seconds
+    removed = 0
+    for directory in ARTIFACTS_DIR.iterdir():
+        if not directory.is_dir() or not is_artifact_id(directory.name):
+            continue
+        try:
+            if directory.stat().st_mtime < expire_before:
+                shutil.rmtree(directory, ignore_errors=True)
+                removed += 1
+        except FileNotFoundError:
+            # Удалено другим воркером
+            continue
+
+    if removed:
+        logger.info(f"🧹 Удалено просроченных артефактов: {removed}")
+    return removed
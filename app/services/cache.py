@@ -0,0 +1,148 @@
+# app/services/cache.py
+"""
+Модуль кэша объяснений
+
+Модуль реализует:
+- Content-addressed ключ: SHA-256 от канонического JSON полей
+  LoanRequest и версии модели
+- LRU-кэш с ограничением по памяти (в байтах)
+- Счётчики попаданий, промахов и вытеснений
+
+Используется в app/services/utils.py (explain_prediction):
+повторные запросы /explain и /report с теми же данными заемщика
+возвращаются из кэша без пересчёта SHAP и перерисовки графика.
+
+Автор: [Кочнева Арина]
+Год: 2025
+"""
+
+import hashlib
+import json
+import threading
+from collections import OrderedDict
+
+
+def make_cache_key(payload: dict, model_version: str) -> str:
+    """
+    Строит ключ кэша по содержимому запроса.
+
+    JSON сериализуется с сортировкой ключей и без пробелов, поэтому
+    порядок полей в запросе на ключ не влияет.
+
+    Args:
+        payload (dict): Поля LoanRequest (результат model_dump())
+        model_version (str): Версия модели
+
+    Returns:
+        str: Хэш SHA-256 в hex
+
+    Пример:
+        >>> make_cache_key({"b": 1, "a": 2}, "v1") == make_cache_key({"a": 2, "b": 1}, "v1")
+        True
+    """
+    canonical = json.dumps(
+        payload, sort_keys=True, separators=(",", ":"), ensure_ascii=False,
+        default=str
+    )
+    return hashlib.sha256(
+        f"{model_version}\n{canonical}".encode("utf-8")
+    ).hexdigest()
+
+
+class ExplanationCache:
+    """
+    Потокобезопасный LRU-кэш с ограничением по суммарному размеру.
+
+    Размер записи передаётся при вставке (оценка в байтах). При
+    превышении max_bytes вытесняются самые давно использованные
+    записи. Запись больше max_bytes не сохраняется.
+
+    Args:
+        max_bytes (int): Лимит памяти; 0 — кэш отключён
+
+    Пример:
+        >>> cache = ExplanationCache(max_bytes=1024)
+        >>> cache.put("key", {"value": 1}, size=100)
+        >>> cache.get("key")
+        {'value': 1}
+        >>> cache.stats()["hits"]
+        1
+    """
+
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()  # key -> (value, size)
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key: str):
+        """
+        Возвращает значение по ключу и помечает его как недавно
+        использованное.
+
+        Returns:
+            Значение или None, если ключа нет
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def put(self, key: str, value, size: int):
+        """
+        Сохраняет значение (заменяя прежнее) и вытесняет старые
+        записи, пока кэш не уложится в max_bytes.
+
+        Args:
+            key (str): Ключ (см. make_cache_key)
+            value: Значение
+            size (int): Оценка размера значения в байтах
+        """
+        if size > self.max_bytes:
+            return
+
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self._bytes -= old[1]
+
+            self._entries[key] = (value, size)
+            self._bytes += size
+
+            while self._bytes > self.max_bytes:
+                _, (_, evicted_size) = self._entries.popitem(last=False)
+                self._bytes -= evicted_size
+                self.evictions += 1
+
+    def clear(self):
+        """Удаляет все записи (счётчики сохраняются)."""
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+    def stats(self) -> dict:
+        """
+        Статистика кэша для /metrics.
+
+        Returns:
+            dict: entries, bytes, max_bytes, hits, misses,
+                evictions, hit_rate
+        """
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "bytes": self._bytes,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0
+            }
@@ -0,0 +1,241 @@
+# app/services/explainer.py
+"""
+Модуль точных SHAP-объяснений для ансамбля деревьев
+
+Модуль реализует:
+- Точный TreeSHAP отдельно для каждой модели ансамбля
+    (RandomForest, XGBoost, CatBoost)
+- Приведение вкладов к пространству вероятностей
+- Объединение вкладов с весами soft voting
+- Сохранение массивов деревьев в .npy при публикации версии модели
+    и их отображение в память при загрузке (общие страницы для всех
+    воркеров API)
+
+Зачем:
+    shap.Explainer с callable-обёрткой над VotingClassifier работает
+    как модельно-агностический PermutationExplainer и делает тысячи
+    вызовов ансамбля на одно объяснение. TreeExplainer на каждой модели
+    считает точные значения за один проход по деревьям.
+
+Пространства выходов:
+    - RandomForest (sklearn) — вероятности, вклады аддитивны по
+      вероятности класса «дефолт»
+    - XGBoost / CatBoost — логиты (margin). Вклады масштабируются
+      коэффициентом (p(x) - σ(base)) / (f(x) - base), что сохраняет
+      знаки и пропорции вкладов и делает их аддитивными по вероятности
+
+Итог: base_value + sum(shap_values) == predict_proba ансамбля.
+
+Автор: [Кочнева Арина]
+Год: 2025
+"""
+
+import logging
+
+import numpy as np
+import shap
+
+
+logger = logging.getLogger(__name__)
+
+# Массивы деревьев shap.TreeExplainer (explainer.model), по которым
+# считаются SHAP-значения; для RandomForest это десятки мегабайт
+_TREE_ARRAYS = (
+    "children_left", "children_right", "children_default", "features",
+    "thresholds", "threshold_types", "values", "node_sample_weight"
+)
+
+# Поддиректория версии модели с массивами деревьев (.npy)
+TREE_ARRAYS_DIR = "tree_arrays"
+
+
+def _sigmoid(x):
+    return 1.0 / (1.0 + np.exp(-x))
+
+
+class EnsembleTreeExplainer:
+    """
+    Точный SHAP для VotingClassifier(voting='soft') из деревьев.
+
+    Строится один раз при загрузке модели: TreeExplainer каждой
+    модели ансамбля создаётся в конструкторе и переиспользуется
+    между запросами.
+
+    Args:
+        model (VotingClassifier): Обученный ансамбль с soft voting
+        feature_names (list): Список фичей в порядке обучения
+
+    Raises:
+        ValueError: Если ансамбль не soft voting или модель ансамбля
+            не поддерживается TreeExplainer
+
+    Пример:
+        >>> explainer = EnsembleTreeExplainer(model, feature_names)
+        >>> values, base_value = explainer.explain(X)
+        >>> base_value + values.sum(axis=1)  # == model.predict_proba(X)[:, 1]
+    """
+
+    def __init__(self, model, feature_names):
+        if getattr(model, "voting", None) != "soft":
+            raise ValueError("Поддерживается только VotingClassifier с voting='soft'")
+
+        self.feature_names = list(feature_names)
+        self.positive_class = list(model.classes_).index(1)
+
+        weights = model.weights
+        if weights is None:
+            weights = [1.0] * len(model.estimators)
+
+        # (имя, вес, TreeExplainer, пространство выхода)
+        self._components = []
+        for (name, estimator), weight in zip(model.estimators, weights):
+            if estimator == "drop":
+                continue
+            explainer = shap.TreeExplainer(model.named_estimators_[name])
+            output_space = explainer.model.tree_output
+            if output_space not in ("probability", "log_odds"):
+                raise ValueError(
+                    f"Модель {name} не поддерживается: выход {output_space}"
+                )
+            self._components.append(
+                (name, float(weight), explainer, output_space)
+            )
+
+        self._total_weight = sum(w for _, w, _, _ in self._components)
+
+    def _explain_component(self, explainer, output_space, X):
+        """Вклады и базовое значение одной модели в пространстве вероятностей."""
+        values = explainer.shap_values(X, check_additivity=False)
+        if isinstance(values, list):
+            values = np.stack(values, axis=-1)
+        values = np.asarray(values, dtype=np.float64)
+        expected = np.atleast_1d(explainer.expected_value).astype(np.float64)
+
+        # Модели ансамбля обучены на закодированных метках: класс 1 — дефолт
+        if values.ndim == 3:
+            values = values[:, :, 1]
+            expected = expected[1]
+        else:
+            expected = expected[0]
+
+        if output_space == "probability":
+            return values, expected
+
+        # log_odds -> вероятность: линейное масштабирование вкладов
+        margin_delta = values.sum(axis=1)
+        proba = _sigmoid(expected + margin_delta)
+        base_proba = _sigmoid(expected)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            scale = np.where(
+                np.abs(margin_delta) > 1e-12,
+                (proba - base_proba) / margin_delta,
+                proba * (1.0 - proba)
+            )
+        return values * scale[:, None], base_proba
+
+    def explain(self, X):
+        """
+        Считает SHAP-значения ансамбля для класса «дефолт».
+
+        Args:
+            X (pd.DataFrame или np.ndarray): Закодированные признаки
+
+        Returns:
+            tuple: (values, base_value)
+                - values (np.ndarray): Вклады формы (n_rows, n_features)
+                - base_value (float): Базовая вероятность дефолта
+        """
+        # ndarray заметно быстрее DataFrame для TreeExplainer XGBoost
+        X = np.asarray(X)
+        values = np.zeros((len(X), len(self.feature_names)))
+        base_value = 0.0
+
+        for _, weight, explainer, output_space in self._components:
+            component_values, component_base = self._explain_component(
+                explainer, output_space, X
+            )
+            values += weight * component_values
+            base_value += weight * component_base
+
+        return values / self._total_weight, float(base_value / self._total_weight)
+
+    def _tree_arrays(self):
+        """Массивы деревьев: (компонент, атрибут, массив, имя файла)."""
+        for name, _, explainer, _ in self._components:
+            for attr in _TREE_ARRAYS:
+                array = getattr(explainer.model, attr, None)
+                if isinstance(array, np.ndarray):
+                    yield explainer.model, attr, array, f"{name}.{attr}.npy"
+
+    def save_tree_arrays(self, directory):
+        """
+        Сохраняет массивы деревьев в .npy-файлы.
+
+        Вызывается при публикации версии модели (во временной
+        директории версии), поэтому опубликованная версия
+        при загрузке не изменяется.
+
+        Args:
+            directory (Path): Директория файлов (создаётся)
+
+        Returns:
+            int: Размер сохранённых массивов, байты
+        """
+        directory.mkdir(parents=True, exist_ok=True)
+        saved_bytes = 0
+        for _, _, array, filename in self._tree_arrays():
+            np.save(directory / filename, array)
+            saved_bytes += array.nbytes
+        return saved_bytes
+
+    def memory_map(self, directory):
+        """
+        Отображает в память массивы деревьев из .npy-файлов версии.
+
+        Файлы только читаются (mmap_mode="r"): все воркеры отображают
+        одни и те же файлы, и страницы массивов хранятся в памяти
+        один раз. Массивы без подходящего файла (версии, опубликованные
+        до сохранения массивов) остаются в памяти процесса.
+
+        Args:
+            directory (Path): Директория файлов (см. save_tree_arrays)
+
+        Returns:
+            int: Размер отображённых массивов, байты
+        """
+        mapped_bytes = 0
+        for tree_model, attr, array, filename in self._tree_arrays():
+            path = directory / filename
+            if not path.exists():
+                continue
+            mapped = np.load(path, mmap_mode="r")
+            if (mapped.shape, mapped.dtype) != (array.shape, array.dtype):
+                continue
+            setattr(tree_model, attr, mapped)
+            mapped_bytes += mapped.nbytes
+        return mapped_bytes
+
+
+def build_tree_explainer(model, feature_names):
+    """
+    Строит EnsembleTreeExplainer, если модель его поддерживает.
+
+    Args:
+        model: Обученная модель
+        feature_names (list): Список фичей в порядке обучения
+
+    Returns:
+        EnsembleTreeExplainer или None: None, если модель не является
+            ансамблем деревьев с soft voting (тогда используется
+            модельно-агностический shap.Explainer)
+    """
+    try:
+        explainer = EnsembleTreeExplainer(model, feature_names)
+        logger.info(
+            "🌳 TreeSHAP построен для моделей: "
+            f"{[name for name, _, _, _ in explainer._components]}"
+        )
+        return explainer
+    except Exception as e:
+        logger.warning(f"TreeSHAP недоступен, используется shap.Explainer: {e}")
+        return None
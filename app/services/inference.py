@@ -0,0 +1,187 @@
+# app/services/inference.py
+"""
+Модуль выделенного пула потоков для инференса
+
+Модуль реализует:
+- Ограниченный пул потоков для вызовов модели (InferenceExecutor)
+    с ограниченной очередью: вызовы сверх max_queue отклоняются
+    (Overloaded → 429)
+- Ожидание результата из async-эндпоинтов без занятия потоков
+    Starlette (run) и из фоновых потоков (call); уже принятые
+    фоновые задачи ждут места в очереди, а не отклоняются
+    (call_background)
+- Метрики пула: глубина очереди, выполняющиеся и завершённые вызовы
+
+Зачем:
+    Синхронные эндпоинты FastAPI выполняются в общем пуле потоков
+    Starlette. Когда прогнозы и SHAP занимали все его потоки, лёгкие
+    эндпоинты (/health, /me) ждали в той же очереди. Теперь
+    /predict, /predict/batch и /explain — async и передают вызовы
+    модели в отдельный пул из INFERENCE_WORKERS потоков, а остальные
+    запросы обслуживаются без очереди за скорингом. Очередь пула
+    тоже ограничена: при перегрузке скорингом запросы не копятся,
+    а сразу получают 429 с Retry-After, как в admission control
+    (app/services/admission.py).
+
+Автор: [Кочнева Арина]
+Год: 2025
+"""
+
+import asyncio
+import logging
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+from http import HTTPStatus
+
+from app.services.admission import Overloaded
+from shared.config import (
+    ADMISSION_RETRY_AFTER_SECONDS, INFERENCE_MAX_QUEUE, INFERENCE_WORKERS
+)
+
+
+logger = logging.getLogger(__name__)
+
+
+class InferenceExecutor:
+    """
+    Пул потоков для вызовов модели с метриками очереди.
+
+    Потоки создаются при первом вызове (после fork, в воркере).
+    Вызовы сверх max_workers ждут в очереди; её глубина видна
+    в stats(). Если в очереди уже max_queue вызовов, новый вызов
+    отклоняется; call_background вместо этого ждёт места.
+
+    Args:
+        max_workers (int): Количество потоков инференса
+        max_queue (int): Максимум вызовов, ожидающих свободный поток
+        retry_after (int): Значение Retry-After при отказе, секунды
+
+    Пример:
+        >>> executor = InferenceExecutor(max_workers=2)
+        >>> result = await executor.run(explain_prediction, data)
+        >>> executor.stats()["queued"]
+        0
+    """
+
+    def __init__(self, max_workers: int = INFERENCE_WORKERS,
+                 max_queue: int = INFERENCE_MAX_QUEUE,
+                 retry_after: int = ADMISSION_RETRY_AFTER_SECONDS):
+        self.max_workers = max_workers
+        self.max_queue = max_queue
+        self.retry_after = retry_after
+        self._executor = ThreadPoolExecutor(
+            max_workers=max_workers, thread_name_prefix="inference"
+        )
+        # Condition: call_background ждёт, пока очередь не освободится
+        self._lock = threading.Condition()
+        self._closed = False
+        self._queued = 0
+        self._running = 0
+        self._completed = 0
+        self._max_queued = 0
+        self._rejected = 0
+
+    def submit(self, fn, *args, **kwargs) -> Future:
+        """
+        Ставит вызов fn(*args, **kwargs) в очередь пула.
+
+        Returns:
+            Future: Результат вызова
+
+        Raises:
+            Overloaded: 429, если очередь пула заполнена
+        """
+        return self._submit(fn, args, kwargs, wait=False)
+
+    def _submit(self, fn, args, kwargs, wait: bool) -> Future:
+        with self._lock:
+            if wait:
+                self._lock.wait_for(
+                    lambda: self._queued < self.max_queue or self._closed
+                )
+            if self._queued >= self.max_queue and not self._closed:
+                self._rejected += 1
+                logger.warning(
+                    f"inference: вызов отклонён — очередь заполнена "
+                    f"({self.max_queue})"
+                )
+                raise Overloaded(
+                    f"Сервер занят (inference): очередь заполнена "
+                    f"({self.max_queue}). Повторите через {self.retry_after} с",
+                    status_code=HTTPStatus.TOO_MANY_REQUESTS,
+                    retry_after=self.retry_after
+                )
+            self._queued += 1
+            self._max_queued = max(self._max_queued, self._queued)
+        try:
+            future = self._executor.submit(self._call, fn, args, kwargs)
+        except RuntimeError:
+            # Пул остановлен (завершение API)
+            with self._lock:
+                self._queued -= 1
+            raise
+        future.add_done_callback(self._on_done)
+        return future
+
+    async def run(self, fn, *args, **kwargs):
+        """Выполняет вызов в пуле и ждёт результат, не блокируя event loop."""
+        return await asyncio.wrap_future(self.submit(fn, *args, **kwargs))
+
+    def call(self, fn, *args, **kwargs):
+        """Выполняет вызов в пуле и ждёт результат (из фоновых потоков)."""
+        return self.submit(fn, *args, **kwargs).result()
+
+    def call_background(self, fn, *args, **kwargs):
+        """
+        Выполняет вызов уже принятой фоновой задачи (например, отчёта).
+
+        В отличие от call, при заполненной очереди ждёт места,
+        а не отклоняет вызов: задача уже обещана пользователю,
+        а число таких задач ограничено их собственной очередью.
+        """
+        return self._submit(fn, args, kwargs, wait=True).result()
+
+    @property
+    def queue_depth(self) -> int:
+        """Количество вызовов, ожидающих свободный поток."""
+        return self._queued
+
+    def stats(self) -> dict:
+        """Метрики пула для /metrics."""
+        with self._lock:
+            return {
+                "workers": self.max_workers,
+                "queued": self._queued,
+                "running": self._running,
+                "completed": self._completed,
+                "max_queued": self._max_queued,
+                "rejected": self._rejected,
+                "max_queue": self.max_queue
+            }
+
+    def shutdown(self, wait: bool = False):
+        """Останавливает пул (вызовы в очереди отменяются)."""
+        with self._lock:
+            self._closed = True
+            self._lock.notify_all()
+        self._executor.shutdown(wait=wait, cancel_futures=True)
+
+    def _call(self, fn, args, kwargs):
+        with self._lock:
+            self._queued -= 1
+            self._running += 1
+            self._lock.notify()
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            with self._lock:
+                self._running -= 1
+                self._completed += 1
+
+    def _on_done(self, future: Future):
+        # Отменённый вызов (клиент отключился, остановка API)
+        # так и не начал выполняться
+        if future.cancelled():
+            with self._lock:
+                self._queued -= 1
+                self._lock.notify()
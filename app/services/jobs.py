@@ -0,0 +1,282 @@
+# app/services/jobs.py
+"""
+Модуль фоновых задач генерации отчётов
+
+Модуль реализует:
+- Очередь задач на пуле потоков (ReportJobQueue)
+- Хранение статуса задачи в директории артефакта отчёта
+    (reports/artifacts/<job_id>/job.json)
+- Стадии выполнения (progress) для опроса через /jobs/{id}
+- Отмену задачи (маркер cancel в директории артефакта)
+- Ограничение очереди: сверх max_queue ожидающих задач новые
+    отклоняются (Overloaded, см. app/services/admission.py)
+
+Зачем:
+    WeasyPrint и обучение моделей для сравнения занимают секунды.
+    /report и /generate-comparison-report только ставят задачу
+    в очередь и сразу возвращают job_id, а PDF рендерится в пуле
+    потоков, не занимая потоки обработки запросов.
+
+Статус хранится в файле, а не в памяти процесса, поэтому его
+может прочитать любой воркер API; ID задачи совпадает с ID отчёта
+(см. app/services/artifacts.py), и на задачи распространяется
+та же политика хранения.
+
+Автор: [Кочнева Арина]
+Год: 2025
+"""
+
+import json
+import logging
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+from app.services.admission import Overloaded
+from app.services.artifacts import create_artifact_dir, get_artifact_dir
+from shared.config import ADMISSION_RETRY_AFTER_SECONDS
+
+
+logger = logging.getLogger(__name__)
+
+JOB_STATUS_FILE = "job.json"
+
+# Статусы задачи
+JOB_QUEUED = "queued"
+JOB_RUNNING = "running"
+JOB_DONE = "done"
+JOB_FAILED = "failed"
+JOB_CANCELLED = "cancelled"
+
+JOB_FINISHED_STATUSES = (JOB_DONE, JOB_FAILED, JOB_CANCELLED)
+
+# Маркер запроса отмены: файл, а не флаг в памяти, чтобы отменить
+# задачу мог любой воркер API
+JOB_CANCEL_FILE = "cancel"
+
+
+class JobCancelled(Exception):
+    """Задача отменена пользователем (см. request_job_cancel)."""
+
+
+def _write_status(directory, status: dict):
+    """Атомарно записывает статус задачи (через временный файл)."""
+    tmp_path = directory / f".{JOB_STATUS_FILE}.{threading.get_ident()}"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(status, f, ensure_ascii=False)
+    os.replace(tmp_path, directory / JOB_STATUS_FILE)
+
+
+def is_cancel_requested(directory) -> bool:
+    """Проверяет, запрошена ли отмена задачи."""
+    return (directory / JOB_CANCEL_FILE).exists()
+
+
+def request_job_cancel(job_id: str) -> bool:
+    """
+    Запрашивает отмену задачи.
+
+    Задача в очереди не запускается; выполняющаяся задача
+    прерывается на следующей смене стадии (set_stage) либо
+    самой задачей (см. is_cancel_requested).
+
+    Args:
+        job_id (str): ID задачи
+
+    Returns:
+        bool: False, если задача не найдена или уже завершена
+    """
+    status = get_job_status(job_id)
+    if status is None or status["status"] in JOB_FINISHED_STATUSES:
+        return False
+    (get_artifact_dir(job_id) / JOB_CANCEL_FILE).touch()
+    return True
+
+
+def get_job_status(job_id: str):
+    """
+    Читает статус задачи.
+
+    Args:
+        job_id (str): ID задачи
+
+    Returns:
+        dict или None: Статус задачи или None, если задача не найдена
+            (неизвестный ID или истёк срок хранения)
+            {
+                "job_id": str,
+                "job_type": str,
+                "status": "queued" | "running" | "done" | "failed"
+                    | "cancelled",
+                "stage": str,
+                "owner_id": int,
+                "created_at": str,
+                "started_at": str | None,
+                "finished_at": str | None,
+                "result": dict | None,
+                "error": str | None
+            }
+    """
+    directory = get_artifact_dir(job_id)
+    if directory is None:
+        return None
+    try:
+        with open(directory / JOB_STATUS_FILE, encoding="utf-8") as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return None
+
+
+class ReportJobQueue:
+    """
+    Очередь задач генерации отчётов на локальном пуле потоков.
+
+    Задача — функция task(directory, set_stage), где directory —
+    директория артефакта, а set_stage(stage, **fields) обновляет
+    стадию выполнения и дополнительные поля статуса (например,
+    progress). Возвращаемый словарь сохраняется как result.
+
+    Если запрошена отмена, set_stage выбрасывает JobCancelled,
+    и задача получает статус cancelled. Стадии, которые нельзя
+    прерывать (сохранение модели), передают cancellable=False.
+
+    Args:
+        max_workers (int): Количество потоков для рендеринга
+        max_queue (int): Сколько задач может ждать свободного потока
+            (None — без ограничения)
+
+    Пример:
+        >>> queue = ReportJobQueue(max_workers=2)
+        >>> job_id = queue.submit("report", task, owner_id=user.id)
+        >>> get_job_status(job_id)["status"]
+        'queued'
+    """
+
+    def __init__(self, max_workers: int, max_queue: int = None):
+        self.max_workers = max_workers
+        self.max_queue = max_queue
+        self._executor = ThreadPoolExecutor(
+            max_workers=max_workers, thread_name_prefix="report-job"
+        )
+        # Поставленные и ещё не завершённые задачи
+        self._pending = 0
+        self._rejected = 0
+        self._pending_lock = threading.Lock()
+
+    def _reserve(self, job_type: str):
+        """Занимает место в очереди или отклоняет задачу."""
+        with self._pending_lock:
+            if self.max_queue is not None and (
+                self._pending >= self.max_workers + self.max_queue
+            ):
+                self._rejected += 1
+                logger.warning(f"Очередь задач {job_type} заполнена — задача отклонена")
+                raise Overloaded(
+                    f"Сервер занят: в очереди уже {self._pending - self.max_workers} "
+                    f"задач {job_type}. Повторите через "
+                    f"{ADMISSION_RETRY_AFTER_SECONDS} с"
+                )
+            self._pending += 1
+
+    def _release(self):
+        with self._pending_lock:
+            self._pending -= 1
+
+    def _on_done(self, future):
+        # Задача, отменённая при остановке пула, так и не попала в _run
+        if future.cancelled():
+            self._release()
+
+    def stats(self) -> dict:
+        """Метрики очереди для /metrics."""
+        with self._pending_lock:
+            return {
+                "workers": self.max_workers,
+                "queued": max(0, self._pending - self.max_workers),
+                "running": min(self._pending, self.max_workers),
+                "max_queue": self.max_queue,
+                "rejected": self._rejected
+            }
+
+    def submit(self, job_type: str, task, owner_id=None) -> str:
+        """
+        Ставит задачу в очередь.
+
+        Args:
+            job_type (str): Тип задачи (report, comparison_report,
+                train_final)
+            task (callable): task(directory, set_stage) -> dict
+            owner_id (int): ID пользователя, создавшего задачу
+
+        Returns:
+            str: ID задачи (он же ID отчёта для /download/{id})
+
+        Raises:
+            Overloaded: Если очередь заполнена (max_queue)
+        """
+        self._reserve(job_type)
+        try:
+            job_id, directory = create_artifact_dir()
+            status = {
+                "job_id": job_id,
+                "job_type": job_type,
+                "status": JOB_QUEUED,
+                "stage": JOB_QUEUED,
+                "owner_id": owner_id,
+                "created_at": datetime.utcnow().isoformat(),
+                "started_at": None,
+                "finished_at": None,
+                "result": None,
+                "error": None
+            }
+            _write_status(directory, status)
+            future = self._executor.submit(self._run, directory, status, task)
+            future.add_done_callback(self._on_done)
+        except BaseException:
+            self._release()
+            raise
+        return job_id
+
+    def _run(self, directory, status: dict, task):
+        """Выполняет задачу в потоке пула и обновляет её статус."""
+        status = dict(
+            status, status=JOB_RUNNING, stage=JOB_RUNNING,
+            started_at=datetime.utcnow().isoformat()
+        )
+
+        def set_stage(stage: str, cancellable: bool = True, **fields):
+            if cancellable and is_cancel_requested(directory):
+                raise JobCancelled()
+            status["stage"] = stage
+            status.update(fields)
+            _write_status(directory, status)
+
+        try:
+            set_stage(JOB_RUNNING)
+            status["result"] = task(directory, set_stage)
+            status["status"] = JOB_DONE
+        except JobCancelled:
+            logger.info(
+                f"Задача {status['job_id']} ({status['job_type']}) отменена"
+            )
+            status["status"] = JOB_CANCELLED
+        except Exception as e:
+            logger.error(
+                f"Задача {status['job_id']} ({status['job_type']}) "
+                f"завершилась с ошибкой: {e}",
+                exc_info=True
+            )
+            status["status"] = JOB_FAILED
+            status["error"] = str(e)
+
+        status["stage"] = status["status"]
+        status["finished_at"] = datetime.utcnow().isoformat()
+        try:
+            _write_status(directory, status)
+        finally:
+            self._release()
+
+    def shutdown(self, wait: bool = False):
+        """Останавливает пул (незапущенные задачи отменяются)."""
+        self._executor.shutdown(wait=wait, cancel_futures=True)
@@ -0,0 +1,220 @@
+# app/services/latency.py
+"""
+Модуль гистограмм времени ответа API
+
+Модуль реализует:
+- Гистограммы времени ответа с фиксированными корзинами по эндпоинту
+    (шаблону пути) и коду ответа (LatencyHistograms)
+- Квантили p50/p95/p99 по корзинам (так же, как histogram_quantile
+    в Prometheus)
+- Выдачу гистограмм в текстовом формате Prometheus (/metrics/prometheus)
+
+Зачем:
+    metrics_middleware хранил последние 1000 времён ответа в списке
+    и на каждом запросе создавал его срез, а /metrics показывал
+    только среднее, минимум и максимум по этому окну, поэтому хвост
+    задержек не было видно. Гистограмма — это счётчики корзин: запись
+    стоит O(log корзин) и не зависит от числа запросов.
+
+Несколько воркеров:
+    Если установлен prometheus_client и задан PROMETHEUS_MULTIPROC_DIR,
+    счётчики хранятся в файлах этой директории (multiprocess-режим
+    prometheus_client), и /metrics с /metrics/prometheus суммируют
+    все воркеры. Иначе гистограммы хранятся в памяти процесса.
+
+Автор: [Кочнева Арина]
+Год: 2025
+"""
+
+import bisect
+import logging
+import threading
+from itertools import accumulate
+
+from shared.config import LATENCY_BUCKETS, PROMETHEUS_MULTIPROC_DIR
+
+# prometheus_client нужен только для общих гистограмм нескольких воркеров
+try:
+    from prometheus_client import CollectorRegistry, Histogram, multiprocess
+    PROMETHEUS_AVAILABLE = True
+except ImportError:
+    PROMETHEUS_AVAILABLE = False
+
+
+logger = logging.getLogger(__name__)
+
+METRIC_NAME = "http_request_duration_seconds"
+METRIC_HELP = "Время обработки HTTP-запроса, секунды"
+# Content-Type текстового формата Prometheus
+PROMETHEUS_CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+QUANTILES = (0.5, 0.95, 0.99)
+
+
+def histogram_quantile(q: float, bounds, cumulative) -> float:
+    """
+    Оценивает квантиль по накопленным счётчикам корзин.
+
+    Внутри корзины значения считаются распределёнными равномерно;
+    квантиль, попавший в корзину +Inf, оценивается её нижней
+    границей (наибольшей конечной).
+
+    Args:
+        q (float): Уровень квантиля (0.95 — p95)
+        bounds (tuple): Верхние границы конечных корзин, по возрастанию
+        cumulative (list): Накопленные счётчики корзин (последняя — +Inf)
+
+    Returns:
+        float или None: Оценка квантиля (None, если наблюдений нет)
+
+    Пример:
+        >>> histogram_quantile(0.5, (0.1, 1.0), [2, 4, 4])
+        0.1
+    """
+    total = cumulative[-1]
+    if not total:
+        return None
+    rank = q * total
+    index = bisect.bisect_left(cumulative, rank)
+    if index >= len(bounds):
+        return bounds[-1]
+    lower = bounds[index - 1] if index else 0.0
+    below = cumulative[index - 1] if index else 0
+    return lower + (bounds[index] - lower) * (rank - below) / (cumulative[index] - below)
+
+
+def _escape_label(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+class LatencyHistograms:
+    """
+    Гистограммы времени ответа по эндпоинту и коду ответа.
+
+    Args:
+        buckets (tuple): Верхние границы корзин, секунды (корзина +Inf
+            добавляется автоматически)
+
+    Пример:
+        >>> latency = LatencyHistograms()
+        >>> latency.observe("POST /predict", 200, 0.012)
+        >>> latency.summary()["p50"]
+        0.0175
+    """
+
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = tuple(sorted(buckets))
+        self._lock = threading.Lock()
+        # (эндпоинт, код) -> [счётчики корзин (последний — +Inf), сумма]
+        self._series = {}
+
+        # Multiprocess-режим: счётчики в файлах PROMETHEUS_MULTIPROC_DIR
+        self._histogram = None
+        self.multiprocess = bool(PROMETHEUS_MULTIPROC_DIR) and PROMETHEUS_AVAILABLE
+        if self.multiprocess:
+            # registry=None: значения пишутся в файлы, а читаются
+            # через MultiProcessCollector в snapshot
+            self._histogram = Histogram(
+                METRIC_NAME, METRIC_HELP, ["endpoint", "status"],
+                buckets=self.buckets, registry=None
+            )
+        elif PROMETHEUS_MULTIPROC_DIR:
+            logger.warning(
+                "PROMETHEUS_MULTIPROC_DIR задан, но prometheus_client не установлен: "
+                "гистограммы задержек считаются в каждом воркере отдельно"
+            )
+
+    def observe(self, endpoint: str, status_code: int, seconds: float):
+        """
+        Учитывает время ответа запроса.
+
+        Args:
+            endpoint (str): Эндпоинт ("POST /predict", шаблон пути)
+            status_code (int): Код ответа
+            seconds (float): Время обработки, секунды
+        """
+        if self._histogram is not None:
+            self._histogram.labels(endpoint, str(status_code)).observe(seconds)
+            return
+
+        index = bisect.bisect_left(self.buckets, seconds)
+        key = (endpoint, str(status_code))
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = [[0] * (len(self.buckets) + 1), 0.0]
+            series[0][index] += 1
+            series[1] += seconds
+
+    def snapshot(self) -> dict:
+        """
+        Возвращает текущие гистограммы (всех воркеров в multiprocess-режиме).
+
+        Returns:
+            dict: (эндпоинт, код) -> (накопленные счётчики корзин, сумма)
+        """
+        if not self.multiprocess:
+            with self._lock:
+                return {
+                    key: (list(accumulate(counts)), total)
+                    for key, (counts, total) in self._series.items()
+                }
+
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry, path=PROMETHEUS_MULTIPROC_DIR)
+        index_by_bound = {bound: i for i, bound in enumerate(self.buckets)}
+        series = {}
+        for metric in registry.collect():
+            if metric.name != METRIC_NAME:
+                continue
+            for sample in metric.samples:
+                key = (sample.labels["endpoint"], sample.labels["status"])
+                cumulative, total = series.setdefault(
+                    key, ([0] * (len(self.buckets) + 1), 0.0)
+                )
+                if sample.name.endswith("_bucket"):
+                    le = sample.labels["le"]
+                    index = len(self.buckets) if le == "+Inf" else index_by_bound[float(le)]
+                    cumulative[index] = int(sample.value)
+                elif sample.name.endswith("_sum"):
+                    series[key] = (cumulative, total + sample.value)
+        return series
+
+    def _describe(self, cumulative, total: float) -> dict:
+        count = cumulative[-1]
+        stats = {"count": count, "avg": round(total / count, 4) if count else 0}
+        for q in QUANTILES:
+            value = histogram_quantile(q, self.buckets, cumulative)
+            stats[f"p{round(q * 100)}"] = round(value, 4) if value is not None else 0
+        return stats
+
+    def summary(self) -> dict:
+        """
+        Сводка для /metrics: количество, среднее и p50/p95/p99 в целом
+        и по эндпоинтам и кодам ответа.
+
+        Returns:
+            dict: {"count", "avg", "p50", "p95", "p99", "by_endpoint":
+                {эндпоинт: {код: {...}}}}
+        """
+        snapshot = self.snapshot()
+        overall = [0] * (len(self.buckets) + 1)
+        overall_total = 0.0
+        by_endpoint = {}
+        for (endpoint, status_code), (cumulative, total) in sorted(snapshot.items()):
+            overall = [a + b for a, b in zip(overall, cumulative)]
+            overall_total += total
+            by_endpoint.setdefault(endpoint, {})[status_code] = \
+                self._describe(cumulative, total)
+        return {**self._describe(overall, overall_total), "by_endpoint": by_endpoint}
+
+    def render(self) -> str:
+        """Гистограммы в текстовом формате Prometheus."""
+        lines = [f"# HELP {METRIC_NAME} {METRIC_HELP}", f"# TYPE {METRIC_NAME} histogram"]
+        bounds = [str(bound) for bound in self.buckets] + ["+Inf"]
+        for (endpoint, status_code), (cumulative, total) in sorted(self.snapshot().items()):
+            labels = f'endpoint="{_escape_label(endpoint)}",status="{status_code}"'
+            for le, count in zip(bounds, cumulative):
+                lines.append(f'{METRIC_NAME}_bucket{{{labels},le="{le}"}} {count}')
+            lines.append(f"{METRIC_NAME}_sum{{{labels}}} {total}")
+            lines.append(f"{METRIC_NAME}_count{{{labels}}} {cumulative[-1]}")
+        return "\n".join(lines) + "\n"
@@ -8,6 +8,8 @@
 - Сравнение по метрикам: accuracy и AUC-ROC
 - Построение ROC-кривых
 - Генерацию графиков
+- Кэширование результатов по отпечатку данных и гиперпараметров
+- Параллельное обучение моделей в пуле процессов
 
 Используется в:
 - Эндпоинте /compare
@@ -17,11 +19,21 @@
 Год: 2025
 """
 
-import matplotlib.pyplot as plt
+from matplotlib.figure import Figure
 import os
 from pathlib import Path
+import hashlib
+import json
 import logging
-
+import multiprocessing
+import threading
+from concurrent.futures import ProcessPoolExecutor
+
+import pandas as pd
+import sklearn
+import xgboost
+import lightgbm
+import catboost
 from sklearn.ensemble import RandomForestClassifier, VotingClassifier
 from sklearn.metrics import accuracy_score, roc_auc_score, roc_curve
 from sklearn.model_selection import train_test_split
@@ -30,11 +42,308 @@ from lightgbm import LGBMClassifier
 from catboost import CatBoostClassifier
 import joblib
 
+from shared.config import (
+    COMPARISON_CACHE_DIR, COMPARISON_PARALLEL, COMPARISON_WORKERS
+)
+
 
 logger = logging.getLogger(__name__)
 
 
-def compare_models(X, y):
+# --- ⚙️ Параметры сравнения ---
+"""
+Разбиение на train/test фиксировано, поэтому результаты сравнения
+полностью определяются данными и гиперпараметрами моделей.
+"""
+TEST_SIZE = 0.2
+RANDOM_STATE = 42
+
+# Параметры, которые не влияют на обученные модели и метрики
+# (потоки, логирование) — не входят в отпечаток
+_FINGERPRINT_EXCLUDED_PARAMS = {
+    "n_jobs", "thread_count", "verbose", "verbosity", "silent",
+    "logging_level"
+}
+
+
+# --- 🗃 Кэш результатов сравнения ---
+"""
+Результаты, тестовая выборка и обученные модели сохраняются
+в MODELS_DIR/comparison/<fingerprint>.joblib и держатся в памяти
+процесса. Отпечаток — хэш содержимого данных, гиперпараметров
+моделей и версий библиотек: при их изменении модели
+переобучаются, иначе /compare и отчёт используют готовый результат.
+"""
+_comparison_lock = threading.Lock()
+_memory_cache = {}  # fingerprint -> результат compare_models
+
+
+def build_comparison_models() -> dict:
+    """
+    Создаёт необученные модели для сравнения.
+
+    Returns:
+        dict: {название: estimator}
+    """
+    return {
+        "RandomForest": RandomForestClassifier(
+            n_estimators=100,
+            random_state=RANDOM_STATE
+        ),
+        "XGBoost": XGBClassifier(
+            use_label_encoder=False,
+            eval_metric='logloss',
+            random_state=RANDOM_STATE
+        ),
+        "LightGBM": LGBMClassifier(random_state=RANDOM_STATE),
+        "CatBoost": CatBoostClassifier(silent=True, random_state=RANDOM_STATE),
+        "Ensemble": VotingClassifier(
+            estimators=[
+                (
+                    'rf',
+                    RandomForestClassifier(
+                        n_estimators=50,
+                        random_state=RANDOM_STATE
+                    )
+                ),
+                (
+                    'xgb',
+                    XGBClassifier(
+                        use_label_encoder=False,
+                        eval_metric='logloss',
+                        random_state=RANDOM_STATE
+                    )
+                ),
+                (
+                    'lgb',
+                    LGBMClassifier(random_state=RANDOM_STATE)
+            )],
+            voting='soft'
+        )
+    }
+
+
+def _model_config(model) -> dict:
+    """Гиперпараметры модели без вложенных estimator-объектов и потоков."""
+    params = {}
+    for key, value in model.get_params(deep=True).items():
+        if key.split("__")[-1] in _FINGERPRINT_EXCLUDED_PARAMS:
+            continue
+        if hasattr(value, "get_params"):
+            # Вложенная модель: её параметры уже есть в ключах name__param
+            value = type(value).__name__
+        elif isinstance(value, list):
+            value = [
+                type(v).__name__ if hasattr(v, "get_params") else v
+                for v in (item[1] if isinstance(item, tuple) else item
+                          for item in value)
+            ]
+        params[key] = value
+    return {"class": type(model).__name__, "params": params}
+
+
+def comparison_fingerprint(X, y, models: dict) -> str:
+    """
+    Вычисляет отпечаток сравнения моделей.
+
+    Учитывает:
+        - Содержимое X и y (значения, индекс, названия и типы столбцов)
+        - Гиперпараметры моделей (кроме потоков и логирования)
+        - Параметры разбиения и версии ML-библиотек
+
+    Args:
+        X (pd.DataFrame): Признаки
+        y (pd.Series): Целевая переменная
+        models (dict): Модели из build_comparison_models()
+
+    Returns:
+        str: Хэш SHA-256 в hex
+    """
+    digest = hashlib.sha256()
+    digest.update(pd.util.hash_pandas_object(X, index=True).values.tobytes())
+    digest.update(pd.util.hash_pandas_object(y, index=True).values.tobytes())
+
+    config = {
+        "columns": [f"{c}:{t}" for c, t in X.dtypes.astype(str).items()],
+        "split": {"test_size": TEST_SIZE, "random_state": RANDOM_STATE},
+        "models": {name: _model_config(m) for name, m in models.items()},
+        "versions": {
+            "sklearn": sklearn.__version__,
+            "xgboost": xgboost.__version__,
+            "lightgbm": lightgbm.__version__,
+            "catboost": catboost.__version__
+        }
+    }
+    digest.update(
+        json.dumps(config, sort_keys=True, default=repr).encode("utf-8")
+    )
+    return digest.hexdigest()
+
+
+def _fit_and_score(name: str, model, X_train, X_test, y_train, y_test) -> dict:
+    """Обучает модель и считает accuracy и AUC-ROC на test-части."""
+    # Обучение
+    model.fit(X_train, y_train)
+
+    # Предсказания
+    y_pred = model.predict(X_test)
+    acc = accuracy_score(y_test, y_pred)
+    auc = roc_auc_score(
+        y_test,
+        model.predict_proba(X_test)[:, 1]
+    )
+    return {
+        "model": name,
+        "accuracy": acc,
+        "auc": auc
+    }
+
+
+def apply_thread_budget(model, threads: int):
+    """
+    Ограничивает число потоков модели.
+
+    Для VotingClassifier бюджет получает каждая вложенная модель,
+    а сам ансамбль обучает их последовательно (n_jobs=1).
+
+    Args:
+        model: Estimator из build_comparison_models()
+        threads (int): Количество потоков
+    """
+    if isinstance(model, VotingClassifier):
+        model.set_params(n_jobs=1)
+        for _, estimator in model.estimators:
+            apply_thread_budget(estimator, threads)
+    elif isinstance(model, CatBoostClassifier):
+        model.set_params(thread_count=threads)
+    elif "n_jobs" in model.get_params(deep=False):
+        model.set_params(n_jobs=threads)
+
+
+def _fit_and_score_in_worker(name, model, threads, X_train, X_test, y_train, y_test):
+    """
+    Обучение одной модели в процессе пула.
+
+    threadpool_limits дополнительно ограничивает OpenMP/BLAS,
+    которые не управляются параметрами модели.
+    """
+    from threadpoolctl import threadpool_limits
+
+    apply_thread_budget(model, threads)
+    with threadpool_limits(limits=threads):
+        result = _fit_and_score(name, model, X_train, X_test, y_train, y_test)
+    return result, model
+
+
+def _train_and_evaluate(models: dict, X, y, parallel: bool = False) -> dict:
+    """
+    Обучает модели на train-части и считает метрики на test-части.
+
+    В параллельном режиме каждая модель обучается в отдельном
+    процессе; ядра делятся между процессами поровну
+    (apply_thread_budget), чтобы внутренние потоки библиотек
+    не конкурировали друг с другом.
+    """
+    # Разделение данных
+    X_train, X_test, y_train, y_test = train_test_split(
+        X, y, test_size=TEST_SIZE, random_state=RANDOM_STATE, stratify=y
+    )
+    split = (X_train, X_test, y_train, y_test)
+
+    results = []
+    trained_models = {}
+
+    def collect(name, get_result):
+        try:
+            result, model = get_result()
+        except Exception as e:
+            logger.error(f"❌ Ошибка при обучении {name}: {e}")
+            return
+        # Сохранение результатов
+        results.append(result)
+        trained_models[name] = model
+        # Логирование
+        logger.info(
+            f"✅ {name}: Accuracy={result['accuracy']:.3f}, "
+            f"AUC={result['auc']:.3f}"
+        )
+
+    workers = min(len(models), COMPARISON_WORKERS)
+    if parallel and workers > 1:
+        threads = max(1, (os.cpu_count() or 1) // workers)
+        logger.info(
+            f"Параллельное обучение: процессов={workers}, "
+            f"потоков на модель={threads}"
+        )
+        # spawn: fork процесса API с запущенными потоками
+        # и инициализированным OpenMP может зависнуть
+        with ProcessPoolExecutor(
+            max_workers=workers,
+            mp_context=multiprocessing.get_context("spawn")
+        ) as executor:
+            futures = {
+                name: executor.submit(
+                    _fit_and_score_in_worker, name, model, threads, *split
+                )
+                for name, model in models.items()
+            }
+            # Порядок результатов совпадает с порядком моделей
+            for name, future in futures.items():
+                collect(name, future.result)
+    else:
+        for name, model in models.items():
+            collect(
+                name,
+                lambda: (_fit_and_score(name, model, *split), model)
+            )
+
+    return {
+        "results": results,
+        "X_test": X_test,
+        "y_test": y_test,
+        "trained_models": trained_models
+    }
+
+
+def _load_cached_comparison(fingerprint: str):
+    """Читает результат сравнения из памяти или с диска."""
+    if fingerprint in _memory_cache:
+        return _memory_cache[fingerprint]
+
+    path = COMPARISON_CACHE_DIR / f"{fingerprint}.joblib"
+    if not path.exists():
+        return None
+    try:
+        result = joblib.load(path)
+    except Exception as e:
+        logger.warning(f"Не удалось прочитать кэш сравнения {path}: {e}")
+        return None
+
+    _memory_cache.clear()
+    _memory_cache[fingerprint] = result
+    return result
+
+
+def _save_cached_comparison(fingerprint: str, result: dict):
+    """
+    Сохраняет результат сравнения (атомарно, через временный файл)
+    и удаляет результаты с устаревшими отпечатками.
+    """
+    COMPARISON_CACHE_DIR.mkdir(parents=True, exist_ok=True)
+    path = COMPARISON_CACHE_DIR / f"{fingerprint}.joblib"
+    tmp_path = path.with_suffix(f".tmp{os.getpid()}")
+    joblib.dump(result, tmp_path)
+    os.replace(tmp_path, path)
+
+    for old_path in COMPARISON_CACHE_DIR.glob("*.joblib"):
+        if old_path != path:
+            old_path.unlink(missing_ok=True)
+
+    _memory_cache.clear()
+    _memory_cache[fingerprint] = result
+
+
+def compare_models(X, y, use_cache: bool = True, parallel: bool = None):
     """
     Обучает несколько моделей и сравнивает их производительность.
 
@@ -49,9 +358,21 @@ def compare_models(X, y):
         - Точность (accuracy)
         - AUC-ROC
 
+    Результат кэшируется по отпечатку данных и гиперпараметров
+    (comparison_fingerprint): повторные вызовы с теми же данными
+    не переобучают модели. Одновременные вызовы ждут друг друга,
+    поэтому обучение выполняется один раз.
+
+    В параллельном режиме модели обучаются одновременно в пуле
+    процессов (до COMPARISON_WORKERS), ядра делятся между ними
+    поровну; время сравнения близко ко времени самой долгой модели.
+
     Args:
         X (pd.DataFrame or np.ndarray): Признаки (фичи)
         y (pd.Series or np.ndarray): Целевая переменная (loan_status)
+        use_cache (bool): Использовать кэш результатов (по умолчанию True)
+        parallel (bool): Обучать модели параллельно
+            (по умолчанию COMPARISON_PARALLEL)
 
     Returns:
         dict: Словарь с результатами и обученными моделями:
@@ -69,12 +390,16 @@ def compare_models(X, y):
                 "trained_models": {      # Обученные модели
                     "RandomForest": model_rf,
                     ...
-                }
+                },
+                "fingerprint": str       # Отпечаток данных и моделей
             }
 
     Raises:
         ValueError: Если X или y пусты
         ValueError: Если размеры X и y не совпадают
+
+    Примечания:
+        - Результат общий для всех вызывающих: его нельзя изменять
     """
     if X.empty or len(X) == 0:
         raise ValueError("Признаки (X) пусты")
@@ -84,86 +409,27 @@ def compare_models(X, y):
             f"y ({len(y)}) не совпадают"
         )
 
-    # Разделение данных
-    X_train, X_test, y_train, y_test = train_test_split(
-        X, y, test_size=0.2, random_state=42, stratify=y
-    )
+    if parallel is None:
+        parallel = COMPARISON_PARALLEL
 
-    # Определение моделей
-    models = {
-        "RandomForest": RandomForestClassifier(
-            n_estimators=100,
-            random_state=42
-        ),
-        "XGBoost": XGBClassifier(
-            use_label_encoder=False,
-            eval_metric='logloss',
-            random_state=42
-        ),
-        "LightGBM": LGBMClassifier(random_state=42),
-        "CatBoost": CatBoostClassifier(silent=True, random_state=42),
-        "Ensemble": VotingClassifier(
-            estimators=[
-                (
-                    'rf',
-                    RandomForestClassifier(
-                        n_estimators=50,
-                        random_state=42
-                    )
-                ),
-                (
-                    'xgb',
-                    XGBClassifier(
-                        use_label_encoder=False,
-                        eval_metric='logloss',
-                        random_state=42
-                    )
-                ),
-                (
-                    'lgb',
-                    LGBMClassifier(random_state=42)
-            )],
-            voting='soft'
-        )
-    }
-
-    results = []
-    trained_models = {}
-
-    for name, model in models.items():
-        try:
-            # Обучение
-            model.fit(X_train, y_train)
-
-            # Предсказания
-            y_pred = model.predict(X_test)
-            acc = accuracy_score(y_test, y_pred)
-            auc = roc_auc_score(
-                y_test,
-                model.predict_proba(X_test)[:, 1]
-            )
+    models = build_comparison_models()
+    fingerprint = comparison_fingerprint(X, y, models)
 
-            # Сохранение результатов
-            results.append({
-                "model": name,
-                "accuracy": acc,
-                "auc": auc
-            })
-            trained_models[name] = model
+    if not use_cache:
+        return {**_train_and_evaluate(models, X, y, parallel), "fingerprint": fingerprint}
 
-            # Логирование
-            logger.info(f"✅ {name}: Accuracy={acc:.3f}, AUC={auc:.3f}")
+    with _comparison_lock:
+        cached = _load_cached_comparison(fingerprint)
+        if cached is not None:
+            logger.info(f"📦 Сравнение моделей из кэша: {fingerprint[:12]}")
+            return cached
 
-        except Exception as e:
-            logger.error(f"❌ Ошибка при обучении {name}: {e}")
-            continue
+        result = {**_train_and_evaluate(models, X, y, parallel), "fingerprint": fingerprint}
 
-    return {
-        "results": results,
-        "X_test": X_test,
-        "y_test": y_test,
-        "trained_models": trained_models
-    }
+        # Частичный результат (ошибка обучения) не кэшируется
+        if len(result["trained_models"]) == len(models):
+            _save_cached_comparison(fingerprint, result)
+        return result
 
 
 def generate_roc_auc_plot(
@@ -192,6 +458,11 @@ def generate_roc_auc_plot(
     Raises:
         ValueError: Если trained_models пуст
         ValueError: Если X_test или y_test пусты
+
+    Примечания:
+        - График строится через объектный API (Figure), без глобального
+          состояния pyplot: функция вызывается из потоков фоновых задач
+          одновременно с waterfall-графиками (см. utils._render_waterfall)
     """
     if not trained_models:
         raise ValueError("Список моделей пуст. Нечего сравнивать.")
@@ -202,12 +473,13 @@ def generate_roc_auc_plot(
     path = Path(filename)
     path.parent.mkdir(parents=True, exist_ok=True)
 
-    # Настройка графика
-    plt.figure(figsize=(10, 8))
-    plt.title(label="ROC-кривые моделей", fontsize=16)
-    plt.xlabel(xlabel="Доля ложноположительных исходов (FPR)", fontsize=12)
-    plt.ylabel(ylabel="Доля истинноположительных исходов (TPR)", fontsize=12)
-    plt.grid(visible=True, alpha=0.3)
+    # Настройка графика: собственная фигура, не текущая фигура pyplot
+    fig = Figure(figsize=(10, 8))
+    ax = fig.subplots()
+    ax.set_title(label="ROC-кривые моделей", fontsize=16)
+    ax.set_xlabel(xlabel="Доля ложноположительных исходов (FPR)", fontsize=12)
+    ax.set_ylabel(ylabel="Доля истинноположительных исходов (TPR)", fontsize=12)
+    ax.grid(visible=True, alpha=0.3)
 
     # Построение кривых
     for name, model in trained_models.items():
@@ -224,7 +496,7 @@ def generate_roc_auc_plot(
 
             fpr, tpr, _ = roc_curve(y_test, y_score)
             auc = roc_auc_score(y_test, y_score)
-            plt.plot(fpr, tpr, lw=2, label=f'{name} (AUC = {auc:.3f})')
+            ax.plot(fpr, tpr, lw=2, label=f'{name} (AUC = {auc:.3f})')
 
         except Exception as e:
             logger.critical(
@@ -233,7 +505,7 @@ def generate_roc_auc_plot(
             continue
 
     # Диагональ — случайный классификатор
-    plt.plot(
+    ax.plot(
         [0, 1], [0, 1],
         'k--',
         lw=2,
@@ -241,17 +513,16 @@ def generate_roc_auc_plot(
     )
 
     # Легенда
-    plt.legend(loc='lower right', fontsize=10)
-    plt.tight_layout()
+    ax.legend(loc='lower right', fontsize=10)
+    fig.tight_layout()
 
-    # Сохранение
-    plt.savefig(
+    # Сохранение (фигура без pyplot освобождается сборщиком мусора)
+    fig.savefig(
         filename,
         bbox_inches='tight',
         dpi=150,
         facecolor='white'
     )
-    plt.close()
 
     # Возвращаем абсолютный путь
     return str(Path(filename).resolve())
@@ -12,30 +12,199 @@
 
 Основные функции:
 - train_ensemble_model: обучение и сохранение ансамбля
+- fit_ensemble: обучение моделей ансамбля по очереди
+    с отчётом о ходе обучения
+- save_model_artifacts: сохранение модели вместе с метаданными
+    новой версией (shared/model_store.py)
 
 Автор: [Кочнева Арина]
 Год: 2025
 """
 
+from sklearn.base import clone
 from sklearn.ensemble import VotingClassifier
 from sklearn.ensemble import RandomForestClassifier
+from sklearn.preprocessing import LabelEncoder
+from sklearn.utils import Bunch
 from xgboost import XGBClassifier
 from catboost import CatBoostClassifier
-import joblib
+from sklearn.metrics import accuracy_score
 import logging
+import time
+from datetime import datetime
 
-# Импорт путей из централизованной конфигурации
-from shared.config import (
-    ENSEMBLE_MODEL_PATH,
-    FEATURE_NAMES_PATH,
-    BACKGROUND_DATA_PATH
-)
+from shared.config import DECISION_THRESHOLD
+from shared.model_store import publish_model_version
+from app.services.explainer import TREE_ARRAYS_DIR, build_tree_explainer
 
 
 logger = logging.getLogger(__name__)
 
 
-def train_ensemble_model(X, y):
+def save_model_artifacts(
+        model,
+        feature_names,
+        background_data,
+        decision_threshold=DECISION_THRESHOLD,
+        metadata=None
+):
+    """
+    Сохраняет модель и все её артефакты новой версией
+    (см. shared/model_store.py) и делает её текущей.
+
+    Сохраняются (в models/versions/<версия>/):
+        - ensemble_model.pkl — модель
+        - feature_names.pkl — список признаков
+        - background_data.pkl — подвыборка для SHAP-объяснений
+        - model_metadata.json — порог решения и прочие метаданные
+        - tree_arrays/ — массивы деревьев TreeSHAP (.npy), которые
+          воркеры API отображают в память
+
+    Args:
+        model: Обученная модель (VotingClassifier)
+        feature_names (list): Список признаков в порядке обучения
+        background_data (pd.DataFrame): Фоновые данные для SHAP
+        decision_threshold (float): Порог вероятности дефолта
+        metadata (dict): Дополнительные поля для model_metadata.json
+
+    Returns:
+        dict: Сохранённые метаданные (включая version)
+    """
+    model_metadata = {
+        **(metadata or {}),
+        "decision_threshold": float(decision_threshold),
+        "saved_at": datetime.utcnow().isoformat()
+    }
+
+    def write_tree_arrays(directory):
+        tree_explainer = build_tree_explainer(model, feature_names)
+        if tree_explainer is not None:
+            tree_explainer.save_tree_arrays(directory / TREE_ARRAYS_DIR)
+
+    version = publish_model_version(
+        model, feature_names, background_data, model_metadata,
+        write_extra=write_tree_arrays
+    )
+    return {**model_metadata, "version": version}
+
+
+def build_ensemble_estimators() -> list:
+    """
+    Создаёт необученные модели ансамбля.
+
+    Returns:
+        list: [(name, estimator), ...] в формате VotingClassifier.estimators
+    """
+    return [
+        # 1. Случайный лес — устойчив к переобучению
+        (
+            'rf',
+            RandomForestClassifier(
+                n_estimators=50,           # количество деревьев
+                random_state=42,           # воспроизводимость
+                n_jobs=-1                  # параллельная обработка
+            )
+        ),
+        # 2. XGBoost — градиентный бустинг, высокая точность
+        (
+            'xgb',
+            XGBClassifier(
+                use_label_encoder=False,   # отключаем предупреждение
+                eval_metric='logloss',     # метрика для валидации
+                random_state=42,           # воспроизводимость
+                n_jobs=-1                  # ускорение
+            )
+        ),
+        # 3. CatBoost — автоматическая обработка категориальных признаков
+        (
+            'cb',
+            CatBoostClassifier(
+                silent=True,               # отключаем вывод в консоль
+                random_state=42,           # воспроизводимость
+                #verbose=0                  # альтернатива silent
+            )
+        )
+    ]
+
+
+def assemble_voting_classifier(estimators: list, fitted: list, y):
+    """
+    Собирает обученный VotingClassifier из отдельно обученных моделей.
+
+    Заполняет те же атрибуты, что и VotingClassifier.fit, поэтому
+    результат неотличим от model.fit(X, y): predict, predict_proba
+    и SHAP-объяснения работают без изменений.
+
+    Args:
+        estimators (list): [(name, estimator), ...] — прототипы моделей
+        fitted (list): Обученные копии моделей в том же порядке
+        y (pd.Series или np.ndarray): Целевая переменная обучения
+
+    Returns:
+        VotingClassifier: Обученный ансамбль (voting='soft')
+    """
+    model = VotingClassifier(estimators=estimators, voting='soft')
+    model.le_ = LabelEncoder().fit(y)
+    model.classes_ = model.le_.classes_
+    model.estimators_ = list(fitted)
+    model.named_estimators_ = Bunch()
+    for (name, _), estimator in zip(estimators, fitted):
+        model.named_estimators_[name] = estimator
+        if hasattr(estimator, "feature_names_in_"):
+            model.feature_names_in_ = estimator.feature_names_in_
+    return model
+
+
+def fit_ensemble(X, y, on_progress=None):
+    """
+    Обучает модели ансамбля по очереди и собирает VotingClassifier.
+
+    В отличие от VotingClassifier.fit, позволяет сообщать о ходе
+    обучения по каждой модели.
+
+    Args:
+        X (pd.DataFrame): Матрица признаков
+        y (pd.Series): Целевая переменная
+        on_progress (callable): on_progress(event: dict), события:
+            {"event": "estimator_started", "estimator": "rf",
+             "index": 0, "total": 3}
+            {"event": "estimator_finished", "estimator": "rf",
+             "index": 0, "total": 3, "seconds": 1.23}
+
+    Returns:
+        VotingClassifier: Обученный ансамбль
+    """
+    estimators = build_ensemble_estimators()
+    # LabelEncoder, как в VotingClassifier.fit
+    y_encoded = LabelEncoder().fit_transform(y)
+
+    fitted = []
+    total = len(estimators)
+    for index, (name, estimator) in enumerate(estimators):
+        event = {"estimator": name, "index": index, "total": total}
+        if on_progress:
+            on_progress({"event": "estimator_started", **event})
+
+        start = time.perf_counter()
+        fitted.append(clone(estimator).fit(X, y_encoded))
+        seconds = time.perf_counter() - start
+
+        logger.info(f"✅ {name} обучен за {seconds:.1f} с")
+        if on_progress:
+            on_progress({
+                "event": "estimator_finished", **event,
+                "seconds": round(seconds, 3)
+            })
+
+    return assemble_voting_classifier(estimators, fitted, y)
+
+
+def train_ensemble_model(
+        X,
+        y,
+        decision_threshold=DECISION_THRESHOLD,
+        on_progress=None
+):
     """
     Обучает ансамблевую модель методом голосования
         (VotingClassifier).
@@ -53,17 +222,25 @@ def train_ensemble_model(X, y):
         - feature_names.pkl — список признаков (для согласованности
             при предсказании)
         - background_data.pkl — подвыборка для SHAP-объяснений
+        - model_metadata.json — порог решения
 
     Args:
         X (pd.DataFrame или np.ndarray): Матрица признаков (фичей)
         y (pd.Series или np.ndarray): Вектор целевой переменной
             (0 — repaid, 1 — default)
+        decision_threshold (float): Порог вероятности дефолта,
+            сохраняемый вместе с моделью
+        on_progress (callable): Обработчик событий обучения
+            (см. fit_ensemble); дополнительно получает
+            {"event": "saving"} перед сохранением артефактов
 
     Returns:
         dict: Результат обучения с информацией о модели и её точности:
             {
                 "model": "Ensemble (RF + XGBoost + CatBoost)",
-                "accuracy": 0.934
+                "accuracy": 0.934,
+                "decision_threshold": 0.5,
+                "version": "20250101T120000000000-a1b2c3"
             }
 
     Raises:
@@ -91,68 +268,35 @@ def train_ensemble_model(X, y):
             f"Размеры X ({len(X)}) и y ({len(y)}) не совпадают"
         )
 
-    # Определение ансамблевой модели
-    model = VotingClassifier(
-        estimators=[
-            # 1. Случайный лес — устойчив к переобучению
-            (
-                'rf',
-                RandomForestClassifier(
-                    n_estimators=50,           # количество деревьев
-                    random_state=42,           # воспроизводимость
-                    n_jobs=-1                  # параллельная обработка
-                )
-            ),
-            # 2. XGBoost — градиентный бустинг, высокая точность
-            (
-                'xgb',
-                XGBClassifier(
-                    use_label_encoder=False,   # отключаем предупреждение
-                    eval_metric='logloss',     # метрика для валидации
-                    random_state=42,           # воспроизводимость
-                    n_jobs=-1                  # ускорение
-                )
-            ),
-            # 3. CatBoost — автоматическая обработка категориальных признаков
-            (
-                'cb',
-                CatBoostClassifier(
-                    silent=True,               # отключаем вывод в консоль
-                    random_state=42,           # воспроизводимость
-                    #verbose=0                  # альтернатива silent
-                )
-            )
-        ],
-        voting='soft'  # усреднение вероятностей (лучше для интерпретируемости)
-    )
-
     # Обучение ансамбля на всех данных
     logger.info("🚀 Начало обучения ансамблевой модели...")
-    model.fit(X, y)
+    model = fit_ensemble(X, y, on_progress=on_progress)
     logger.info("✅ Модель обучена")
 
     # Сохранение компонентов
-    logger.info(f"💾 Сохранение модели: {ENSEMBLE_MODEL_PATH}")
-    joblib.dump(model, ENSEMBLE_MODEL_PATH)
-
-    logger.info(
-        f"💾 Сохранение названий признаков: {FEATURE_NAMES_PATH}"
+    if on_progress:
+        on_progress({"event": "saving"})
+    background_data = X.sample(min(100, len(X)), random_state=42)
+    saved = save_model_artifacts(
+        model,
+        X.columns.tolist(),
+        background_data,
+        decision_threshold=decision_threshold,
+        metadata={"model": "Ensemble (RF + XGBoost + CatBoost)"}
     )
-    joblib.dump(X.columns.tolist(), FEATURE_NAMES_PATH)
 
-    logger.info(
-        f"💾 Сохранение background_data: {BACKGROUND_DATA_PATH}"
+    # Оценка точности на обучающей выборке с учётом порога решения
+    proba_default = model.predict_proba(X)[:, 1]
+    accuracy = accuracy_score(
+        y, (proba_default >= decision_threshold).astype(int)
     )
-    background_data = X.sample(min(100, len(X)), random_state=42)
-    joblib.dump(background_data, BACKGROUND_DATA_PATH)
-
-    # Оценка точности на обучающей выборке
-    accuracy = model.score(X, y)
     logger.info(
         f"📊 Точность модели на обучающей выборке: {accuracy:.3f}"
     )
 
     return {
         "model": "Ensemble (RF + XGBoost + CatBoost)",
-        "accuracy": accuracy
+        "accuracy": accuracy,
+        "decision_threshold": decision_threshold,
+        "version": saved["version"]
     }
@@ -0,0 +1,227 @@
+# app/services/replay.py
+"""
+Модуль выборки базового датасета для дообучения с повторением (replay)
+
+Модуль реализует:
+- Резервуарную выборку фиксированного размера (Algorithm R),
+    пополняемую порциями без хранения всего потока
+- Сохранение выборки в сжатый .npz (закодированные признаки float32
+    и метки int8)
+- Построение выборки по credit_risk_dataset.csv один раз и повторное
+    использование, пока не изменятся датасет, признаки модели
+    или размер выборки
+
+Зачем:
+    Дообучение только на фидбэках постепенно «забывает» исходный
+    датасет. В режиме replay к новым фидбэкам добавляется эта выборка,
+    поэтому стоимость дообучения не растёт вместе с историей.
+
+Автор: [Кочнева Арина]
+Год: 2025
+"""
+
+import logging
+import os
+
+import numpy as np
+import pandas as pd
+
+from shared.config import (
+    DATA_SOURCE, REPLAY_RESERVOIR_PATH, RETRAIN_REPLAY_SAMPLE_SIZE
+)
+
+
+logger = logging.getLogger(__name__)
+
+# Размер порции чтения датасета
+_CSV_CHUNK_ROWS = 10000
+
+
+class ReplayReservoir:
+    """
+    Равномерная выборка фиксированного размера из потока строк
+    (Algorithm R).
+
+    Каждая из seen просмотренных строк попадает в выборку
+    с вероятностью capacity / seen. Порции добавляются векторно.
+
+    Args:
+        capacity (int): Размер выборки
+        n_features (int): Количество признаков
+        seed (int): Зерно генератора (воспроизводимость)
+
+    Пример:
+        >>> reservoir = ReplayReservoir(capacity=1000, n_features=27)
+        >>> for X_chunk, y_chunk in chunks:
+        ...     reservoir.add(X_chunk, y_chunk)
+        >>> X, y = reservoir.X, reservoir.y
+    """
+
+    def __init__(self, capacity: int, n_features: int, seed: int = 42):
+        self.capacity = capacity
+        self.seen = 0
+        self._X = np.empty((capacity, n_features), dtype=np.float32)
+        self._y = np.empty(capacity, dtype=np.int8)
+        self._rng = np.random.default_rng(seed)
+
+    @property
+    def size(self) -> int:
+        """Количество строк в выборке."""
+        return min(self.seen, self.capacity)
+
+    @property
+    def X(self) -> np.ndarray:
+        return self._X[:self.size]
+
+    @property
+    def y(self) -> np.ndarray:
+        return self._y[:self.size]
+
+    def add(self, X: np.ndarray, y: np.ndarray):
+        """
+        Добавляет порцию строк в поток.
+
+        Args:
+            X (np.ndarray): Признаки формы (n, n_features)
+            y (np.ndarray): Метки формы (n,)
+        """
+        n_rows = len(X)
+        # Заполнение: первые capacity строк потока попадают в выборку
+        n_fill = max(0, min(n_rows, self.capacity - self.seen))
+        if n_fill:
+            self._X[self.seen:self.seen + n_fill] = X[:n_fill]
+            self._y[self.seen:self.seen + n_fill] = y[:n_fill]
+
+        # Замещение: строка с номером t (с нуля) занимает случайный
+        # слот j ~ U[0, t], если j < capacity
+        positions = np.arange(self.seen + n_fill, self.seen + n_rows)
+        slots = (self._rng.random(len(positions)) * (positions + 1)).astype(np.int64)
+        accepted = np.flatnonzero(slots < self.capacity) + n_fill
+        if len(accepted):
+            # При повторе слота побеждает более поздняя строка потока
+            last_slots, last_index = np.unique(
+                slots[accepted - n_fill][::-1], return_index=True
+            )
+            rows = accepted[::-1][last_index]
+            self._X[last_slots] = X[rows]
+            self._y[last_slots] = y[rows]
+
+        self.seen += n_rows
+
+    def save(self, path, **metadata):
+        """
+        Сохраняет выборку в сжатый .npz (атомарно, через временный файл).
+
+        Args:
+            path (Path): Путь к файлу
+            **metadata: Дополнительные строковые поля (источник и т.п.)
+        """
+        tmp_path = path.with_name(f".{path.name}.{os.getpid()}")
+        with open(tmp_path, "wb") as f:
+            np.savez_compressed(
+                f, X=self.X, y=self.y, seen=self.seen,
+                capacity=self.capacity,
+                **{key: np.asarray(value) for key, value in metadata.items()}
+            )
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path):
+        """
+        Загружает выборку из .npz.
+
+        Returns:
+            tuple: (reservoir, metadata) — выборка и дополнительные поля
+        """
+        with np.load(path) as data:
+            X, y = data["X"], data["y"]
+            reservoir = cls(int(data["capacity"]), X.shape[1])
+            reservoir._X[:len(X)] = X
+            reservoir._y[:len(y)] = y
+            reservoir.seen = int(data["seen"])
+            metadata = {
+                key: data[key] for key in data.files
+                if key not in ("X", "y", "seen", "capacity")
+            }
+        return reservoir, metadata
+
+
+def _dataset_signature(path) -> str:
+    """Подпись датасета: имя, размер и время изменения файла."""
+    stat = path.stat()
+    return f"{path.name}:{stat.st_size}:{stat.st_mtime_ns}"
+
+
+def build_base_reservoir(encoder, capacity: int = RETRAIN_REPLAY_SAMPLE_SIZE,
+                         source=DATA_SOURCE) -> ReplayReservoir:
+    """
+    Строит выборку базового датасета, читая CSV порциями.
+
+    Args:
+        encoder (FeatureEncoder): Кодировщик признаков модели
+        capacity (int): Размер выборки
+        source (Path): Путь к CSV с колонкой loan_status
+
+    Returns:
+        ReplayReservoir: Выборка закодированных строк
+    """
+    reservoir = ReplayReservoir(capacity, encoder.n_features)
+    for chunk in pd.read_csv(source, chunksize=_CSV_CHUNK_ROWS):
+        reservoir.add(
+            encoder.transform(chunk),
+            chunk["loan_status"].to_numpy(dtype=np.int8)
+        )
+    return reservoir
+
+
+def get_base_reservoir(encoder, capacity: int = RETRAIN_REPLAY_SAMPLE_SIZE,
+                       source=DATA_SOURCE, path=REPLAY_RESERVOIR_PATH):
+    """
+    Возвращает выборку базового датасета для replay.
+
+    Выборка читается из path; она строится заново и сохраняется,
+    если файла нет или изменились датасет, признаки модели или размер.
+
+    Args:
+        encoder (FeatureEncoder): Кодировщик признаков модели
+        capacity (int): Размер выборки
+        source (Path): Путь к базовому датасету
+        path (Path): Путь к файлу выборки
+
+    Returns:
+        tuple: (X, y)
+            - X (pd.DataFrame): Признаки (float64) в порядке
+                encoder.feature_names
+            - y (pd.Series): Метки loan_status
+    """
+    signature = _dataset_signature(source)
+    reservoir = None
+
+    if path.exists():
+        try:
+            reservoir, metadata = ReplayReservoir.load(path)
+            if (
+                str(metadata.get("source")) != signature
+                or list(metadata.get("feature_names", [])) != encoder.feature_names
+                or reservoir.capacity != capacity
+            ):
+                reservoir = None
+        except Exception as e:
+            logger.warning(f"Не удалось прочитать выборку replay {path}: {e}")
+            reservoir = None
+
+    if reservoir is None:
+        logger.info(f"Построение выборки replay ({capacity} строк) по {source}")
+        reservoir = build_base_reservoir(encoder, capacity, source)
+        reservoir.save(
+            path, source=signature,
+            feature_names=np.array(encoder.feature_names)
+        )
+
+    # float32 хранится только на диске: в базовом датасете есть пропуски,
+    # а RandomForest не принимает read-only float32 с NaN (при
+    # copy-on-write pandas отдаёт именно такой массив); из float64
+    # sklearn делает собственную копию
+    X = pd.DataFrame(reservoir.X.astype(np.float64), columns=encoder.feature_names)
+    y = pd.Series(reservoir.y.astype(int), name="actual_status")
+    return X, y
@@ -3,11 +3,14 @@
 Модуль дообучения модели на основе обратной связи (feedback)
 
 Модуль реализует:
-- Загрузку фидбэков из базы данных
+- Потоковую загрузку фидбэков из базы данных порциями
 - Валидацию структуры и качества данных
 - Предобработку и выравнивание признаков
-- Дообучение ансамблевой модели (VotingClassifier)
-- Сохранение обновлённой модели и background_data
+- Инкрементальное дообучение ансамблевой модели (VotingClassifier)
+    по водяному знаку последнего учтённого фидбэка
+- Режим replay: дообучение на фидбэках вместе с выборкой
+    базового датасета
+- Сохранение обновлённой модели и background_data новой версией
 
 Используется в эндпоинте /retrain
 
@@ -15,64 +18,334 @@
 Год: 2025
 """
 
+import numpy as np
 import pandas as pd
 import joblib
 import logging
 from pathlib import Path
+from sklearn.base import clone
 from sklearn.ensemble import VotingClassifier
 from sklearn.ensemble import RandomForestClassifier
 from xgboost import XGBClassifier
 from catboost import CatBoostClassifier
 from sklearn.metrics import accuracy_score
 
-from shared.data_processing import preprocess_data_for_prediction
+from shared.data_processing import (
+    CATEGORIES, NUMERIC_FEATURES, preprocess_data_for_prediction
+)
 from shared.config import (
-    FEATURE_NAMES_PATH,
-    BACKGROUND_DATA_PATH,
-    ENSEMBLE_MODEL_PATH
+    DECISION_THRESHOLD,
+    RETRAIN_CHUNK_SIZE,
+    RETRAIN_BOOST_ROUNDS,
+    RETRAIN_RF_REBUILD_ROWS,
+    RETRAIN_REPLAY
+)
+from shared.model_store import (
+    get_artifact_path, get_current_version, load_background_data, read_metadata
+)
+from app.services.utils import get_feature_encoder
+from app.services.model_training import (
+    assemble_voting_classifier, fit_ensemble, save_model_artifacts
 )
+from app.services.replay import get_base_reservoir
 
 # Импорт ORM-модели и сессии
 from shared.models import FeedbackDB
 from sqlalchemy.orm import Session
-from sqlalchemy import select
+from sqlalchemy import func, select
 
 logger = logging.getLogger(__name__)
 
 
-def retrain_model_from_feedback(db: Session):
+# --- 📥 Потоковая загрузка фидбэков ---
+"""
+Фидбэки читаются запросом только нужных колонок (без ORM-объектов)
+порциями по RETRAIN_CHUNK_SIZE строк (yield_per) и сразу пишутся
+в заранее выделенные массивы:
+    - денежные поля (person_income, loan_amnt) — float64: суммы
+      больше 2^24 во float32 потеряли бы точность
+    - остальные числовые признаки и actual_status — float32
+      (NULL -> NaN)
+    - категориальные признаки — коды int8 (pd.Categorical)
+
+Пиковая память — около 45 байт на фидбэк плюс одна порция строк,
+вместо ORM-объекта и словаря на каждую строку.
+"""
+FEEDBACK_NUMERIC_COLUMNS = NUMERIC_FEATURES + ["actual_status"]
+FEEDBACK_FLOAT64_COLUMNS = ["person_income", "loan_amnt"]
+FEEDBACK_CATEGORICAL_COLUMNS = list(CATEGORIES)
+
+
+def load_feedback_frame(
+        db: Session,
+        after_id: int = 0,
+        until_id: int = None,
+        chunk_size: int = RETRAIN_CHUNK_SIZE
+):
+    """
+    Загружает фидбэки из БД в DataFrame порциями.
+
+    Количество строк и максимальный id определяются одним запросом
+    до чтения; строки, добавленные во время чтения, не загружаются.
+    Если строк прочитано меньше, чем подсчитано (параллельное
+    удаление), DataFrame содержит только прочитанные строки.
+
+    Args:
+        db (Session): Сессия SQLAlchemy
+        after_id (int): Загружать фидбэки с id > after_id
+            (водяной знак последнего дообучения)
+        until_id (int): Загружать фидбэки с id <= until_id
+            (None — без ограничения)
+        chunk_size (int): Размер порции строк
+
+    Returns:
+        tuple: (df, last_id)
+            - df (pd.DataFrame): Поля LoanRequest и actual_status
+              в порядке id
+            - last_id (int или None): Максимальный загруженный id
+              (None, если новых фидбэков нет)
+    """
+    conditions = [FeedbackDB.id > after_id]
+    if until_id is not None:
+        conditions.append(FeedbackDB.id <= until_id)
+
+    n_rows, last_id = db.execute(
+        select(func.count(FeedbackDB.id), func.max(FeedbackDB.id))
+        .where(*conditions)
+    ).one()
+
+    numeric = {
+        col: np.empty(
+            n_rows,
+            dtype=np.float64 if col in FEEDBACK_FLOAT64_COLUMNS else np.float32
+        )
+        for col in FEEDBACK_NUMERIC_COLUMNS
+    }
+    codes = {
+        col: np.empty(n_rows, dtype=np.int8)
+        for col in FEEDBACK_CATEGORICAL_COLUMNS
+    }
+
+    offset = 0
+    if n_rows:
+        columns = FEEDBACK_NUMERIC_COLUMNS + FEEDBACK_CATEGORICAL_COLUMNS
+        stmt = (
+            select(*(getattr(FeedbackDB, col) for col in columns))
+            .where(FeedbackDB.id > after_id, FeedbackDB.id <= last_id)
+            .order_by(FeedbackDB.id)
+            .execution_options(yield_per=chunk_size)
+        )
+        categories = {
+            col: pd.Index(CATEGORIES[col])
+            for col in FEEDBACK_CATEGORICAL_COLUMNS
+        }
+
+        for chunk in db.execute(stmt).partitions():
+            # Строки сверх подсчитанных (параллельная вставка с меньшим id)
+            # в буферы не помещаются
+            chunk = chunk[:n_rows - offset]
+            if not chunk:
+                break
+            end = offset + len(chunk)
+            values = dict(zip(columns, zip(*chunk)))
+            for col, buffer in numeric.items():
+                buffer[offset:end] = np.array(values[col], dtype=buffer.dtype)
+            for col, buffer in codes.items():
+                # Неизвестная категория или NULL -> -1 (NaN в Categorical)
+                buffer[offset:end] = categories[col].get_indexer(values[col])
+            offset = end
+
+        if offset < n_rows:
+            logger.warning(
+                f"Прочитано {offset} фидбэков из {n_rows} подсчитанных "
+                "(строки удалены во время чтения)"
+            )
+
+    # Незаполненный хвост буферов (np.empty) в DataFrame не попадает
+    df = pd.DataFrame(
+        {col: buffer[:offset] for col, buffer in numeric.items()}, copy=False
+    )
+    for col in FEEDBACK_CATEGORICAL_COLUMNS:
+        df[col] = pd.Categorical.from_codes(codes[col][:offset], CATEGORIES[col])
+    return df, last_id
+
+
+# --- 📈 Инкрементальное дообучение ---
+"""
+Дообучение учитывает только фидбэки, поступившие после предыдущего
+(водяной знак feedback_watermark — последний учтённый FeedbackDB.id
+в model_metadata.json):
+    - XGBoost и CatBoost продолжают бустинг от текущей модели
+      (xgb_model / init_model) на RETRAIN_BOOST_ROUNDS итераций
+    - RandomForest не дообучается по частям и перестраивается на всех
+      фидбэках, когда с последней перестройки накопилось не меньше
+      RETRAIN_RF_REBUILD_ROWS новых строк
+Полное переобучение ансамбля выполняется, если модели ещё нет, она
+другой структуры или запрошено явно (full=True).
+
+Режим replay (replay=True, см. app/services/replay.py): к фидбэкам
+добавляется сохранённая выборка базового датасета фиксированного
+размера, чтобы модель не «забывала» его. RF в этом режиме
+перестраивается на выборке и фидбэках с предыдущей перестройки
+(rf_watermark), поэтому стоимость дообучения не растёт с историей.
+
+Каждое дообучение добавляет в бустинги RETRAIN_BOOST_ROUNDS деревьев.
+
+Размер и баланс классов проверяются по обучающей выборке (фидбэки
+и выборка replay). Если при инкрементальном дообучении она слишком
+мала или в ней один класс (бустинг на ней невозможен), дообучение
+откладывается (status "deferred"): водяной знак не сдвигается,
+и фидбэки учитываются при следующем дообучении вместе с новыми.
+"""
+
+
+def _supports_incremental(model) -> bool:
+    """Проверяет, что модель — обученный ансамбль RF + XGBoost + CatBoost."""
+    return (
+        isinstance(model, VotingClassifier)
+        and hasattr(model, "estimators_")
+        and all(
+            isinstance(est, (RandomForestClassifier, XGBClassifier, CatBoostClassifier))
+            for est in model.estimators_
+        )
+    )
+
+
+def _continue_boosting(estimator, X, y, rounds: int):
     """
-    Переобучает ансамблевую модель на основе собранных фидбэков из БД.
+    Продолжает бустинг XGBoost или CatBoost на новых данных.
+
+    Исходная модель не изменяется: возвращается новая модель,
+    содержащая деревья исходной и rounds новых деревьев.
+    """
+    updated = clone(estimator)
+    if isinstance(estimator, XGBClassifier):
+        updated.set_params(n_estimators=rounds)
+        return updated.fit(X, y, xgb_model=estimator.get_booster())
+    updated.set_params(iterations=rounds)
+    return updated.fit(X, y, init_model=estimator)
+
+
+def _validate_feedback(df: pd.DataFrame):
+    """
+    Проверяет целевую переменную фидбэков и приводит actual_status к int.
+
+    Raises:
+        ValueError: При некорректной целевой переменной
+    """
+    # Валидация целевой переменной
+    if not pd.api.types.is_numeric_dtype(df['actual_status']):
+        raise ValueError("Колонка 'actual_status' должна быть числовой (0 или 1)")
+
+    unique_statuses = set(df['actual_status'].unique())
+    if not unique_statuses.issubset({0, 1}):
+        raise ValueError(f"Допустимые значения actual_status: 0 (repaid), 1 (default). Найдены: {unique_statuses}")
+    df['actual_status'] = df['actual_status'].astype(int)
+
+
+def _check_fit_set(y: pd.Series) -> dict:
+    """
+    Проверяет размер и баланс классов обучающей выборки.
+
+    Returns:
+        dict: Баланс классов {0: доля, 1: доля}
+
+    Raises:
+        ValueError: При недостатке данных, одном классе
+            или сильном дисбалансе классов
+    """
+    # Минимальный размер выборки
+    min_samples = 5
+    if len(y) < min_samples:
+        raise ValueError(f"Недостаточно данных для дообучения. Минимум: {min_samples}, получено: {len(y)}")
+
+    # Проверка баланса классов
+    class_ratio = y.value_counts(normalize=True).to_dict()
+    if len(class_ratio) < 2:
+        raise ValueError(f"В обучающей выборке только один класс: {class_ratio}")
+    imbalance_threshold = 0.1
+    if min(class_ratio.values()) < imbalance_threshold:
+        raise ValueError(
+            f"Сильный дисбаланс классов: {class_ratio}. "
+            f"Минимальная доля одного класса: {imbalance_threshold}"
+        )
+    return class_ratio
+
+
+def _encode_feedback(df: pd.DataFrame, encoder):
+    """
+    Разделяет фидбэки на признаки и целевую переменную.
+
+    Общий FeatureEncoder: все фидбэки кодируются за один векторизованный
+    проход (без построчных DataFrame и без чтения feature_names.pkl).
+    """
+    X = preprocess_data_for_prediction(
+        df.drop(columns=['actual_status']).reset_index(drop=True),
+        encoder=encoder
+    )
+    y = df['actual_status'].astype(int).reset_index(drop=True)
+    return X, y
+
+
+def _with_replay(X, y, encoder):
+    """Добавляет к фидбэкам выборку базового датасета."""
+    X_replay, y_replay = get_base_reservoir(encoder)
+    return (
+        pd.concat([X, X_replay], ignore_index=True),
+        pd.concat([y, y_replay], ignore_index=True)
+    )
+
+
+def retrain_model_from_feedback(db: Session, full: bool = False, replay: bool = None):
+    """
+    Дообучает ансамблевую модель на новых фидбэках из БД.
 
     Процесс включает:
-        1. Загрузку фидбэков из SQLite (таблица feedback)
+        1. Потоковую загрузку фидбэков с id больше водяного знака
         2. Валидацию структуры, типов и баланса классов
         3. Предобработку данных (OHE, feature engineering)
-        4. Выравнивание признаков с текущей моделью
-        5. Дообучение ансамбля (RF + XGBoost + CatBoost)
-        6. Сохранение модели и background_data
+            с выравниванием признаков по текущей модели
+        4. Инкрементальное дообучение (продолжение бустинга,
+            перестройка RF по накоплению данных) или полное обучение
+        5. Сохранение модели и нового водяного знака
 
     Args:
         db (Session): Сессия SQLAlchemy
+        full (bool): Переобучить ансамбль с нуля на всех фидбэках
+        replay (bool): Добавлять выборку базового датасета
+            (по умолчанию RETRAIN_REPLAY)
 
     Returns:
         dict: Результат дообучения:
             {
                 "status": "retrained",
-                "samples_used": 12,
+                "mode": "incremental",        # или "full"
+                "samples_used": 12,           # новые фидбэки
+                "rf_rebuilt": False,
+                "replay_samples": 0,          # строк базового датасета
+                "feedback_watermark": 1042,   # последний учтённый id
+                "version": "20250101T120000000000-a1b2c3",
                 "model_path": "/полный/путь/к/ensemble_model.pkl",
                 "accuracy_on_feedback": 0.917,
                 "class_balance": {0: 0.55, 1: 0.45}
             }
+        Если новых фидбэков нет — {"status": "up_to_date",
+            "samples_used": 0, "feedback_watermark": ...}
+        Если инкрементальное дообучение отложено (мало данных, один
+            класс, дисбаланс) — {"status": "deferred", "samples_used": 0,
+            "pending_samples": 3, "feedback_watermark": ..., "reason": ...}
 
     Raises:
-        ValueError: При ошибках валидации (пустые данные, дисбаланс)
+        ValueError: При ошибках валидации (пустые данные, дисбаланс
+            при полном обучении)
         Exception: При ошибках предобработки или обучения
 
     Примечания:
         - Используется soft voting для усреднения вероятностей
-        - Модель загружается из файла, дообучается и сохраняется обратно
-        - background_data обновляется для SHAP-объяснений
+        - Порог решения и прочие метаданные модели переносятся
+          от текущей модели
+        - При полном обучении background_data обновляется по фидбэкам,
+          при инкрементальном — сохраняется текущий
 
     Пример использования:
         >>> from database import SessionLocal
@@ -83,124 +356,158 @@ def retrain_model_from_feedback(db: Session):
         >>> finally:
         >>>     db.close()
     """
-    # --- 1. Загрузка фидбэков из БД ---
+    if replay is None:
+        replay = RETRAIN_REPLAY
+
+    # --- 1. Текущая модель и водяной знак ---
+    # Версия фиксируется один раз: все артефакты читаются из неё,
+    # даже если во время дообучения опубликуют другую
+    base_version = get_current_version()
+    model_path = get_artifact_path("model", base_version)
+    model = joblib.load(model_path) if model_path.exists() else None
+    metadata = read_metadata(base_version)
+    incremental = not full and _supports_incremental(model)
+    watermark = metadata.get("feedback_watermark", 0) if incremental else 0
+
+    # --- 2. Загрузка новых фидбэков из БД ---
     try:
-        stmt = select(FeedbackDB)
-        result = db.execute(stmt)
-        rows = result.scalars().all()
-
-        if not rows:
-            logger.warning("Попытка дообучения при отсутствии данных в таблице feedback")
-            raise ValueError("Нет данных в таблице feedback. Нечего дообучать.")
-
-        df = pd.DataFrame([{
-            "person_age": fb.person_age,
-            "person_income": fb.person_income,
-            "person_home_ownership": fb.person_home_ownership,
-            "person_emp_length": fb.person_emp_length,
-            "loan_intent": fb.loan_intent,
-            "loan_grade": fb.loan_grade,
-            "loan_amnt": fb.loan_amnt,
-            "loan_int_rate": fb.loan_int_rate,
-            "loan_percent_income": fb.loan_percent_income,
-            "cb_person_default_on_file": fb.cb_person_default_on_file,
-            "cb_person_cred_hist_length": fb.cb_person_cred_hist_length,
-            "actual_status": fb.actual_status
-        } for fb in rows])
-
-        logger.info(f"Загружено {len(df)} фидбэков из базы данных")
-    except ValueError:
-        # ValueError уже содержит правильное сообщение (например, "Нет данных в таблице feedback")
-        raise
+        df, last_id = load_feedback_frame(db, after_id=watermark)
+        logger.info(f"Загружено {len(df)} новых фидбэков (id > {watermark})")
     except Exception as e:
         logger.error(f"Ошибка при загрузке фидбэков из БД: {e}", exc_info=True)
         raise ValueError(f"Не удалось загрузить данные из БД: {str(e)}")
 
-    # --- 2. Валидация целевой переменной ---
-    if not pd.api.types.is_numeric_dtype(df['actual_status']):
-        raise ValueError("Колонка 'actual_status' должна быть числовой (0 или 1)")
-
-    unique_statuses = set(df['actual_status'].unique())
-    if not unique_statuses.issubset({0, 1}):
-        raise ValueError(f"Допустимые значения actual_status: 0 (repaid), 1 (default). Найдены: {unique_statuses}")
+    if df.empty:
+        if watermark:
+            logger.info("Новых фидбэков нет, модель актуальна")
+            return {
+                "status": "up_to_date",
+                "samples_used": 0,
+                "feedback_watermark": watermark
+            }
+        logger.warning("Попытка дообучения при отсутствии данных в таблице feedback")
+        raise ValueError("Нет данных в таблице feedback. Нечего дообучать.")
 
-    # --- 3. Минимальный размер выборки ---
-    min_samples = 5
-    if len(df) < min_samples:
-        raise ValueError(f"Недостаточно данных для дообучения. Минимум: {min_samples}, получено: {len(df)}")
+    # --- 3. Валидация ---
+    _validate_feedback(df)
 
-    # --- 4. Проверка баланса классов ---
-    class_ratio = df['actual_status'].value_counts(normalize=True).to_dict()
-    imbalance_threshold = 0.1
-    if len(class_ratio) == 2 and min(class_ratio.values()) < imbalance_threshold:
-        raise ValueError(
-            f"Сильный дисбаланс классов: {class_ratio}. "
-            f"Минимальная доля одного класса: {imbalance_threshold}"
-        )
+    # --- 4. Предобработка ---
+    encoder = get_feature_encoder()
+    X, y = _encode_feedback(df, encoder)
+    del df
 
-    # --- 5. Разделение признаков и целевой переменной ---
-    X_raw = df.drop(columns=['actual_status'])
-    y = df['actual_status']
-
-    # --- 6. Предобработка ---
-    X_list = []
-    for _, row in X_raw.iterrows():
-        row_df = pd.DataFrame([row])
-        processed = preprocess_data_for_prediction(row_df)
-        X_list.append(processed.iloc[0])
-    X = pd.DataFrame(X_list).reset_index(drop=True)
-
-    # --- 7. Выравнивание признаков ---
-    if FEATURE_NAMES_PATH.exists():
-        expected_features = joblib.load(FEATURE_NAMES_PATH)
+    expected_features = encoder.feature_names
+    if get_artifact_path("feature_names", base_version).exists():
         logger.info(f"Загружены ожидаемые фичи: {len(expected_features)}")
     else:
-        expected_features = X.columns.tolist()
-        joblib.dump(expected_features, FEATURE_NAMES_PATH)
-        logger.warning(f"feature_names.pkl не найден. Сохранён новый список из {len(expected_features)} фичей")
-
-    # Добавляем недостающие колонки как 0
-    for col in expected_features:
-        if col not in X.columns:
-            X[col] = 0
-    X = X[expected_features]
-
-    # --- 8. Загрузка или создание модели ---
-    if ENSEMBLE_MODEL_PATH.exists():
-        model = joblib.load(ENSEMBLE_MODEL_PATH)
-        logger.info(f"Загружена модель для дообучения: {ENSEMBLE_MODEL_PATH}")
+        logger.warning(f"feature_names.pkl не найден. Используется полный набор из {len(expected_features)} фичей")
+
+    # --- 5. Дообучение ---
+    X_fit, y_fit = _with_replay(X, y, encoder) if replay else (X, y)
+    replay_samples = len(X_fit) - len(X)
+    try:
+        class_ratio = _check_fit_set(y_fit)
+    except ValueError as e:
+        if not incremental:
+            raise
+        # Фидбэки остаются за водяным знаком и войдут
+        # в следующее дообучение вместе с новыми
+        logger.warning(f"Инкрементальное дообучение отложено: {e}")
+        return {
+            "status": "deferred",
+            "samples_used": 0,
+            "pending_samples": len(X),
+            "feedback_watermark": watermark,
+            "reason": str(e)
+        }
+    rf_watermark = metadata.get("rf_watermark", 0)
+
+    rf_rebuilt = False
+    if incremental:
+        rows_since_rebuild = metadata.get("rows_since_rf_rebuild", 0) + len(X)
+        logger.info(
+            f"Инкрементальное дообучение на {len(X_fit)} примерах "
+            f"(replay: {replay_samples}, "
+            f"+{RETRAIN_BOOST_ROUNDS} итераций бустинга)..."
+        )
+        fitted = []
+        for estimator in model.estimators_:
+            if not isinstance(estimator, RandomForestClassifier):
+                estimator = _continue_boosting(estimator, X_fit, y_fit, RETRAIN_BOOST_ROUNDS)
+            elif rows_since_rebuild >= RETRAIN_RF_REBUILD_ROWS:
+                # RF перестраивается на фидбэках до last_id: всех или,
+                # в режиме replay, с предыдущей перестройки + выборка
+                rf_df, _ = load_feedback_frame(
+                    db, after_id=rf_watermark if replay else 0, until_id=last_id
+                )
+                rf_df['actual_status'] = rf_df['actual_status'].astype(int)
+                X_rf, y_rf = _encode_feedback(rf_df, encoder)
+                del rf_df
+                if replay:
+                    X_rf, y_rf = _with_replay(X_rf, y_rf, encoder)
+                logger.info(f"Перестройка RandomForest на {len(X_rf)} примерах...")
+                estimator = clone(estimator).fit(X_rf, y_rf)
+                rows_since_rebuild = 0
+                rf_watermark = int(last_id)
+                rf_rebuilt = True
+            fitted.append(estimator)
+        model = assemble_voting_classifier(model.estimators, fitted, model.classes_)
     else:
-        logger.info("Создана новая ансамблевая модель")
-        rf = RandomForestClassifier(n_estimators=50, random_state=42)
-        xgb = XGBClassifier(use_label_encoder=False, eval_metric='logloss', random_state=42)
-        cb = CatBoostClassifier(silent=True, random_state=42)
-        model = VotingClassifier(
-            estimators=[('rf', rf), ('xgb', xgb), ('cb', cb)],
-            voting='soft'
+        logger.info(
+            f"Полное обучение ансамбля на {len(X_fit)} примерах "
+            f"(replay: {replay_samples})..."
         )
-
-    # --- 9. Дообучение ---
-    logger.info(f"Начало дообучения на {len(X)} примерах...")
-    model.fit(X, y)
-
-    # --- 10. Оценка качества ---
-    y_pred = model.predict(X)
+        model = fit_ensemble(X_fit, y_fit)
+        rows_since_rebuild = 0
+        rf_watermark = int(last_id)
+        rf_rebuilt = True
+    del X_fit, y_fit
+
+    # --- 6. Оценка качества ---
+    # Порог решения сохраняется от текущей модели
+    decision_threshold = metadata.get("decision_threshold", DECISION_THRESHOLD)
+    y_pred = (model.predict_proba(X)[:, 1] >= decision_threshold).astype(int)
     accuracy = accuracy_score(y, y_pred)
     logger.info(f"Точность на фидбэках: {accuracy:.3f}")
 
-    # --- 11. Сохранение ---
-    joblib.dump(model, ENSEMBLE_MODEL_PATH)
-    logger.info(f"Модель сохранена: {ENSEMBLE_MODEL_PATH}")
-
-    background_data = X.sample(min(100, len(X)), random_state=42)
-    joblib.dump(background_data, BACKGROUND_DATA_PATH)
-    logger.info(f"background_data обновлён: {BACKGROUND_DATA_PATH}")
-
-    # --- 12. Возврат результата ---
+    # --- 7. Сохранение ---
+    background_data = None
+    if incremental:
+        try:
+            background_data = load_background_data(
+                base_version, expected_features, mmap=False
+            )
+        except FileNotFoundError:
+            pass
+    if background_data is None:
+        background_data = X.sample(min(100, len(X)), random_state=42)
+    mode = "incremental" if incremental else "full"
+    saved = save_model_artifacts(
+        model,
+        expected_features,
+        background_data,
+        decision_threshold=decision_threshold,
+        metadata={
+            **metadata,
+            "retrained_on_feedback": len(X),
+            "retrain_mode": mode,
+            "feedback_watermark": int(last_id),
+            "rows_since_rf_rebuild": rows_since_rebuild,
+            "rf_watermark": rf_watermark
+        }
+    )
+    logger.info(f"Модель сохранена: версия {saved['version']}, водяной знак: {last_id}")
+
+    # --- 8. Возврат результата ---
     return {
         "status": "retrained",
+        "mode": mode,
         "samples_used": len(X),
-        "model_path": str(ENSEMBLE_MODEL_PATH),
+        "rf_rebuilt": rf_rebuilt,
+        "replay_samples": replay_samples,
+        "feedback_watermark": int(last_id),
+        "version": saved["version"],
+        "model_path": str(get_artifact_path("model", saved["version"])),
         "accuracy_on_feedback": accuracy,
         "class_balance": class_ratio
-    }
\ No newline at end of file
+    }
@@ -0,0 +1,426 @@
+# app/services/scheduler.py
+"""
+Модуль автоматического дообучения при накоплении фидбэков
+
+Модуль реализует:
+- Проверку условий дообучения (check_and_retrain): количество новых
+    фидбэков, возраст самого старого из них, минимальный интервал
+    между дообучениями
+- Блокировку дообучения (retrain_lock), общую для /retrain,
+    планировщика и всех воркеров API
+- Фоновый планировщик (RetrainScheduler), запускающий дообучение
+    вне обработки запросов
+
+Зачем:
+    Дообучение запускалось только вручную через /retrain. Теперь
+    планировщик сам дообучает модель, когда фидбэков достаточно
+    (RETRAIN_TRIGGER_ROWS) или они ждут слишком долго
+    (RETRAIN_TRIGGER_MAX_AGE_SECONDS).
+
+Свойства:
+    - Дообучения не пересекаются: блокировка — flock на файле
+      RETRAIN_LOCK_PATH, поэтому она действует и между воркерами
+    - Повторные сигналы (каждый POST /feedback) схлопываются
+      в одну проверку; воркер, не получивший блокировку, пропускает
+      проверку — дообучение уже идёт
+    - Не чаще раза в RETRAIN_MIN_INTERVAL_SECONDS
+    - Дообучение идёт в отдельном процессе с пониженным приоритетом
+      и ограниченным числом потоков
+    - После неудачного или отложенного дообучения планировщик ждёт
+      (пауза удваивается с каждой неудачей подряд), а не запускает
+      процесс дообучения на каждой проверке
+
+Автор: [Кочнева Арина]
+Год: 2025
+"""
+
+import logging
+import multiprocessing
+import os
+import sys
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime
+
+from sqlalchemy import func, select
+from sqlalchemy.orm import Session
+
+try:
+    import fcntl
+except ImportError:
+    # Windows: блокировка действует только внутри процесса
+    fcntl = None
+
+from shared.config import (
+    RETRAIN_LOCK_PATH,
+    RETRAIN_TRIGGER_ROWS,
+    RETRAIN_TRIGGER_MAX_AGE_SECONDS,
+    RETRAIN_MIN_INTERVAL_SECONDS,
+    RETRAIN_CHECK_INTERVAL_SECONDS,
+    RETRAIN_SCHEDULER_THREADS,
+    RETRAIN_SCHEDULER_NICENESS,
+    RETRAIN_FAILURE_BACKOFF_SECONDS,
+    RETRAIN_FAILURE_BACKOFF_MAX_SECONDS
+)
+from shared.model_store import read_metadata
+from shared.models import FeedbackDB
+from app.services.retrain import retrain_model_from_feedback
+
+
+logger = logging.getLogger(__name__)
+
+# Блокировка внутри процесса (flock защищает между процессами)
+_local_lock = threading.Lock()
+
+# Код выхода процесса дообучения, если оно отложено или фидбэки
+# не прошли валидацию (ошибка дообучения — код 1)
+DEFERRED_EXIT_CODE = 2
+
+
+class RetrainInProgress(Exception):
+    """Дообучение уже выполняется (в этом или другом процессе)."""
+
+
+# --- 🔒 Блокировка дообучения ---
+"""
+Захватывается без ожидания: если дообучение уже идёт, /retrain
+возвращает 409, а планировщик пропускает проверку.
+"""
+
+
+@contextmanager
+def retrain_lock():
+    """
+    Захватывает блокировку дообучения.
+
+    Raises:
+        RetrainInProgress: Блокировка занята
+
+    Пример:
+        >>> with retrain_lock():
+        ...     retrain_model_from_feedback(db)
+    """
+    if not _local_lock.acquire(blocking=False):
+        raise RetrainInProgress()
+    try:
+        if fcntl is None:
+            yield
+            return
+
+        RETRAIN_LOCK_PATH.parent.mkdir(parents=True, exist_ok=True)
+        with open(RETRAIN_LOCK_PATH, "a") as lock_file:
+            try:
+                fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                raise RetrainInProgress()
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+    finally:
+        _local_lock.release()
+
+
+# --- 📊 Условия дообучения ---
+"""
+Новые фидбэки — с id больше водяного знака feedback_watermark
+(см. app/services/retrain.py). Время последнего обучения — saved_at
+из model_metadata.json.
+"""
+
+
+def pending_feedback(db: Session, watermark: int = None) -> tuple:
+    """
+    Считает фидбэки, ещё не учтённые моделью.
+
+    Args:
+        db (Session): Сессия БД
+        watermark (int): Последний учтённый id
+            (по умолчанию — из метаданных модели)
+
+    Returns:
+        tuple: (count, oldest_created_at) — количество и время
+            создания самого старого (None, если новых нет)
+    """
+    if watermark is None:
+        watermark = read_metadata().get("feedback_watermark", 0)
+    return db.execute(
+        select(func.count(FeedbackDB.id), func.min(FeedbackDB.created_at))
+        .where(FeedbackDB.id > watermark)
+    ).one()
+
+
+def retrain_due_reason(db: Session, now: datetime = None):
+    """
+    Проверяет, пора ли дообучать модель.
+
+    Args:
+        db (Session): Сессия БД
+        now (datetime): Текущее время UTC (для тестов)
+
+    Returns:
+        str или None: Причина ("rows" | "age") или None,
+            если дообучать рано
+    """
+    now = now or datetime.utcnow()
+    metadata = read_metadata()
+
+    saved_at = metadata.get("saved_at")
+    if saved_at and (
+        now - datetime.fromisoformat(saved_at)
+    ).total_seconds() < RETRAIN_MIN_INTERVAL_SECONDS:
+        return None
+
+    count, oldest = pending_feedback(db, metadata.get("feedback_watermark", 0))
+    if count >= RETRAIN_TRIGGER_ROWS:
+        return "rows"
+    if count and oldest is not None and (
+        now - oldest
+    ).total_seconds() >= RETRAIN_TRIGGER_MAX_AGE_SECONDS:
+        return "age"
+    return None
+
+
+def check_and_retrain(db: Session, **retrain_kwargs):
+    """
+    Дообучает модель, если накопилось достаточно фидбэков.
+
+    Условия проверяются повторно под блокировкой: пока этот
+    процесс её ждал, модель мог дообучить другой воркер.
+
+    Args:
+        db (Session): Сессия БД
+        **retrain_kwargs: Параметры retrain_model_from_feedback
+            (full, replay)
+
+    Returns:
+        dict или None: Результат дообучения или None, если дообучать
+            рано или дообучение уже выполняется
+    """
+    if retrain_due_reason(db) is None:
+        return None
+    try:
+        with retrain_lock():
+            reason = retrain_due_reason(db)
+            if reason is None:
+                return None
+            logger.info(f"Автоматическое дообучение (причина: {reason})")
+            return retrain_model_from_feedback(db, **retrain_kwargs)
+    except RetrainInProgress:
+        logger.info("Дообучение уже выполняется — проверка пропущена")
+        return None
+
+
+# --- ⏰ Планировщик ---
+"""
+Один планировщик на воркер API; воркеры не мешают друг другу
+благодаря retrain_lock и водяному знаку фидбэков.
+"""
+
+
+def _retrain_in_process(threads: int, niceness: int):
+    """
+    Точка входа процесса автоматического дообучения.
+
+    Приоритет процесса понижается, а число потоков OpenMP/BLAS
+    и joblib ограничивается threads, чтобы обработка запросов
+    не простаивала без ядер.
+
+    Код выхода: 0 — модель дообучена или дообучать рано,
+    DEFERRED_EXIT_CODE — дообучение отложено, 1 — ошибка.
+    """
+    from threadpoolctl import threadpool_limits
+    from shared.database import SessionLocal
+    from shared.logging_config import setup_logging
+
+    setup_logging(
+        log_level=os.getenv("LOG_LEVEL", "INFO"),
+        use_json=os.getenv("USE_JSON_LOGS", "true").lower() == "true"
+    )
+    if niceness and hasattr(os, "nice"):
+        os.nice(niceness)
+    # joblib (RandomForest n_jobs=-1) берёт число ядер отсюда
+    os.environ["LOKY_MAX_CPU_COUNT"] = str(threads)
+
+    exitcode = 0
+    db = SessionLocal()
+    try:
+        with threadpool_limits(limits=threads):
+            result = check_and_retrain(db)
+        if result is not None and result["status"] == "deferred":
+            exitcode = DEFERRED_EXIT_CODE
+    except ValueError as e:
+        # Фидбэки не прошли валидацию (мало строк, один класс) —
+        # дообучение повторится, когда их станет больше
+        logger.warning(f"Автоматическое дообучение пропущено: {e}")
+        exitcode = DEFERRED_EXIT_CODE
+    except Exception as e:
+        logger.error(f"Ошибка автоматического дообучения: {e}", exc_info=True)
+        exitcode = 1
+    finally:
+        db.close()
+    sys.exit(exitcode)
+
+
+class RetrainScheduler:
+    """
+    Фоновый поток, запускающий дообучение при накоплении фидбэков.
+
+    Поток просыпается раз в check_interval секунд или по notify()
+    (например, после POST /feedback). Сигналы, пришедшие, пока идёт
+    проверка или дообучение, схлопываются в одну следующую проверку.
+
+    После неудачного или отложенного дообучения проверки пропускаются
+    RETRAIN_FAILURE_BACKOFF_SECONDS (пауза удваивается при каждой
+    неудаче подряд); пауза снимается, когда водяной знак фидбэков
+    сдвинется (например, после ручного /retrain).
+
+    Args:
+        check_interval (float): Интервал проверки, секунды
+        isolated (bool): Дообучать в отдельном процессе
+            (False — в потоке планировщика, для тестов)
+        session_factory (callable): Фабрика сессий БД
+            (используется при isolated=False)
+
+    Пример:
+        >>> scheduler = RetrainScheduler()
+        >>> scheduler.start()
+        >>> scheduler.notify()   # новый фидбэк
+        >>> scheduler.stop()
+    """
+
+    def __init__(self, check_interval: float = RETRAIN_CHECK_INTERVAL_SECONDS,
+                 isolated: bool = True, session_factory=None):
+        self.check_interval = check_interval
+        self.isolated = isolated
+        self.session_factory = session_factory
+        self._wake = threading.Event()
+        self._stopped = threading.Event()
+        self._thread = None
+        self._process = None
+        # Последняя неудача: (водяной знак, время по time.monotonic, пауза)
+        self._failure = None
+
+    def start(self):
+        """Запускает поток планировщика."""
+        if self._thread is not None:
+            return
+        self._stopped.clear()
+        self._thread = threading.Thread(
+            target=self._loop, name="retrain-scheduler", daemon=True
+        )
+        self._thread.start()
+        logger.info(
+            f"Планировщик дообучения запущен (проверка раз в {self.check_interval} с)"
+        )
+
+    def notify(self):
+        """Просит проверить условия дообучения, не дожидаясь интервала."""
+        self._wake.set()
+
+    def stop(self, timeout: float = 5.0):
+        """Останавливает планировщик и прерывает процесс дообучения."""
+        self._stopped.set()
+        self._wake.set()
+        process = self._process
+        if process is not None and process.is_alive():
+            logger.info("Остановка процесса автоматического дообучения")
+            process.terminate()
+        if self._thread is not None:
+            self._thread.join(timeout)
+            self._thread = None
+
+    def _loop(self):
+        while not self._stopped.is_set():
+            self._wake.wait(self.check_interval)
+            self._wake.clear()
+            if self._stopped.is_set():
+                break
+            try:
+                self.run_once()
+            except Exception as e:
+                logger.error(f"Ошибка автоматического дообучения: {e}", exc_info=True)
+
+    def _in_backoff(self, watermark: int, now: float) -> bool:
+        """Проверяет, не идёт ли пауза после неудачного дообучения."""
+        if self._failure is None:
+            return False
+        failed_watermark, failed_at, delay = self._failure
+        if watermark != failed_watermark:
+            # Модель дообучили в другом месте — пауза больше не нужна
+            self._failure = None
+            return False
+        return now - failed_at < delay
+
+    def _record_failure(self, watermark: int, now: float):
+        """Запоминает неудачу и удваивает паузу перед следующей попыткой."""
+        delay = RETRAIN_FAILURE_BACKOFF_SECONDS
+        if self._failure is not None and self._failure[0] == watermark:
+            delay = min(self._failure[2] * 2, RETRAIN_FAILURE_BACKOFF_MAX_SECONDS)
+        self._failure = (watermark, now, delay)
+        logger.warning(
+            f"Автоматическое дообучение не выполнено (водяной знак {watermark}), "
+            f"следующая попытка не раньше чем через {delay} с"
+        )
+
+    def run_once(self):
+        """
+        Проверяет условия и при необходимости дообучает модель.
+
+        Returns:
+            dict или None: Результат дообучения (при isolated=False)
+        """
+        now = time.monotonic()
+        watermark = read_metadata().get("feedback_watermark", 0)
+        if self._in_backoff(watermark, now):
+            return None
+
+        if not self.isolated:
+            db = self.session_factory()
+            try:
+                result = check_and_retrain(db)
+            except Exception:
+                self._record_failure(watermark, now)
+                raise
+            finally:
+                db.close()
+            if result is not None and result["status"] == "deferred":
+                self._record_failure(watermark, now)
+            elif result is not None:
+                self._failure = None
+            return result
+
+        # Дешёвая проверка в текущем процессе: процесс дообучения
+        # запускается, только если дообучать пора
+        from shared.database import SessionLocal
+
+        db = (self.session_factory or SessionLocal)()
+        try:
+            if retrain_due_reason(db) is None:
+                return None
+        finally:
+            db.close()
+
+        context = multiprocessing.get_context("spawn")
+        self._process = context.Process(
+            target=_retrain_in_process,
+            args=(RETRAIN_SCHEDULER_THREADS, RETRAIN_SCHEDULER_NICENESS),
+            name="retrain-scheduler",
+            # Не daemon: в daemon-процессе joblib отключает
+            # параллельное обучение RandomForest
+            daemon=False
+        )
+        self._process.start()
+        self._process.join()
+        exitcode = self._process.exitcode
+        self._process = None
+        if not exitcode:
+            self._failure = None
+            return None
+        if exitcode != DEFERRED_EXIT_CODE:
+            logger.error(
+                f"Процесс автоматического дообучения завершился с кодом {exitcode}"
+            )
+        self._record_failure(watermark, now)
+        return None
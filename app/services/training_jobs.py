@@ -0,0 +1,254 @@
+# app/services/training_jobs.py
+"""
+Модуль фоновых задач обучения ансамбля
+
+Модуль реализует:
+- Обучение ансамбля (train_ensemble_model) в отдельном процессе
+- Передачу хода обучения по каждой модели (стадия, время)
+    через очередь событий в статус задачи
+- Отмену задачи: процесс обучения завершается принудительно,
+    но только после того, как отмена зафиксирована в общем
+    с процессом флаге, и только если процесс ещё не начал сохранение
+
+Зачем:
+    /train-final обучал модель прямо в HTTP-запросе: соединение
+    держалось минутами, а таймаут клиента обрывал обучение.
+    Теперь эндпоинт ставит задачу в очередь (см. app/services/jobs.py)
+    и сразу возвращает job_id, а ход обучения доступен через /jobs/{id}.
+
+Обучение идёт в отдельном процессе, поэтому не конкурирует за GIL
+с обработкой запросов и может быть прервано в любой момент
+(кроме сохранения артефактов модели).
+
+Автор: [Кочнева Арина]
+Год: 2025
+"""
+
+import logging
+import multiprocessing
+import os
+import queue
+import threading
+
+from app.services.jobs import JobCancelled, is_cancel_requested
+
+
+logger = logging.getLogger(__name__)
+
+# Интервал опроса очереди событий и маркера отмены, секунды
+EVENT_POLL_SECONDS = 0.5
+
+# Состояние процесса обучения в общем флаге (multiprocessing.Value).
+# Переходы TRAINING -> CANCEL_REQUESTED (родитель) и TRAINING -> SAVING
+# (процесс) выполняются под блокировкой флага, поэтому взаимоисключающие:
+# процесс, начавший сохранение, не прерывается, а отменённый
+# процесс не начинает сохранение
+STATE_TRAINING = 0
+STATE_CANCEL_REQUESTED = 1
+STATE_SAVING = 2
+
+# Запущенные процессы обучения (для остановки при завершении API)
+_processes = set()
+_processes_lock = threading.Lock()
+
+
+class TrainingCancelled(Exception):
+    """Процесс обучения увидел запрос отмены и не стал сохранять модель."""
+
+
+def _progress_reporter(state, events):
+    """
+    Обработчик событий обучения в процессе обучения.
+
+    Между моделями проверяет запрос отмены, а перед сохранением
+    переводит флаг в STATE_SAVING. Затем событие отправляется
+    в очередь events.
+
+    Raises:
+        TrainingCancelled: Если родитель уже запросил отмену
+    """
+    def report(event: dict):
+        with state.get_lock():
+            if state.value == STATE_CANCEL_REQUESTED:
+                raise TrainingCancelled()
+            if event["event"] == "saving":
+                state.value = STATE_SAVING
+        events.put(event)
+
+    return report
+
+
+def _claim_cancel(state) -> bool:
+    """
+    Фиксирует отмену в общем флаге, если процесс ещё не сохраняет модель.
+
+    Returns:
+        bool: True — процесс уже не начнёт сохранение, его можно
+            завершить; False — идёт сохранение, прерывать нельзя
+    """
+    with state.get_lock():
+        if state.value == STATE_SAVING:
+            return False
+        state.value = STATE_CANCEL_REQUESTED
+        return True
+
+
+def _train_in_process(X, y, decision_threshold, state, events):
+    """
+    Точка входа процесса обучения.
+
+    Все события (ход обучения, результат, ошибка, отмена)
+    отправляются в очередь events; статус задачи обновляет
+    родительский процесс.
+    """
+    from shared.logging_config import setup_logging
+    from app.services.model_training import train_ensemble_model
+
+    setup_logging(
+        log_level=os.getenv("LOG_LEVEL", "INFO"),
+        use_json=os.getenv("USE_JSON_LOGS", "true").lower() == "true"
+    )
+
+    try:
+        result = train_ensemble_model(
+            X, y, decision_threshold,
+            on_progress=_progress_reporter(state, events)
+        )
+        events.put({"event": "done", "result": result})
+    except TrainingCancelled:
+        events.put({"event": "cancelled"})
+    except Exception as e:
+        events.put({"event": "error", "error": str(e)})
+
+
+def make_training_task(X, y, decision_threshold):
+    """
+    Создаёт задачу обучения ансамбля для ReportJobQueue.
+
+    Поток очереди запускает процесс обучения, переносит его события
+    в статус задачи и следит за маркером отмены. Статус содержит
+    поле progress:
+        {
+            "estimators": [
+                {"name": "rf", "status": "done", "seconds": 4.2},
+                {"name": "xgb", "status": "running", "seconds": None},
+                ...
+            ],
+            "completed": 1,
+            "total": 3
+        }
+
+    Args:
+        X (pd.DataFrame): Матрица признаков
+        y (pd.Series): Целевая переменная
+        decision_threshold (float): Порог решения для метаданных модели
+
+    Returns:
+        callable: task(directory, set_stage) -> dict
+            (результат train_ensemble_model)
+    """
+    def task(directory, set_stage):
+        # spawn: fork процесса API с запущенными потоками
+        # и инициализированным OpenMP может зависнуть
+        context = multiprocessing.get_context("spawn")
+        events = context.Queue()
+        state = context.Value("i", STATE_TRAINING)
+        process = context.Process(
+            target=_train_in_process,
+            args=(X, y, decision_threshold, state, events),
+            name=f"train-{directory.name}",
+            # Не daemon: в daemon-процессе joblib отключает
+            # параллельное обучение RandomForest (n_jobs=1)
+            daemon=False
+        )
+        progress = {"estimators": [], "completed": 0, "total": None}
+        # Сохранение артефактов не прерывается: иначе на диске
+        # может остаться несогласованный набор файлов модели.
+        # Стадии обучения не проверяют отмену сами (cancellable=False):
+        # она принимается только через общий флаг (_claim_cancel)
+        saving = False
+
+        set_stage("starting", progress=progress)
+        process.start()
+        with _processes_lock:
+            _processes.add(process)
+        try:
+            while True:
+                # Если процесс завершился до get(), все его события
+                # уже в очереди
+                alive = process.is_alive()
+                try:
+                    event = events.get(timeout=EVENT_POLL_SECONDS)
+                except queue.Empty:
+                    # Событие saving может ещё не дойти через очередь,
+                    # поэтому решение об отмене принимается по общему
+                    # флагу: процесс, уже начавший сохранение, не
+                    # прерывается
+                    if not saving and is_cancel_requested(directory):
+                        if _claim_cancel(state):
+                            raise JobCancelled()
+                        saving = True
+                        set_stage("saving", cancellable=False, progress=progress)
+                    if not alive:
+                        raise RuntimeError(
+                            "Процесс обучения завершился без результата "
+                            f"(код {process.exitcode})"
+                        )
+                    continue
+
+                kind = event["event"]
+                if kind == "done":
+                    return event["result"]
+                if kind == "error":
+                    raise RuntimeError(event["error"])
+                if kind == "cancelled":
+                    raise JobCancelled()
+
+                if kind == "estimator_started":
+                    progress["total"] = event["total"]
+                    progress["estimators"].append({
+                        "name": event["estimator"],
+                        "status": "running",
+                        "seconds": None
+                    })
+                    set_stage(f"fitting:{event['estimator']}", cancellable=False,
+                              progress=progress)
+                elif kind == "estimator_finished":
+                    progress["estimators"][event["index"]].update(
+                        status="done", seconds=event["seconds"]
+                    )
+                    progress["completed"] = event["index"] + 1
+                    set_stage(f"fitted:{event['estimator']}", cancellable=False,
+                              progress=progress)
+                elif kind == "saving":
+                    # Сначала запрет отмены: процесс уже публикует версию
+                    saving = True
+                    set_stage("saving", cancellable=False, progress=progress)
+        finally:
+            # Во время сохранения процесс не прерывается ни при какой
+            # ошибке: join дожидается окончания публикации версии.
+            # Иначе отмена сначала фиксируется во флаге, и процесс
+            # уже не может начать сохранение до terminate()
+            if _claim_cancel(state) and process.is_alive():
+                logger.info(f"Остановка процесса обучения {process.name}")
+                process.terminate()
+            process.join()
+            with _processes_lock:
+                _processes.discard(process)
+
+    return task
+
+
+def terminate_training_processes():
+    """
+    Останавливает все запущенные процессы обучения.
+
+    Вызывается при остановке API: иначе завершение ждало бы
+    окончания обучения. Задачи получают статус failed.
+    """
+    with _processes_lock:
+        processes = list(_processes)
+    for process in processes:
+        if process.is_alive():
+            logger.info(f"Остановка процесса обучения {process.name}")
+            process.terminate()
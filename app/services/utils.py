@@ -7,11 +7,14 @@
 - Прогнозирование статуса кредита
 - Объяснение решения с помощью SHAP
 - Генерацию графиков и текстовых объяснений
+- Прогрев модели при старте API
 
 Особенности:
-- Поддержка VotingClassifier через callable-обёртку
-- Кэширование модели для производительности
-- Генерация waterfall-графика SHAP
+- Точный TreeSHAP для ансамбля деревьев (app/services/explainer.py)
+- Поддержка прочих моделей через callable-обёртку
+- Кэширование модели и горячая замена при публикации новой версии
+- Общая память модели для воркеров (предзагрузка до fork, mmap)
+- Генерация waterfall-графика SHAP по запросу (PNG / SVG)
 - Сохранение графика для PDF-отчётов
 
 Автор: [Кочнева Арина]
@@ -25,77 +28,314 @@ import numpy as np
 import shap
 import matplotlib.pyplot as plt
 import base64
+import gc
 from io import BytesIO
 import logging
+import threading
+import time
 
 # Импорт компонентов системы
-from shared.data_processing import preprocess_data_for_prediction
+from shared.data_processing import (
+    FeatureEncoder, load_feature_encoder, preprocess_data_for_prediction
+)
+from app.services.explainer import TREE_ARRAYS_DIR, build_tree_explainer
+from app.services.cache import ExplanationCache, make_cache_key
 from shared.config import (
-    ENSEMBLE_MODEL_PATH, FEATURE_NAMES_PATH, BACKGROUND_DATA_PATH,
-    IMAGES_DIR
+    DECISION_THRESHOLD, EXPLANATION_CACHE_MAX_BYTES,
+    MODEL_WARMUP_INFERENCES, MODEL_WARMUP_BATCH_ROWS, MODEL_MMAP
+)
+from shared.model_store import (
+    get_artifact_path, get_current_version, get_model_dir,
+    load_background_data, read_metadata
 )
 
 
 logger = logging.getLogger(__name__)
 
 
-# --- 🧠 Глобальные переменные для кэширования ---
+# --- 🧠 Кэширование модели ---
 """
-Кэширование модели, фичей и background_data
-для ускорения повторных вызовов.
-Загружается один раз при первом вызове.
+Модель, фичи, кодировщик, background_data, порог решения и
+SHAP-объяснители одной версии модели хранятся вместе в ModelBundle.
+Текущий набор — одна глобальная ссылка _bundle.
+
+На каждом запросе читается CURRENT (см. shared/model_store.py).
+Если опубликована новая версия, один поток загружает её и заменяет
+ссылку, а остальные тем временем обслуживают запросы прежней
+версией: запрос, начатый со старым набором, до конца работает с ним.
 """
-_model = None
-_feature_names = None
-_background_data = None
+_bundle = None
+_bundle_lock = threading.Lock()
+# Версия, загрузить которую не удалось (не повторять на каждом запросе)
+_failed_version = None
 
+# Кэш объяснений: SHAP-значения, текст и графики по хэшу запроса
+_explanation_cache = ExplanationCache(max_bytes=EXPLANATION_CACHE_MAX_BYTES)
+# Оценка размера записи без графиков (словари, строки summary)
+_CACHE_ENTRY_OVERHEAD = 4096
 
-def _load_model():
+
+class ModelBundle:
     """
-    Загружает модель, названия фичей и background_data один
-    раз и кэширует их.
+    Артефакты одной версии модели, загруженные в память.
 
-    Реализует паттерн Singleton: при повторных вызовах возвращает
-    закэшированные объекты.
+    Набор не меняется после создания (кроме ленивого shap_explainer),
+    поэтому его можно использовать из нескольких потоков.
 
-    Returns:
-        tuple: (model, feature_names, background_data)
+    Args:
+        version (str): Версия модели
+        model: Модель (VotingClassifier)
+        feature_names (list): Признаки в порядке обучения
+        background_data (pd.DataFrame): Фоновые данные для SHAP
+        metadata (dict): Содержимое model_metadata.json
+    """
 
-    Raises:
-        FileNotFoundError: Если модель или данные не найдены
-        Exception: При ошибках десериализации
+    def __init__(self, version, model, feature_names, background_data, metadata):
+        self.version = version
+        self.model = model
+        self.feature_names = feature_names
+        self.background_data = background_data
+        self.metadata = metadata
+        self.encoder = FeatureEncoder(feature_names)
+        self.decision_threshold = metadata.get(
+            "decision_threshold", DECISION_THRESHOLD
+        )
+        # Объяснители строятся один раз на версию модели:
+        # TreeSHAP — сразу, shap.Explainer — лениво при первом запросе
+        self.tree_explainer = build_tree_explainer(model, feature_names)
+        self.shap_explainer = None
+
+    @classmethod
+    def load(cls, version: str):
+        """
+        Загружает артефакты версии с диска.
+
+        Args:
+            version (str): Версия (см. _current_version)
+
+        Returns:
+            ModelBundle: Загруженный набор
+        """
+        store_version = None if version.startswith(_LEGACY_PREFIX) else version
+        model_path = get_artifact_path("model", store_version)
+        logger.info(f"📥 Загрузка модели: {model_path}")
+        model = joblib.load(model_path)
+        feature_names = joblib.load(get_artifact_path("feature_names", store_version))
+        background_data = load_background_data(store_version, feature_names)
+        bundle = cls(
+            version, model, feature_names, background_data,
+            read_metadata(store_version)
+        )
 
-    Примечания:
-        - Используется для ускорения прогнозирования
-        - Пути задаются в shared/config.py
+        # Массивы деревьев TreeSHAP сохраняются в .npy при публикации
+        # версии (см. save_model_artifacts); здесь они только отображаются
+        # в память, версия на диске не изменяется
+        if MODEL_MMAP and store_version is not None and bundle.tree_explainer is not None:
+            try:
+                mapped_bytes = bundle.tree_explainer.memory_map(
+                    get_model_dir(store_version) / TREE_ARRAYS_DIR
+                )
+                if mapped_bytes:
+                    logger.info(
+                        f"🗺️ Массивы деревьев TreeSHAP отображены в память: "
+                        f"{mapped_bytes / 1e6:.1f} МБ"
+                    )
+                else:
+                    logger.info(
+                        "Массивы деревьев TreeSHAP в версии не сохранены — "
+                        "остаются в памяти процесса"
+                    )
+            except OSError as e:
+                logger.warning(f"Массивы деревьев остаются в памяти процесса: {e}")
+        return bundle
+
+
+# Версии плоской раскладки (до первой опубликованной версии)
+_LEGACY_PREFIX = "legacy-"
+
+
+def _current_version():
     """
-    global _model, _feature_names, _background_data
+    Возвращает текущую версию модели: содержимое CURRENT или,
+    в плоской раскладке, время изменения ensemble_model.pkl.
 
-    if _model is None:
-        try:
-            logger.info(f"📥 Загрузка модели: {ENSEMBLE_MODEL_PATH}")
-            _model = joblib.load(ENSEMBLE_MODEL_PATH)
+    Returns:
+        str или None: Версия или None, если модели нет
+    """
+    version = get_current_version()
+    if version is not None:
+        return version
+    try:
+        return f"{_LEGACY_PREFIX}{get_artifact_path('model').stat().st_mtime_ns}"
+    except FileNotFoundError:
+        return None
 
-            logger.info(
-                f"📥 Загрузка названий фичей: {FEATURE_NAMES_PATH}"
-            )
-            _feature_names = joblib.load(FEATURE_NAMES_PATH)
 
-            logger.info(
-                f"📥 Загрузка background_data: {BACKGROUND_DATA_PATH}"
-            )
-            _background_data = joblib.load(BACKGROUND_DATA_PATH)
+def _swap_bundle(version: str) -> ModelBundle:
+    """Загружает версию и публикует её одной заменой ссылки."""
+    global _bundle, _failed_version
 
-            logger.info(
-                f"✅ Модель загружена: {_model.__class__.__name__}"
-            )
+    if version is None:
+        raise FileNotFoundError(get_artifact_path("model"))
+    try:
+        bundle = ModelBundle.load(version)
+    except Exception:
+        _failed_version = version
+        raise
+    _bundle = bundle
+    _failed_version = None
+    # Объяснения прежней модели больше не нужны
+    _explanation_cache.clear()
+    logger.info(
+        f"✅ Модель загружена: {bundle.model.__class__.__name__}, "
+        f"версия {bundle.version}, порог решения: {bundle.decision_threshold}"
+    )
+    return bundle
+
+
+def get_model_bundle() -> ModelBundle:
+    """
+    Возвращает загруженную текущую версию модели.
+
+    При первом вызове модель загружается (остальные потоки ждут).
+    Если затем опубликована новая версия, её загружает один поток,
+    а остальные продолжают работать с прежней; если новую версию
+    загрузить не удалось, обслуживание продолжается прежней.
+
+    Returns:
+        ModelBundle: Артефакты текущей версии
 
+    Raises:
+        FileNotFoundError: Если модель не найдена
+        Exception: При ошибках десериализации
+    """
+    bundle = _bundle
+    version = _current_version()
+    if bundle is not None and version in (bundle.version, _failed_version, None):
+        return bundle
+
+    if bundle is not None:
+        # Модель уже есть: не ждём, если новую версию загружает
+        # другой поток
+        if not _bundle_lock.acquire(blocking=False):
+            return bundle
+        try:
+            if _bundle is not bundle:
+                return _bundle
+            logger.info(f"🔄 Опубликована новая версия модели: {version}")
+            return _swap_bundle(version)
+        except Exception as e:
+            logger.error(f"Не удалось загрузить версию модели {version}: {e}")
+            return bundle
+        finally:
+            _bundle_lock.release()
+
+    with _bundle_lock:
+        if _bundle is not None:
+            return _bundle
+        try:
+            return _swap_bundle(version)
         except FileNotFoundError as e:
             raise FileNotFoundError(f"Файл не найден: {e}")
         except Exception as e:
             raise Exception(f"Ошибка при загрузке модели: {e}")
 
-    return _model, _feature_names, _background_data
+
+def get_loaded_model_version():
+    """
+    Возвращает версию загруженной модели, не загружая её.
+
+    Returns:
+        str или None: Версия или None, если модель ещё не загружена
+    """
+    bundle = _bundle
+    return bundle.version if bundle is not None else None
+
+
+# --- 🧩 Предзагрузка до fork ---
+"""
+При MODEL_PRELOAD gunicorn импортирует приложение в мастер-процессе
+(preload_app, см. gunicorn.conf.py), и модель загружается там до
+создания воркеров. Воркеры наследуют загруженный набор, и его
+страницы памяти общие, пока не изменены (copy-on-write).
+
+В мастере модель только загружается: прогнозы (и пулы потоков
+OpenMP, которые не переживают fork) запускаются уже в воркерах.
+"""
+
+
+def preload_model():
+    """
+    Загружает текущую версию модели в мастер-процессе до fork.
+
+    Загруженные объекты переносятся в постоянное поколение GC
+    (gc.freeze): сборщик мусора в воркерах их не обходит и не
+    копирует ради этого страницы памяти.
+
+    Returns:
+        str или None: Загруженная версия или None, если модели нет
+    """
+    try:
+        bundle = get_model_bundle()
+    except FileNotFoundError as e:
+        logger.warning(f"Предзагрузка модели пропущена: {e}")
+        return None
+    gc.collect()
+    gc.freeze()
+    logger.info(f"📦 Модель {bundle.version} загружена до запуска воркеров")
+    return bundle.version
+
+
+def load_model_metadata() -> dict:
+    """
+    Читает model_metadata.json текущей версии модели.
+
+    Returns:
+        dict: Метаданные модели или пустой словарь, если файла нет
+            (модели, обученные до появления метаданных)
+    """
+    return read_metadata()
+
+
+def _predict_from_proba(proba: np.ndarray, threshold: float) -> np.ndarray:
+    """
+    Переводит вероятности ансамбля в метки по порогу решения модели.
+
+    Args:
+        proba (np.ndarray): Результат predict_proba формы (n, 2)
+        threshold (float): Порог вероятности дефолта
+
+    Returns:
+        np.ndarray: Метки 0 (repaid) / 1 (default)
+    """
+    return (proba[:, 1] >= threshold).astype(int)
+
+
+def get_explanation_cache_stats() -> dict:
+    """
+    Возвращает статистику кэша объяснений (для /metrics).
+
+    Returns:
+        dict: entries, bytes, max_bytes, hits, misses, evictions, hit_rate
+    """
+    return _explanation_cache.stats()
+
+
+def get_feature_encoder() -> FeatureEncoder:
+    """
+    Возвращает общий FeatureEncoder текущей версии модели.
+
+    Если текущая версия уже загружена, возвращается кодировщик
+    из ModelBundle. Иначе он строится по feature_names.pkl (или по
+    полному набору фичей, если файла ещё нет).
+
+    Returns:
+        FeatureEncoder: Кодировщик фичей текущей модели
+    """
+    bundle = _bundle
+    if bundle is not None and bundle.version == _current_version():
+        return bundle.encoder
+    return load_feature_encoder()
 
 
 def predict_loan_status(input_df: pd.DataFrame) -> dict:
@@ -103,6 +343,10 @@ def predict_loan_status(input_df: pd.DataFrame) -> dict:
     Выполняет прогноз статуса кредита с использованием ансамблевой
     модели.
 
+    Вызывает predict_proba один раз; метка определяется порогом
+    решения из model_metadata.json (по умолчанию DECISION_THRESHOLD),
+    а не неявным порогом 0.5 внутри VotingClassifier.
+
     Args:
         input_df (pd.DataFrame): Входные данные одного заемщика
 
@@ -133,16 +377,17 @@ def predict_loan_status(input_df: pd.DataFrame) -> dict:
         }
     """
     try:
-        model, feature_names, _ = _load_model()
+        bundle = get_model_bundle()
 
-        # Предобработка
-        input_processed = preprocess_data_for_prediction(input_df)
-        # Выравнивание
-        input_processed = input_processed[feature_names]
+        # Предобработка и выравнивание по фичам модели
+        input_processed = preprocess_data_for_prediction(
+            input_df, encoder=bundle.encoder
+        )
 
-        # Предсказание
-        pred = model.predict(input_processed)[0]
-        proba = model.predict_proba(input_processed)[0]
+        # Один проход ансамбля: метка выводится из вероятностей по порогу
+        proba_all = bundle.model.predict_proba(input_processed)
+        pred = _predict_from_proba(proba_all, bundle.decision_threshold)[0]
+        proba = proba_all[0]
 
         return {
             "prediction": int(pred),
@@ -154,16 +399,288 @@ def predict_loan_status(input_df: pd.DataFrame) -> dict:
         raise ValueError(f"Ошибка при предсказании: {str(e)}")
 
 
-def explain_prediction(input_data: dict) -> dict:
+def predict_loan_status_batch(input_df: pd.DataFrame,
+                              skip_invalid: bool = False) -> list:
+    """
+    Выполняет пакетный прогноз статуса кредита для нескольких
+    заемщиков.
+
+    Предобработка и predict_proba выполняются один раз для всей
+    матрицы, поэтому накладные расходы на одного заемщика намного
+    ниже, чем при последовательных вызовах predict_loan_status.
+
+    Args:
+        input_df (pd.DataFrame): Данные заемщиков (строка = заемщик)
+        skip_invalid (bool): Строки с бесконечными или пропущенными
+            фичами (например, person_income=0 даёт бесконечное
+            отношение) не скорятся, а получают {"error": ...};
+            иначе такая строка отклоняет весь пакет (ValueError)
+
+    Returns:
+        list: Результаты в порядке строк input_df:
+            [
+                {
+                    "prediction": 0 или 1,
+                    "probability_repaid": float,
+                    "probability_default": float
+                },
+                {"error": "..."},  # только при skip_invalid=True
+                ...
+            ]
+
+    Raises:
+        ValueError: При ошибках предобработки или предсказания
+
+    Примечания:
+        - Метка выводится из вероятности дефолта по порогу решения,
+          сохранённому вместе с моделью
+    """
+    if input_df.empty:
+        return []
+
+    try:
+        bundle = get_model_bundle()
+
+        # Предобработка всей матрицы за один проход
+        input_processed = preprocess_data_for_prediction(
+            input_df, encoder=bundle.encoder
+        )
+
+        # Строки с inf/NaN модель не принимает: без skip_invalid
+        # они отклоняют весь пакет, иначе — только себя
+        values = np.asarray(input_processed, dtype=np.float64)
+        finite = np.isfinite(values).all(axis=1)
+        if not finite.all() and not skip_invalid:
+            raise ValueError(
+                f"некорректные фичи в строках {np.flatnonzero(~finite).tolist()}"
+            )
+
+        results = [None] * len(finite)
+        if finite.any():
+            # Один вызов ансамбля на все корректные строки
+            valid = input_processed if finite.all() else input_processed[finite]
+            proba = bundle.model.predict_proba(valid)
+            predictions = _predict_from_proba(proba, bundle.decision_threshold)
+            for position, pred, p in zip(np.flatnonzero(finite), predictions, proba):
+                results[position] = {
+                    "prediction": int(pred),
+                    "probability_repaid": float(p[0]),
+                    "probability_default": float(p[1])
+                }
+
+        for position in np.flatnonzero(~finite):
+            bad = [
+                name for name, ok in zip(bundle.feature_names, np.isfinite(values[position]))
+                if not ok
+            ]
+            results[position] = {
+                "error": f"Некорректные значения фичей (inf/NaN): {', '.join(bad)}"
+            }
+        return results
+
+    except Exception as e:
+        raise ValueError(f"Ошибка при пакетном предсказании: {str(e)}")
+
+
+def _explain_with_permutation(bundle: ModelBundle, input_processed):
+    """
+    Модельно-агностическое объяснение через shap.Explainer.
+
+    Используется, если модель не является ансамблем деревьев
+    с soft voting и EnsembleTreeExplainer построить нельзя.
+    Объяснитель кэшируется в bundle.shap_explainer, то есть
+    отдельно для каждой версии модели.
+
+    Returns:
+        tuple: (shap_vals, base_value) для класса "дефолт" (1)
+    """
+    model, feature_names = bundle.model, bundle.feature_names
+
+    if bundle.shap_explainer is None:
+        # Создание callable-обёртки для ансамбля
+        def model_predict_proba(X):
+            """
+            Обёртка, преобразующая VotingClassifier в вызываемую
+            функцию.
+            Требуется, так как SHAP не поддерживает VotingClassifier
+            напрямую.
+            """
+            if isinstance(X, np.ndarray):
+                X = pd.DataFrame(X, columns=feature_names)
+            return model.predict_proba(X)
+
+        bundle.shap_explainer = shap.Explainer(
+            model_predict_proba,
+            bundle.background_data
+        )
+
+    shap_values = bundle.shap_explainer(input_processed)
+
+    # Извлечение значений для класса "дефолт" (1)
+    if len(shap_values.output_names) == 2:
+        shap_vals = shap_values.values[:, :, 1].flatten()
+        base_value = float(shap_values.base_values[0][1])
+    else:
+        shap_vals = shap_values.values.flatten()
+        base_value = float(shap_values.base_values[0])
+
+    return shap_vals, base_value
+
+
+# --- 🖼 Рендеринг waterfall-графика ---
+"""
+Допустимые значения параметра render:
+- none — только числа, matplotlib не вызывается
+- png — PNG в base64 (по умолчанию, как раньше)
+- svg — SVG-разметка
+- both — PNG и SVG из одного и того же графика
+"""
+RENDER_MODES = ("none", "png", "svg", "both")
+
+# pyplot хранит глобальное состояние, а эндпоинты выполняются
+# в пуле потоков — график строится под блокировкой
+_plot_lock = threading.Lock()
+
+
+def _render_waterfall(explanation: shap.Explanation, formats: tuple) -> dict:
+    """
+    Строит waterfall-график один раз и кодирует его во все
+    запрошенные форматы с одного и того же холста.
+
+    Args:
+        explanation (shap.Explanation): Объяснение одной строки
+        formats (tuple): Форматы для savefig ("png", "svg")
+
+    Returns:
+        dict: {формат: bytes}
+
+    Raises:
+        ValueError: При ошибках построения графика
+    """
+    images = {}
+    with _plot_lock:
+        plt.figure(figsize=(8, 6))
+        try:
+            shap.waterfall_plot(explanation, show=False)
+            # waterfall_plot рисует на текущей фигуре и меняет её размер
+            fig = plt.gcf()
+            for fmt in formats:
+                buf = BytesIO()
+                fig.savefig(
+                    buf,
+                    format=fmt,
+                    bbox_inches='tight',
+                    dpi=150,
+                    facecolor='white'
+                )
+                images[fmt] = buf.getvalue()
+        except Exception as e:
+            raise ValueError(
+                f"Ошибка при построении waterfall: {str(e)}"
+            )
+        finally:
+            plt.close('all')
+    return images
+
+
+def _compute_explanation(bundle: ModelBundle, input_data: dict) -> dict:
+    """
+    Считает SHAP-значения, прогноз и текстовое объяснение одного
+    заемщика (без графиков).
+
+    Returns:
+        dict: Запись кэша объяснений:
+            {
+                "result": dict,   # ответ explain_prediction без графиков
+                "plot": tuple,    # (shap_vals, base_value, data) для waterfall
+                "images": dict    # {"png": base64, "svg": str}, заполняется лениво
+            }
+    """
+    # 2. Предобработка данных
+    input_processed = bundle.encoder.transform_frame([input_data])
+
+    if bundle.tree_explainer is not None:
+        # 3-6. Точный TreeSHAP по моделям ансамбля
+        # (вклады уже в пространстве вероятности дефолта)
+        values, base_value = bundle.tree_explainer.explain(input_processed)
+        shap_vals = values[0]
+    else:
+        shap_vals, base_value = _explain_with_permutation(
+            bundle, input_processed
+        )
+
+    # 7. Предсказание (один вызов predict_proba)
+    proba_all = bundle.model.predict_proba(input_processed)
+    prediction = _predict_from_proba(proba_all, bundle.decision_threshold)[0]
+    prediction_proba = proba_all[0]
+
+    # 8. Топ-5 признаков по абсолютному вкладу
+    top_features = sorted(
+        zip(bundle.feature_names, shap_vals),
+        key=lambda x: abs(x[1]),
+        reverse=True
+    )[:5]
+
+    result = {
+        "prediction": int(prediction),
+        "status": "repaid" if prediction == 0 else "default",
+        "decision": "approve" if prediction == 0 else "reject",
+        "probability_repaid": float(prediction_proba[0]),
+        "probability_default": float(prediction_proba[1]),
+        "explanation": {
+            "base_value": base_value,
+            "shap_values": [
+                {"feature": name, "value": float(val)}
+                for name, val in top_features
+            ],
+            "summary": [
+                f"{name}: {'↑ риск' if val > 0 else '↓ риск'} ({val:+.3f})"
+                for name, val in top_features
+            ]
+        }
+    }
+
+    return {
+        "result": result,
+        "plot": (
+            np.asarray(shap_vals), base_value,
+            input_processed.iloc[0].to_numpy()
+        ),
+        "images": {}
+    }
+
+
+def _cache_entry_size(entry: dict) -> int:
+    """Оценка размера записи кэша объяснений в байтах."""
+    shap_vals, _, data = entry["plot"]
+    return (
+        _CACHE_ENTRY_OVERHEAD
+        + shap_vals.nbytes + data.nbytes
+        + sum(len(image) for image in entry["images"].values())
+    )
+
+
+def explain_prediction(
+        input_data: dict,
+        render: str = "png",
+        image_path=None,
+        use_cache: bool = True
+) -> dict:
     """
     Генерирует интерпретируемое объяснение решения модели
     с помощью SHAP.
 
-    Поддерживает ансамбль (VotingClassifier) через создание
-    callable-обёртки.
+    Для ансамбля деревьев с soft voting используется точный TreeSHAP
+    по каждой модели (EnsembleTreeExplainer), построенный при загрузке
+    модели. Для остальных моделей — shap.Explainer с callable-обёрткой.
 
     Args:
         input_data (dict): Данные заемщика в формате словаря
+        render (str): Формат графика: none / png / svg / both
+        image_path (str or Path): Куда сохранить PNG для PDF-отчёта
+            (директория артефакта отчёта; требует render png или both)
+        use_cache (bool): Читать и пополнять кэш объяснений
+            (False — для прогрева, чтобы не искажать статистику кэша)
 
     Returns:
         dict: Полное объяснение:
@@ -176,144 +693,157 @@ def explain_prediction(input_data: dict) -> dict:
                     "base_value": float,
                     "shap_values": [{"feature": str, "value": float}],
                     "summary": [str],
-                    "shap_image_base64": str,
-                    "shap_image_path": str
+                    "shap_image_base64": str,   # render png / both
+                    "shap_image_svg": str,      # render svg / both
+                    "shap_image_path": str      # если задан image_path
                 }
             }
 
     Raises:
-        ValueError: При ошибках предобработки или объяснения
-        Exception: При ошибках генерации графика
+        ValueError: При ошибках предобработки или объяснения,
+            неизвестном render или ошибках генерации графика
 
     Особенности:
-        - Использует shap.Explainer с callable-обёрткой
-        - Генерирует waterfall-график
-        - Сохраняет изображение для PDF-отчётов
+        - Использует TreeSHAP (или shap.Explainer как запасной путь)
+        - Waterfall-график строится не более одного раза за вызов
+          и только если он запрошен
+        - Результат и графики кэшируются по хэшу данных заемщика
+          и версии модели (LRU с лимитом памяти)
         - Возвращает top-5 наиболее важных признаков
     """
-    try:
-        # 1. Загрузка модели
-        model, feature_names, background_data = _load_model()
-
-        # 2. Предобработка данных
-        input_df = pd.DataFrame([input_data])
-        input_processed = preprocess_data_for_prediction(input_df)
-        input_processed = input_processed[feature_names]
-
-        # 3. Создание callable-обёртки для ансамбля
-        def model_predict_proba(X):
-            """
-            Обёртка, преобразующая VotingClassifier в вызываемую
-            функцию.
-            Требуется, так как SHAP не поддерживает VotingClassifier
-            напрямую.
-            """
-            if isinstance(X, np.ndarray):
-                X = pd.DataFrame(X, columns=feature_names)
-            return model.predict_proba(X)
-
-        # 4. Создание SHAP Explainer
-        explainer = shap.Explainer(
-            model_predict_proba,
-            background_data
+    if render not in RENDER_MODES:
+        raise ValueError(
+            f"Неизвестный формат render: {render}. "
+            f"Допустимые: {', '.join(RENDER_MODES)}"
         )
+    formats = {
+        "none": (), "png": ("png",), "svg": ("svg",), "both": ("png", "svg")
+    }[render]
+    if image_path is not None and "png" not in formats:
+        raise ValueError("image_path требует render png или both")
 
-        # 5. Получение SHAP значений
-        shap_values = explainer(input_processed)
-
-        # 6. Извлечение значений для класса "дефолт" (1)
-        if len(shap_values.output_names) == 2:
-            shap_vals = shap_values.values[:, :, 1].flatten()
-            base_value = float(shap_values.base_values[0][1])
-        else:
-            shap_vals = shap_values.values.flatten()
-            base_value = float(shap_values.base_values[0])
-
-        # 7. Предсказание
-        prediction = model.predict(input_processed)[0]
-        prediction_proba = model.predict_proba(input_processed)[0]
-
-        # 8. Топ-5 признаков по абсолютному вкладу
-        top_features = sorted(
-            zip(feature_names, shap_vals),
-            key=lambda x: abs(x[1]),
-            reverse=True
-        )[:5]
-
-        # 9. Генерация waterfall-графика
-        fig, ax = plt.subplots(figsize=(8, 6))
-        try:
-            shap.waterfall_plot(
+    try:
+        # 1. Текущая версия модели (весь запрос работает с ней)
+        bundle = get_model_bundle()
+
+        # Кэш: ключ — хэш данных заемщика и версии модели
+        cache_key = make_cache_key(input_data, bundle.version)
+        entry = _explanation_cache.get(cache_key) if use_cache else None
+        is_new = entry is None
+        if is_new:
+            entry = _compute_explanation(bundle, input_data)
+
+        # 9. Waterfall-график: только недостающие форматы, один холст
+        missing = [fmt for fmt in formats if fmt not in entry["images"]]
+        if missing:
+            shap_vals, base_value, data = entry["plot"]
+            rendered = _render_waterfall(
                 shap.Explanation(
                     values=shap_vals,
                     base_values=base_value,
-                    data=input_processed.iloc[0],
-                    feature_names=feature_names
+                    data=data,
+                    feature_names=bundle.feature_names
                 ),
-                show=False
+                tuple(missing)
             )
-        except Exception as e:
-            plt.close(fig)
-            raise ValueError(
-                f"Ошибка при построении waterfall: {str(e)}"
+
+            # 10. PNG в base64 (для фронтенда и PDF), SVG — как текст
+            images = dict(entry["images"])
+            if "png" in rendered:
+                images["png"] = base64.b64encode(
+                    rendered["png"]
+                ).decode('utf-8')
+            if "svg" in rendered:
+                images["svg"] = rendered["svg"].decode('utf-8')
+            entry = {**entry, "images": images}
+
+        if use_cache and (is_new or missing):
+            _explanation_cache.put(
+                cache_key, entry, _cache_entry_size(entry)
             )
 
-        # 10. Сохранение в base64 (для встраивания в PDF)
-        buf = BytesIO()
-        fig.savefig(
-            buf,
-            format='png',
-            bbox_inches='tight',
-            dpi=150,
-            facecolor='white'
-        )
-        buf.seek(0)
-        image_base64 = base64.b64encode(buf.read()).decode('utf-8')
-        plt.close(fig)
-
-        # 11. Сохранение на диск (для отчётов)
-        img_path = IMAGES_DIR / "shap_waterfall.png"
-        # Пересоздаём график для сохранения
-        fig, ax = plt.subplots(figsize=(8, 6))
-        shap.waterfall_plot(
-            shap.Explanation(
-                values=shap_vals,
-                base_values=base_value,
-                data=input_processed.iloc[0],
-                feature_names=feature_names
-            ),
-            show=False
-        )
-        fig.savefig(
-            img_path,
-            format='png',
-            bbox_inches='tight',
-            dpi=150,
-            facecolor='white'
-        )
-        plt.close(fig)
+        # 11. Формирование результата (копия: запись кэша не меняется)
+        explanation = dict(entry["result"]["explanation"])
+        if "png" in formats:
+            explanation["shap_image_base64"] = entry["images"]["png"]
+        if "svg" in formats:
+            explanation["shap_image_svg"] = entry["images"]["svg"]
 
-        # 12. Формирование результата
-        return {
-            "prediction": int(prediction),
-            "status": "repaid" if prediction == 0 else "default",
-            "decision": "approve" if prediction == 0 else "reject",
-            "probability_repaid": float(prediction_proba[0]),
-            "probability_default": float(prediction_proba[1]),
-            "explanation": {
-                "base_value": base_value,
-                "shap_values": [
-                    {"feature": name, "value": float(val)}
-                    for name, val in top_features
-                ],
-                "summary": [
-                    f"{name}: {'↑ риск' if val > 0 else '↓ риск'} ({val:+.3f})"
-                    for name, val in top_features
-                ],
-                "shap_image_base64": image_base64,
-                "shap_image_path": "images/shap_waterfall.png"
-            }
-        }
+        # 12. Сохранение на диск (для отчётов) — те же байты PNG
+        if image_path is not None:
+            image_path = Path(image_path)
+            image_path.write_bytes(base64.b64decode(entry["images"]["png"]))
+            explanation["shap_image_path"] = str(image_path.resolve())
+
+        return {**entry["result"], "explanation": explanation}
 
     except Exception as e:
         raise ValueError(f"Ошибка при объяснении: {str(e)}")
+
+
+# --- 🔥 Прогрев модели ---
+"""
+Первый прогноз после загрузки заметно медленнее следующих: XGBoost
+и CatBoost при первом вызове готовят внутренние структуры, а pandas,
+SHAP и matplotlib заполняют свои кэши. warm_up_model делает это
+при старте API, до того как воркер объявит готовность (/health/ready).
+"""
+_WARMUP_APPLICANT = {
+    "person_age": 35,
+    "person_income": 75000,
+    "person_home_ownership": "RENT",
+    "person_emp_length": 5.0,
+    "loan_intent": "EDUCATION",
+    "loan_grade": "B",
+    "loan_amnt": 20000,
+    "loan_int_rate": 9.5,
+    "loan_percent_income": 0.27,
+    "cb_person_default_on_file": "N",
+    "cb_person_cred_hist_length": 4
+}
+
+
+def warm_up_model(
+        inferences: int = MODEL_WARMUP_INFERENCES,
+        batch_rows: int = MODEL_WARMUP_BATCH_ROWS
+) -> dict:
+    """
+    Загружает модель и выполняет прогревочные прогнозы и объяснение.
+
+    Args:
+        inferences (int): Количество повторов прогноза
+            (одного заемщика и пакета)
+        batch_rows (int): Размер прогревочного пакета
+
+    Returns:
+        dict: {"version": str, "load_seconds": float,
+               "warmup_seconds": float}
+
+    Raises:
+        FileNotFoundError: Если модель не найдена
+        ValueError: При ошибках прогноза или объяснения
+    """
+    start = time.perf_counter()
+    bundle = get_model_bundle()
+    loaded = time.perf_counter()
+
+    single = pd.DataFrame([_WARMUP_APPLICANT])
+    batch = pd.DataFrame([_WARMUP_APPLICANT] * batch_rows)
+    for _ in range(inferences):
+        predict_loan_status(single)
+        if batch_rows:
+            predict_loan_status_batch(batch)
+    # Мимо кэша: синтетический заемщик не должен занимать место
+    # в кэше и влиять на его статистику
+    explain_prediction(_WARMUP_APPLICANT, render="png", use_cache=False)
+
+    finished = time.perf_counter()
+    logger.info(
+        f"🔥 Модель прогрета: версия {bundle.version}, загрузка "
+        f"{loaded - start:.2f} с, прогрев {finished - loaded:.2f} с"
+    )
+    return {
+        "version": bundle.version,
+        "load_seconds": round(loaded - start, 3),
+        "warmup_seconds": round(finished - loaded, 3)
+    }
@@ -22,11 +22,11 @@ Frontend-интерфейс для системы кредитного скор
 
 import os
 import sys
+import time
 from pathlib import Path
 import streamlit as st
 import requests
 import pandas as pd
-import joblib
 
 # --- 🧭 Настройка пути к корню проекта ---
 # Добавляет корень проекта в sys.path, чтобы можно было импортировать модули
@@ -39,9 +39,8 @@ if str(root_dir) not in sys.path:
 
 
 # --- 🔗 Импорт компонентов системы ---
-from shared.config import (
-    API_BASE_URL, REPORT_PATH, BACKGROUND_DATA_PATH, ENSEMBLE_MODEL_PATH
-)
+from shared.config import API_BASE_URL, REPORT_PATH
+from shared import model_store
 
 
 # --- 🖼️ Настройка страницы Streamlit ---
@@ -175,15 +174,51 @@ def explain_request(data):
     return response
 
 
+def wait_for_job(response, timeout=600, poll_interval=1.0):
+    """
+    Дожидается завершения фоновой задачи (отчёт или обучение).
+
+    /report, /generate-comparison-report и /train-final возвращают
+    202 и job_id; статус опрашивается через /jobs/{job_id}, пока
+    задача не завершится (done / failed / cancelled) или не истечёт
+    timeout.
+
+    Args:
+        response (requests.Response): Ответ на постановку задачи
+        timeout (float): Максимальное время ожидания, секунды
+        poll_interval (float): Интервал опроса, секунды
+
+    Returns:
+        requests.Response: Последний ответ /jobs/{job_id}
+            (или исходный ответ, если задача не была создана)
+    """
+    if response.status_code != 202:
+        return response
+
+    status_url = f"{API_BASE_URL}{response.json()['status_url']}"
+    deadline = time.time() + timeout
+    while True:
+        response = requests.get(status_url, headers=get_auth_headers())
+        if response.status_code == 401 and refresh_access_token():
+            continue
+        if response.status_code != 200:
+            return response
+        if response.json()["status"] in ("done", "failed", "cancelled") or time.time() > deadline:
+            return response
+        time.sleep(poll_interval)
+
+
 def generate_report(data):
     """
-    Генерирует PDF-отчёт через /report.
+    Генерирует PDF-отчёт через /report и дожидается
+    завершения фоновой задачи.
 
     Args:
         data (dict): Данные заемщика
 
     Returns:
-        requests.Response: Ответ с путём к PDF
+        requests.Response: Статус задачи (/jobs/{job_id}) с путём
+            к PDF и URL для скачивания в поле result
     """
     response = requests.post(
         url=f"{API_BASE_URL}/report",
@@ -197,7 +232,7 @@ def generate_report(data):
                 json=data,
                 headers=get_auth_headers()
             )
-    return response
+    return wait_for_job(response)
 
 
 def save_feedback(feedback_data):
@@ -238,10 +273,12 @@ def compare_models():
 
 def generate_comparison_report():
     """
-    Генерирует PDF-отчёт по сравнению моделей.
+    Генерирует PDF-отчёт по сравнению моделей и дожидается
+    завершения фоновой задачи.
 
     Returns:
-        requests.Response: Путь к PDF
+        requests.Response: Статус задачи (/jobs/{job_id}) с путём
+            к PDF в поле result
     """
     response = requests.post(
         url=f"{API_BASE_URL}/generate-comparison-report",
@@ -253,7 +290,7 @@ def generate_comparison_report():
                 url=f"{API_BASE_URL}/generate-comparison-report",
                 headers=get_auth_headers()
             )
-    return response
+    return wait_for_job(response)
 
 
 def retrain_model():
@@ -281,13 +318,15 @@ def retrain_model():
 
 def train_ensemble():
     """
-    Запрашивает обучение ансамблевой модели с нуля через /train-final.
+    Запрашивает обучение ансамблевой модели с нуля через /train-final
+    и дожидается завершения фоновой задачи.
     
     Обучает VotingClassifier (RandomForest + XGBoost + CatBoost) на полном
     датасете. Требует роль admin.
     
     Returns:
-        requests.Response: Результат обучения (модель, точность)
+        requests.Response: Статус задачи (/jobs/{job_id}) с результатом
+            обучения (модель, точность) в поле result
     """
     response = requests.post(
         url=f"{API_BASE_URL}/train-final",
@@ -299,14 +338,14 @@ def train_ensemble():
                 url=f"{API_BASE_URL}/train-final",
                 headers=get_auth_headers()
             )
-    return response
+    return wait_for_job(response, timeout=1800)
 
 
 # --- 🧠 Загрузка background_data для SHAP ---
 @st.cache_resource
 def load_background_data():
     """
-    Загружает background_data.pkl для построения SHAP-графиков.
+    Загружает background_data текущей версии модели для SHAP-графиков.
 
     Кэшируется, чтобы не загружать повторно при каждом действии.
 
@@ -314,9 +353,9 @@ def load_background_data():
         pd.DataFrame or None: Фоновые данные или None при ошибке
     """
     try:
-        return joblib.load(BACKGROUND_DATA_PATH)
+        return model_store.load_background_data()
     except Exception as e:
-        st.warning("Не удалось загрузить background_data.pkl")
+        st.warning("Не удалось загрузить background_data")
         return None
 
 
@@ -438,6 +477,8 @@ with tab1:
                         del st.session_state['pdf_generated']
                     if 'report_path' in st.session_state:
                         del st.session_state['report_path']
+                    if 'report_download_url' in st.session_state:
+                        del st.session_state['report_download_url']
 
                     # Отображение результата прогноза
                     # Преобразуем коды решения в читаемый формат
@@ -487,12 +528,16 @@ with tab1:
                     input_data = st.session_state['input_data']
                     # Отправляем запрос на генерацию PDF
                     response = generate_report(input_data)
-                    if response.status_code == 200:
-                        report_path = response.json()["report_path"]
-                        # Сохраняем флаг и путь для последующего скачивания
+                    if response.status_code == 200 and response.json()["status"] == "done":
+                        job_result = response.json()["result"]
+                        report_path = job_result["report_path"]
+                        # Сохраняем флаг, путь и URL отчёта (по его ID)
                         st.session_state['pdf_generated'] = True
                         st.session_state['report_path'] = report_path
+                        st.session_state['report_download_url'] = job_result["download_url"]
                         st.success(f"✅ Отчёт сформирован: `{report_path}`")
+                    elif response.status_code == 200:
+                        st.error(f"❌ Ошибка: {response.json().get('error') or 'отчёт не готов'}")
                     else:
                         st.error(f"❌ Ошибка: {response.json().get('detail')}")
                 except Exception as e:
@@ -502,11 +547,12 @@ with tab1:
         # Кнопка скачивания (отображается только если отчёт был сформирован)
         if 'pdf_generated' in st.session_state and 'report_path' in st.session_state:
             report_path = st.session_state['report_path']
-            # Скачивание файла через API endpoint /download/{filename}
+            download_url = st.session_state['report_download_url']
+            # Скачивание файла через API endpoint /download/{id}
             # Это безопаснее, чем прямой доступ к файловой системе
             try:
                 download_response = requests.get(
-                    f"{API_BASE_URL}/download/explanation_report.pdf",
+                    f"{API_BASE_URL}{download_url}",
                     headers=get_auth_headers()
                 )
                 if download_response.status_code == 200:
@@ -521,7 +567,7 @@ with tab1:
                     # Попробуем обновить токен и повторить запрос
                     if refresh_access_token():
                         download_response = requests.get(
-                            f"{API_BASE_URL}/download/explanation_report.pdf",
+                            f"{API_BASE_URL}{download_url}",
                             headers=get_auth_headers()
                         )
                         if download_response.status_code == 200:
@@ -630,6 +676,12 @@ with tab2:
                         # График ROC-AUC для каждой модели
                         st.bar_chart(df.set_index("model")["auc"])
 
+                elif response.status_code in (429, 503):
+                    # Сервер занят другими сравнениями (admission control)
+                    st.warning(
+                        "⏳ Сервер занят сравнением моделей. Повторите через "
+                        f"{response.headers.get('Retry-After', '30')} с."
+                    )
                 else:
                     st.warning("Метрики недоступны. Обучите модели сначала.")
             except Exception as e:
@@ -644,14 +696,17 @@ with tab2:
         with st.spinner("Генерация отчёта..."):
             try:
                 response = generate_comparison_report()
-                if response.status_code == 200:
-                    report_path = response.json()["report_path"]
+                if response.status_code == 200 and response.json()["status"] != "done":
+                    st.error(f"❌ Ошибка: {response.json().get('error') or 'отчёт не готов'}")
+                elif response.status_code == 200:
+                    report_path = response.json()["result"]["report_path"]
+                    download_url = response.json()["result"]["download_url"]
                     st.success(f"✅ Отчёт сгенерирован: `{report_path}`")
                     
                     # Скачивание файла через API endpoint
                     try:
                         download_response = requests.get(
-                            f"{API_BASE_URL}/download/model_comparison_report.pdf",
+                            f"{API_BASE_URL}{download_url}",
                             headers=get_auth_headers()
                         )
                         if download_response.status_code == 200:
@@ -665,7 +720,7 @@ with tab2:
                             # Попробуем обновить токен и повторить запрос
                             if refresh_access_token():
                                 download_response = requests.get(
-                                    f"{API_BASE_URL}/download/model_comparison_report.pdf",
+                                    f"{API_BASE_URL}{download_url}",
                                     headers=get_auth_headers()
                                 )
                                 if download_response.status_code == 200:
@@ -711,12 +766,15 @@ with tab3:
         with st.spinner("Обучение..."):
             try:
                 response = train_ensemble()
-                if response.status_code == 200:
-                    result = response.json()
+                if response.status_code == 200 and response.json()["status"] == "done":
+                    result = response.json()["result"]
                     st.success(
                         f"✅ Модель обучена: {result['model']}, "
                         f"точность: {result['accuracy']:.3f}"
                     )
+                elif response.status_code == 200:
+                    job = response.json()
+                    st.error(f"❌ Ошибка обучения: {job.get('error') or job['status']}")
                 else:
                     error_detail = response.json().get("detail", "Неизвестная ошибка")
                     st.error(f"❌ Ошибка обучения: {error_detail}")
@@ -739,7 +797,12 @@ with tab3:
                 response = retrain_model()
                 if response.status_code == 200:
                     result = response.json()
-                    st.success("✅ Модель дообучена!")
+                    if result["status"] == "up_to_date":
+                        st.info("ℹ️ Новых фидбэков нет — модель актуальна")
+                    elif result["status"] == "deferred":
+                        st.warning(f"⏳ Дообучение отложено: {result['reason']}")
+                    else:
+                        st.success("✅ Модель дообучена!")
                     # Отображаем полный JSON результат для детального просмотра
                     st.json(result)
                 else:
@@ -0,0 +1,68 @@
+# gunicorn.conf.py
+"""
+Конфигурация gunicorn для запуска API несколькими воркерами
+
+Запуск:
+    gunicorn -c gunicorn.conf.py app.main:app
+
+Воркеры — UvicornWorker (ASGI), их количество — API_WORKERS.
+
+При MODEL_PRELOAD=true приложение импортируется в мастер-процессе
+(preload_app), и модель загружается там до fork (см. preload_model
+в app/services/utils.py). Воркеры делят память модели, поэтому
+на узле помещается больше воркеров.
+
+При заданном PROMETHEUS_MULTIPROC_DIR гистограммы задержек воркеров
+пишутся в файлы этой директории (см. app/services/latency.py);
+при запуске gunicorn она очищается.
+
+Автор: [Кочнева Арина]
+Год: 2025
+"""
+
+import os
+import shutil
+import sys
+
+# Корень проекта в sys.path: gunicorn читает этот файл до перехода
+# в рабочую директорию приложения
+root_dir = os.path.dirname(os.path.abspath(__file__))
+if root_dir not in sys.path:
+    sys.path.insert(0, root_dir)
+
+from shared.config import API_WORKERS, MODEL_PRELOAD, PORT, PROMETHEUS_MULTIPROC_DIR
+
+
+bind = f"0.0.0.0:{PORT}"
+workers = API_WORKERS
+worker_class = "uvicorn.workers.UvicornWorker"
+preload_app = MODEL_PRELOAD
+# Первый запрос к новой версии модели ждёт её загрузки
+timeout = 120
+
+
+def when_ready(server):
+    """Загружает модель в мастере: приложение уже импортировано, воркеров ещё нет."""
+    if not server.cfg.preload_app:
+        return
+    from app.services.utils import preload_model
+
+    preload_model()
+
+
+def on_starting(server):
+    """Очищает файлы метрик прошлого запуска (до импорта приложения)."""
+    if PROMETHEUS_MULTIPROC_DIR:
+        shutil.rmtree(PROMETHEUS_MULTIPROC_DIR, ignore_errors=True)
+        os.makedirs(PROMETHEUS_MULTIPROC_DIR, exist_ok=True)
+
+
+def child_exit(server, worker):
+    """Помечает файлы метрик завершившегося воркера."""
+    if not PROMETHEUS_MULTIPROC_DIR:
+        return
+    try:
+        from prometheus_client import multiprocess
+    except ImportError:
+        return
+    multiprocess.mark_process_dead(worker.pid)
@@ -0,0 +1,153 @@
+# scripts/benchmark_feedback_preprocessing.py
+"""
+Бенчмарк предобработки фидбэков для дообучения
+
+Сравнивает подготовку матрицы признаков в retrain_model_from_feedback:
+- loop: исходная реализация до FeatureEncoder — iterrows(), DataFrame
+    из одной строки, feature engineering и One-Hot Encoding средствами
+    pandas и joblib.load(feature_names.pkl) для каждого фидбэка
+    (воспроизведена в run_loop)
+- vectorized: один вызов preprocess_data_for_prediction на весь
+    DataFrame фидбэков (FeatureEncoder)
+
+Данные генерируются синтетически (поля LoanRequest). Построчный
+вариант замеряется только до --loop-max-rows строк, для больших
+объёмов время экстраполируется линейно.
+
+Запуск:
+    python scripts/benchmark_feedback_preprocessing.py --sizes 1000 100000 1000000
+
+Автор: [Кочнева Арина]
+Год: 2025
+"""
+import argparse
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+import joblib
+import numpy as np
+import pandas as pd
+
+# Добавляем корневую директорию проекта в sys.path
+project_root = Path(__file__).parent.parent
+sys.path.insert(0, str(project_root))
+
+from shared.data_processing import (
+    CATEGORIES, FeatureEncoder, feature_engineering, preprocess_data_for_prediction
+)
+
+
+def make_feedback_frame(n_rows: int, seed: int = 42) -> pd.DataFrame:
+    """Синтетические фидбэки (без actual_status) в формате таблицы feedback."""
+    rng = np.random.default_rng(seed)
+    income = rng.integers(10_000, 300_000, n_rows)
+    amount = rng.integers(500, 35_000, n_rows)
+    df = pd.DataFrame({
+        "person_age": rng.integers(20, 70, n_rows),
+        "person_income": income,
+        "person_emp_length": rng.uniform(0, 30, n_rows).round(1),
+        "loan_amnt": amount,
+        "loan_int_rate": rng.uniform(5, 23, n_rows).round(2),
+        "loan_percent_income": (amount / income).round(2),
+        "cb_person_cred_hist_length": rng.integers(2, 30, n_rows)
+    })
+    for col, categories in CATEGORIES.items():
+        df[col] = rng.choice(categories, n_rows)
+    return df
+
+
+def _original_preprocess_for_prediction(df: pd.DataFrame, feature_names_path) -> pd.DataFrame:
+    """preprocess_data_for_prediction в исходном виде (до FeatureEncoder)."""
+    df = df.copy()
+    df = feature_engineering(df)
+
+    # One-Hot Encoding
+    for col, categories in CATEGORIES.items():
+        for cat in categories:
+            df[f"{col}_{cat}"] = (df[col] == cat).astype(int)
+        df = df.drop(col, axis=1)
+
+    # Выравнивание по фичам из обученной модели (чтение файла на каждый вызов)
+    expected_features = joblib.load(feature_names_path)
+    for col in expected_features:
+        if col not in df.columns:
+            df[col] = 0
+    return df[expected_features]
+
+
+def run_loop(df: pd.DataFrame, feature_names_path) -> pd.DataFrame:
+    """Исходная построчная предобработка retrain_model_from_feedback."""
+    X_list = []
+    for _, row in df.iterrows():
+        row_df = pd.DataFrame([row])
+        processed = _original_preprocess_for_prediction(row_df, feature_names_path)
+        X_list.append(processed.iloc[0])
+    return pd.DataFrame(X_list).reset_index(drop=True)
+
+
+def run_vectorized(df: pd.DataFrame, encoder: FeatureEncoder) -> pd.DataFrame:
+    """Один векторизованный проход по всем фидбэкам."""
+    return preprocess_data_for_prediction(
+        df.reset_index(drop=True), encoder=encoder
+    )
+
+
+def _timeit(func) -> float:
+    """Время одного вызова в секундах."""
+    start = time.perf_counter()
+    func()
+    return time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Бенчмарк предобработки фидбэков для дообучения"
+    )
+    parser.add_argument(
+        "--sizes", type=int, nargs="+",
+        default=[1_000, 10_000, 100_000, 1_000_000]
+    )
+    parser.add_argument(
+        "--loop-max-rows", type=int, default=2_000,
+        help="Максимум строк для замера построчного варианта"
+    )
+    args = parser.parse_args()
+
+    encoder = FeatureEncoder.default()
+    # Исходный вариант читал список фичей модели из feature_names.pkl
+    feature_names_path = Path(tempfile.mkdtemp()) / "feature_names.pkl"
+    joblib.dump(list(encoder.feature_names), feature_names_path)
+
+    # Проверка совпадения результатов (исходный вариант считал в float64)
+    sample = make_feedback_frame(200)
+    np.testing.assert_allclose(
+        run_loop(sample, feature_names_path).to_numpy(dtype=np.float64),
+        run_vectorized(sample, encoder).to_numpy(dtype=np.float64),
+        rtol=1e-6
+    )
+
+    # Время построчного варианта на одну строку
+    loop_rows = min(args.loop_max_rows, max(args.sizes))
+    loop_df = make_feedback_frame(loop_rows)
+    loop_per_row = _timeit(lambda: run_loop(loop_df, feature_names_path)) / loop_rows
+
+    print(
+        f"{'Строк':>10}{'loop, с':>14}{'vectorized, с':>16}"
+        f"{'строк/с':>14}{'ускорение':>12}"
+    )
+    for n_rows in args.sizes:
+        df = make_feedback_frame(n_rows)
+        vectorized = _timeit(lambda: run_vectorized(df, encoder))
+        loop = loop_per_row * n_rows
+        mark = "" if n_rows <= loop_rows else "*"
+        print(
+            f"{n_rows:>10}{loop:>13.2f}{mark:1}{vectorized:>16.3f}"
+            f"{n_rows / vectorized:>14.0f}{loop / vectorized:>11.0f}x"
+        )
+    print("* — экстраполяция по времени на строку")
+
+
+if __name__ == "__main__":
+    main()
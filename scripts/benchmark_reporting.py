@@ -0,0 +1,152 @@
+# scripts/benchmark_reporting.py
+"""
+Бенчмарк подготовки PDF-отчётов
+
+Сравнивает затраты на один отчёт:
+- legacy: jinja2.Template из строки + инлайн <style> на каждый вызов
+    (как было до переноса шаблонов в app/templates/)
+- cached: скомпилированный шаблон из jinja2.Environment + заранее
+    разобранный weasyprint.CSS в stylesheets=
+
+Этапы:
+- template — компиляция (legacy) и рендеринг HTML
+- pdf — полный HTML → PDF через WeasyPrint
+
+Запуск:
+    python scripts/benchmark_reporting.py --iterations 20
+
+Автор: [Кочнева Арина]
+Год: 2025
+"""
+import argparse
+import sys
+import tempfile
+import time
+from datetime import datetime
+from pathlib import Path
+
+# Добавляем корневую директорию проекта в sys.path
+project_root = Path(__file__).parent.parent
+sys.path.insert(0, str(project_root))
+
+from jinja2 import Template
+
+from app.services import reporting
+from shared.config import REPORTS_DIR
+
+
+SAMPLE_DATA = {
+    "person_age": 35,
+    "person_income": 75000,
+    "person_home_ownership": "RENT",
+    "person_emp_length": 5.0,
+    "loan_intent": "EDUCATION",
+    "loan_grade": "B",
+    "loan_amnt": 20000,
+    "loan_int_rate": 9.5,
+    "loan_percent_income": 0.27,
+    "cb_person_default_on_file": "N",
+    "cb_person_cred_hist_length": 4
+}
+
+SAMPLE_EXPLANATION = {
+    "prediction": 0,
+    "probability_repaid": 0.93,
+    "explanation": {
+        "summary": [
+            "loan_grade_B: ↓ риск (-0.250)",
+            "person_income: ↓ риск (-0.180)"
+        ]
+    }
+}
+
+
+def _context() -> dict:
+    return {
+        "data": SAMPLE_DATA,
+        "explanation": SAMPLE_EXPLANATION,
+        "decision": "approve",
+        "probability_repaid": SAMPLE_EXPLANATION["probability_repaid"],
+        "image_path": "images/shap_waterfall.png",
+        "now": datetime.now().strftime("%d.%m.%Y %H:%M")
+    }
+
+
+def _legacy_source() -> str:
+    """Шаблон отчёта в прежнем виде: стили инлайн в <style>."""
+    template = (reporting.TEMPLATES_DIR / "explanation_report.html").read_text(encoding="utf-8")
+    css = reporting.REPORT_STYLESHEET_PATH.read_text(encoding="utf-8")
+    return template.replace("</head>", f"<style>{css}</style>\n</head>")
+
+
+def _timeit(func, iterations: int) -> float:
+    """Среднее время вызова в миллисекундах (после прогрева)."""
+    func()
+    start = time.perf_counter()
+    for _ in range(iterations):
+        func()
+    return (time.perf_counter() - start) / iterations * 1000
+
+
+def benchmark_templates(iterations: int) -> dict:
+    """Компиляция и рендеринг HTML: legacy vs cached."""
+    source = _legacy_source()
+    template = reporting._jinja_env.get_template("explanation_report.html")
+
+    return {
+        "legacy": _timeit(lambda: Template(source).render(**_context()), iterations),
+        "cached": _timeit(lambda: template.render(**_context()), iterations)
+    }
+
+
+def benchmark_pdf(iterations: int) -> dict:
+    """Полный HTML → PDF: инлайн CSS vs общий разобранный CSS."""
+    from weasyprint import HTML
+
+    source = _legacy_source()
+    template = reporting._jinja_env.get_template("explanation_report.html")
+    base_url = REPORTS_DIR.resolve()
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        target = Path(tmp_dir) / "report.pdf"
+
+        def legacy():
+            html = Template(source).render(**_context())
+            HTML(string=html, base_url=base_url).write_pdf(target=target)
+
+        def cached():
+            html = template.render(**_context())
+            HTML(string=html, base_url=base_url).write_pdf(
+                target=target, stylesheets=[reporting.get_report_stylesheet()]
+            )
+
+        return {
+            "legacy": _timeit(legacy, iterations),
+            "cached": _timeit(cached, iterations)
+        }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Бенчмарк подготовки PDF-отчётов")
+    parser.add_argument("--iterations", type=int, default=20)
+    parser.add_argument(
+        "--skip-pdf", action="store_true",
+        help="Только шаблоны (без WeasyPrint)"
+    )
+    args = parser.parse_args()
+
+    stages = {"template": benchmark_templates(args.iterations)}
+    if not args.skip_pdf:
+        stages["pdf"] = benchmark_pdf(args.iterations)
+
+    print(f"{'Этап':<10}{'legacy, мс':>14}{'cached, мс':>14}{'экономия, мс':>16}")
+    for stage, timings in stages.items():
+        saved = timings["legacy"] - timings["cached"]
+        print(
+            f"{stage:<10}{timings['legacy']:>14.2f}"
+            f"{timings['cached']:>14.2f}{saved:>16.2f}"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -18,6 +18,13 @@ echo "👤 Проверка пользователей..."
 python scripts/create_users.py || echo "⚠️ Ошибка при создании пользователей"
 
 # Запуск приложения
+# При MODEL_PRELOAD=true — gunicorn: модель загружается до запуска воркеров
+if [ "${MODEL_PRELOAD:-false}" = "true" ]; then
+    # Гистограммы задержек суммируются по всем воркерам
+    export PROMETHEUS_MULTIPROC_DIR="${PROMETHEUS_MULTIPROC_DIR:-/tmp/prometheus_multiproc}"
+    echo "✅ Запуск FastAPI сервера (gunicorn, воркеров: ${API_WORKERS:-1})..."
+    exec gunicorn -c gunicorn.conf.py app.main:app
+fi
 echo "✅ Запуск FastAPI сервера..."
 exec uvicorn app.main:app --host 0.0.0.0 --port 8000
 
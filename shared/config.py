@@ -34,12 +34,14 @@ ROOT_DIR = Path(__file__).parent.parent
 - data/ — сырые и фидбэки
 - reports/ — PDF-отчёты
 - reports/images/ — графики для встраивания в PDF
+- reports/artifacts/ — PDF и графики отдельных запросов (по ID)
 - logs/ — логи приложения (backend и frontend)
 """
 MODELS_DIR = ROOT_DIR / "models"
 DATA_DIR = ROOT_DIR / "data"
 REPORTS_DIR = ROOT_DIR / "reports"
 IMAGES_DIR = REPORTS_DIR / "images"  # Для хранения графиков (SHAP, ROC-AUC)
+ARTIFACTS_DIR = REPORTS_DIR / "artifacts"  # Отчёты по запросам: artifacts/<id>/
 
 # Директория для логов (настраивается через .env, по умолчанию logs/)
 LOGS_DIR_NAME = os.getenv("LOGS_DIR", "logs")
@@ -55,11 +57,22 @@ LOGS_DIR = ROOT_DIR / LOGS_DIR_NAME
 - Дообучения на фидбэках
 """
 FEATURE_NAMES_PATH = MODELS_DIR / "feature_names.pkl"       # Список фичей после OHE
-BACKGROUND_DATA_PATH = MODELS_DIR / "background_data.pkl"   # Фоновые данные для SHAP
+BACKGROUND_DATA_PATH = MODELS_DIR / "background_data.pkl"   # Фоновые данные для SHAP (в версиях — .npy)
 ENSEMBLE_MODEL_PATH = MODELS_DIR / "ensemble_model.pkl"     # Ансамблевая модель (VotingClassifier)
+MODEL_METADATA_PATH = MODELS_DIR / "model_metadata.json"    # Метаданные модели (порог решения и т.д.)
+MODEL_VERSIONS_DIR = MODELS_DIR / "versions"                # Версии модели: versions/<версия>/<файлы выше>
+MODEL_CURRENT_PATH = MODELS_DIR / "CURRENT"                 # Имя текущей версии модели
+COMPARISON_CACHE_DIR = MODELS_DIR / "comparison"          # Кэш сравнения моделей (по отпечатку данных)
+REPLAY_RESERVOIR_PATH = MODELS_DIR / "replay_reservoir.npz"   # Выборка базового датасета для дообучения (replay)
+RETRAIN_LOCK_PATH = MODELS_DIR / ".retrain.lock"             # Блокировка дообучения (общая для воркеров API)
 REPORT_PATH = REPORTS_DIR / "explanation_report.pdf"        # Стандартный отчёт по заемщику
 DATA_SOURCE = DATA_DIR / "credit_risk_dataset.csv"          # Исходный датасет для обучения
 
+# Пути выше (ensemble_model.pkl и т.д.) — прежняя «плоская» раскладка:
+# она используется, пока не сохранена первая версия модели
+# (см. shared/model_store.py). Хранится MODEL_VERSIONS_KEEP последних версий
+MODEL_VERSIONS_KEEP = int(os.getenv("MODEL_VERSIONS_KEEP", "3"))
+
 # База данных — в корне проекта
 DATABASE_PATH = ROOT_DIR / "credit_scoring.db"
 SQLALCHEMY_DATABASE_URL = f"sqlite:///{DATABASE_PATH}"
@@ -76,6 +89,201 @@ API_BASE_URL = os.getenv("API_BASE_URL", "http://localhost:8000")
 HOST = os.getenv("HOST", "localhost")
 PORT = int(os.getenv("PORT", "8000"))
 
+# --- 📦 Пакетный скоринг ---
+"""
+Ограничение размера пакета для /predict/batch.
+Защищает API от чрезмерно больших запросов.
+"""
+BATCH_PREDICT_MAX_ROWS = int(os.getenv("BATCH_PREDICT_MAX_ROWS", "50000"))
+
+# --- 🧺 Микропакетирование /predict ---
+"""
+Конкурентные запросы /predict собираются в один вызов predict_proba
+(см. app/services/batching.py): пакет закрывается, когда в нём
+PREDICT_MICROBATCH_MAX_ROWS строк или через
+PREDICT_MICROBATCH_MAX_WAIT_MS после первого запроса пакета.
+"""
+PREDICT_MICROBATCH = os.getenv("PREDICT_MICROBATCH", "true").lower() == "true"
+PREDICT_MICROBATCH_MAX_ROWS = int(os.getenv("PREDICT_MICROBATCH_MAX_ROWS", "64"))
+PREDICT_MICROBATCH_MAX_WAIT_MS = float(os.getenv("PREDICT_MICROBATCH_MAX_WAIT_MS", "5"))
+
+# --- 🧵 Пул потоков инференса ---
+"""
+Вызовы модели из /predict, /predict/batch, /explain и SHAP для
+/report выполняются в отдельном пуле из INFERENCE_WORKERS потоков
+(см. app/services/inference.py), а не в общем пуле Starlette.
+Вызовы сверх INFERENCE_MAX_QUEUE ожидающих сразу отклоняются
+с 429 и Retry-After (ADMISSION_RETRY_AFTER_SECONDS).
+"""
+INFERENCE_WORKERS = int(os.getenv("INFERENCE_WORKERS", str(os.cpu_count() or 1)))
+INFERENCE_MAX_QUEUE = int(os.getenv("INFERENCE_MAX_QUEUE", str(8 * INFERENCE_WORKERS)))
+
+# --- 🔥 Прогрев модели при старте ---
+"""
+При запуске API модель загружается заранее и прогревается:
+MODEL_WARMUP_INFERENCES раз выполняются прогноз одного заемщика
+и пакета из MODEL_WARMUP_BATCH_ROWS строк, затем одно объяснение
+с графиком. До окончания прогрева /health/ready отвечает 503.
+При MODEL_WARMUP=false модель при запуске только загружается.
+"""
+MODEL_WARMUP = os.getenv("MODEL_WARMUP", "true").lower() == "true"
+MODEL_WARMUP_INFERENCES = int(os.getenv("MODEL_WARMUP_INFERENCES", "3"))
+MODEL_WARMUP_BATCH_ROWS = int(os.getenv("MODEL_WARMUP_BATCH_ROWS", "64"))
+
+# --- 🧩 Общая память модели для нескольких воркеров ---
+"""
+API_WORKERS — количество воркеров gunicorn (см. gunicorn.conf.py).
+
+MODEL_PRELOAD — модель загружается в мастер-процессе gunicorn до
+fork, и воркеры делят её страницы памяти (copy-on-write).
+
+MODEL_MMAP — background_data и массивы деревьев TreeSHAP читаются
+из .npy-файлов версии через отображение в память: воркеры делят
+одни страницы page cache, в том числе после загрузки новой версии.
+"""
+API_WORKERS = int(os.getenv("API_WORKERS", "1"))
+MODEL_PRELOAD = os.getenv("MODEL_PRELOAD", "false").lower() == "true"
+MODEL_MMAP = os.getenv("MODEL_MMAP", "true").lower() == "true"
+
+# --- 🎯 Порог решения ---
+"""
+Порог вероятности дефолта, начиная с которого заемщик получает
+prediction = 1 (default). Сохраняется вместе с моделью в
+model_metadata.json при обучении; значение из окружения используется
+для новых моделей и для моделей без метаданных.
+"""
+DECISION_THRESHOLD = float(os.getenv("DECISION_THRESHOLD", "0.5"))
+
+# --- 🗃 Кэш объяснений ---
+"""
+Лимит памяти LRU-кэша объяснений /explain и /report (SHAP-значения,
+текстовое объяснение, графики). Ключ — хэш данных заемщика и версии
+модели. 0 — кэш отключён.
+"""
+EXPLANATION_CACHE_MAX_BYTES = int(
+    os.getenv("EXPLANATION_CACHE_MAX_BYTES", str(64 * 1024 * 1024))
+)
+
+# --- 🧾 Артефакты отчётов ---
+"""
+Каждый отчёт (/report, /generate-comparison-report) сохраняется
+в собственную директорию reports/artifacts/<id>/ и скачивается
+через /download/{id}. Артефакты старше ARTIFACT_TTL_SECONDS удаляются
+не чаще раза в ARTIFACT_CLEANUP_INTERVAL_SECONDS.
+"""
+ARTIFACT_TTL_SECONDS = int(os.getenv("ARTIFACT_TTL_SECONDS", str(24 * 3600)))
+ARTIFACT_CLEANUP_INTERVAL_SECONDS = int(
+    os.getenv("ARTIFACT_CLEANUP_INTERVAL_SECONDS", "300")
+)
+
+# --- ⏳ Фоновые задачи отчётов ---
+"""
+Количество потоков, рендерящих PDF-отчёты в фоне. /report и
+/generate-comparison-report только ставят задачу в очередь.
+"""
+REPORT_JOB_WORKERS = int(os.getenv("REPORT_JOB_WORKERS", "2"))
+
+# --- 🚦 Ограничение нагрузки (admission control) ---
+"""
+Тяжёлые эндпоинты ограничены числом одновременных вызовов
+(*_MAX_CONCURRENT) и длиной очереди (*_MAX_QUEUE) — см.
+app/services/admission.py. Запрос сверх очереди сразу получает
+429, а /compare, прождавший в очереди дольше
+ADMISSION_QUEUE_TIMEOUT_SECONDS, — 503; в обоих случаях
+с заголовком Retry-After (ADMISSION_RETRY_AFTER_SECONDS).
+
+Для задач (/report, /generate-comparison-report, /train-final)
+одновременные вызовы — это потоки очереди задач, а очередь —
+задачи, ожидающие потока. Ограничения действуют в каждом воркере.
+"""
+COMPARE_MAX_CONCURRENT = int(os.getenv("COMPARE_MAX_CONCURRENT", "1"))
+COMPARE_MAX_QUEUE = int(os.getenv("COMPARE_MAX_QUEUE", "2"))
+COMPARISON_REPORT_MAX_CONCURRENT = int(os.getenv("COMPARISON_REPORT_MAX_CONCURRENT", "1"))
+COMPARISON_REPORT_MAX_QUEUE = int(os.getenv("COMPARISON_REPORT_MAX_QUEUE", "2"))
+REPORT_MAX_QUEUE = int(os.getenv("REPORT_MAX_QUEUE", "20"))
+TRAIN_FINAL_MAX_QUEUE = int(os.getenv("TRAIN_FINAL_MAX_QUEUE", "1"))
+ADMISSION_QUEUE_TIMEOUT_SECONDS = float(os.getenv("ADMISSION_QUEUE_TIMEOUT_SECONDS", "30"))
+ADMISSION_RETRY_AFTER_SECONDS = int(os.getenv("ADMISSION_RETRY_AFTER_SECONDS", "30"))
+
+# --- ⏱️ Гистограммы задержек ---
+"""
+Время ответа API считается в гистограммах с фиксированными
+границами корзин LATENCY_BUCKETS (секунды, через запятую) —
+см. app/services/latency.py.
+
+PROMETHEUS_MULTIPROC_DIR — директория multiprocess-режима
+prometheus_client: воркеры gunicorn пишут счётчики в её файлы,
+и метрики суммируются по всем воркерам. Без неё (или без
+prometheus_client) гистограммы считаются в памяти процесса.
+"""
+LATENCY_BUCKETS = tuple(
+    float(bound) for bound in os.getenv(
+        "LATENCY_BUCKETS", "0.005,0.01,0.025,0.05,0.1,0.25,0.5,1,2.5,5,10,30,60"
+    ).split(",")
+)
+PROMETHEUS_MULTIPROC_DIR = os.getenv("PROMETHEUS_MULTIPROC_DIR")
+
+# --- 🏁 Параллельное сравнение моделей ---
+"""
+compare_models обучает модели одновременно в пуле процессов,
+деля ядра между ними поровну (см. app/services/model_comparison.py).
+COMPARISON_WORKERS — максимум процессов (по умолчанию — число ядер).
+"""
+COMPARISON_PARALLEL = os.getenv("COMPARISON_PARALLEL", "true").lower() == "true"
+COMPARISON_WORKERS = int(os.getenv("COMPARISON_WORKERS", str(os.cpu_count() or 1)))
+
+# --- 🔁 Дообучение на фидбэках ---
+"""
+Фидбэки читаются из БД порциями по RETRAIN_CHUNK_SIZE строк
+прямо в типизированные массивы NumPy (без ORM-объектов).
+"""
+RETRAIN_CHUNK_SIZE = int(os.getenv("RETRAIN_CHUNK_SIZE", "10000"))
+
+# Дообучение учитывает только новые фидбэки (см. app/services/retrain.py):
+# бустинги продолжаются на RETRAIN_BOOST_ROUNDS итераций, RandomForest
+# перестраивается после RETRAIN_RF_REBUILD_ROWS новых фидбэков
+RETRAIN_BOOST_ROUNDS = int(os.getenv("RETRAIN_BOOST_ROUNDS", "50"))
+RETRAIN_RF_REBUILD_ROWS = int(os.getenv("RETRAIN_RF_REBUILD_ROWS", "5000"))
+
+# Режим replay: к фидбэкам добавляется равномерная выборка базового
+# датасета (RETRAIN_REPLAY_SAMPLE_SIZE строк), которая строится один раз
+# и хранится в REPLAY_RESERVOIR_PATH
+RETRAIN_REPLAY = os.getenv("RETRAIN_REPLAY", "false").lower() == "true"
+RETRAIN_REPLAY_SAMPLE_SIZE = int(os.getenv("RETRAIN_REPLAY_SAMPLE_SIZE", "5000"))
+
+# --- ⏰ Автоматическое дообучение ---
+"""
+Планировщик (см. app/services/scheduler.py) проверяет новые фидбэки
+раз в RETRAIN_CHECK_INTERVAL_SECONDS (и сразу после POST /feedback)
+и запускает дообучение, если их накопилось RETRAIN_TRIGGER_ROWS или
+самый старый ждёт дольше RETRAIN_TRIGGER_MAX_AGE_SECONDS. Между
+дообучениями проходит не меньше RETRAIN_MIN_INTERVAL_SECONDS.
+
+Дообучение идёт в отдельном процессе с пониженным приоритетом
+(RETRAIN_SCHEDULER_NICENESS) и не более чем RETRAIN_SCHEDULER_THREADS
+потоками, чтобы не отнимать ядра у обработки запросов.
+
+После неудачного или отложенного дообучения следующая попытка
+планировщика ждёт RETRAIN_FAILURE_BACKOFF_SECONDS; пауза удваивается
+при каждой новой неудаче, но не превышает
+RETRAIN_FAILURE_BACKOFF_MAX_SECONDS.
+"""
+RETRAIN_SCHEDULER = os.getenv("RETRAIN_SCHEDULER", "false").lower() == "true"
+RETRAIN_TRIGGER_ROWS = int(os.getenv("RETRAIN_TRIGGER_ROWS", "1000"))
+RETRAIN_TRIGGER_MAX_AGE_SECONDS = int(
+    os.getenv("RETRAIN_TRIGGER_MAX_AGE_SECONDS", str(24 * 3600))
+)
+RETRAIN_MIN_INTERVAL_SECONDS = int(os.getenv("RETRAIN_MIN_INTERVAL_SECONDS", "3600"))
+RETRAIN_CHECK_INTERVAL_SECONDS = int(os.getenv("RETRAIN_CHECK_INTERVAL_SECONDS", "60"))
+RETRAIN_SCHEDULER_THREADS = int(
+    os.getenv("RETRAIN_SCHEDULER_THREADS", str(max(1, (os.cpu_count() or 1) // 2)))
+)
+RETRAIN_SCHEDULER_NICENESS = int(os.getenv("RETRAIN_SCHEDULER_NICENESS", "10"))
+RETRAIN_FAILURE_BACKOFF_SECONDS = int(os.getenv("RETRAIN_FAILURE_BACKOFF_SECONDS", "300"))
+RETRAIN_FAILURE_BACKOFF_MAX_SECONDS = int(
+    os.getenv("RETRAIN_FAILURE_BACKOFF_MAX_SECONDS", str(6 * 3600))
+)
+
 # --- 🔐 Настройки безопасности JWT ---
 """
 Конфигурация JWT токенов для аутентификации.
@@ -106,7 +314,7 @@ ROLES = {
 Автоматически создаём все необходимые папки при импорте модуля.
 Параметр exist_ok=True — не вызывает ошибку, если папка уже существует.
 """
-for path in [MODELS_DIR, DATA_DIR, REPORTS_DIR, IMAGES_DIR, LOGS_DIR]:
+for path in [MODELS_DIR, DATA_DIR, REPORTS_DIR, IMAGES_DIR, ARTIFACTS_DIR, LOGS_DIR]:
     path.mkdir(exist_ok=True)
 
 
@@ -115,8 +323,8 @@ for path in [MODELS_DIR, DATA_DIR, REPORTS_DIR, IMAGES_DIR, LOGS_DIR]:
 Примеры использования в других модулях:
 
 # В services/utils.py
-from shared.config import ENSEMBLE_MODEL_PATH, FEATURE_NAMES_PATH
-model = joblib.load(ENSEMBLE_MODEL_PATH)
+from shared.model_store import get_artifact_path
+model = joblib.load(get_artifact_path("model"))
 
 # В app/main.py
 from shared.config import DATA_SOURCE
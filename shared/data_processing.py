@@ -5,29 +5,32 @@
 Модуль реализует:
 - Feature engineering (например, loan_to_income_ratio)
 - One-Hot Encoding категориальных признаков
+- Скомпилированный кодировщик признаков (FeatureEncoder)
 - Предобработку данных для предсказания и обучения
 - Автоматическое дообучение при накоплении фидбэков
 
 Основные функции:
 - feature_engineering: создание новых признаков
+- FeatureEncoder: кодирование заемщиков в матрицу float32
+- load_feature_encoder: построение кодировщика из feature_names.pkl
 - preprocess_data_for_prediction: обработка входных данных заемщика
 - preprocess_data: подготовка данных для обучения модели
 - check_and_retrain: автоматическое дообучение модели
+    (app/services/scheduler.py)
 
 Автор: [Кочнева Арина]
 Год: 2025
 """
 
 import pandas as pd
+import numpy as np
 from pathlib import Path
 import joblib
 import logging
 
 # Импорт путей из централизованной конфигурации
-from shared.config import (
-    FEATURE_NAMES_PATH,
-    DATA_DIR
-)
+from shared.config import DATA_DIR
+from shared.model_store import get_artifact_path
 
 
 logger = logging.getLogger(__name__)
@@ -56,6 +59,18 @@ CATEGORIES = {
 }
 
 
+# --- 🔹 Числовые признаки в порядке обучения ---
+"""
+Порядок совпадает с порядком колонок, который формирует preprocess_data
+на исходном датасете: числовые признаки, loan_to_income_ratio, затем OHE.
+"""
+NUMERIC_FEATURES = [
+    'person_age', 'person_income', 'person_emp_length', 'loan_amnt',
+    'loan_int_rate', 'loan_percent_income', 'cb_person_cred_hist_length'
+]
+RATIO_FEATURE = 'loan_to_income_ratio'
+
+
 def feature_engineering(df: pd.DataFrame) -> pd.DataFrame:
     """
     Добавляет новые признаки на основе существующих.
@@ -82,51 +97,249 @@ def feature_engineering(df: pd.DataFrame) -> pd.DataFrame:
     return df
 
 
-def preprocess_data_for_prediction(df: pd.DataFrame) -> pd.DataFrame:
+def _ratio_input(df: pd.DataFrame, name: str) -> np.ndarray:
+    """Колонка для loan_to_income_ratio во float64 (NaN, если колонки нет)."""
+    if name not in df.columns:
+        return np.full(len(df), np.nan)
+    return df[name].to_numpy(dtype=np.float64, na_value=np.nan)
+
+
+class FeatureEncoder:
+    """
+    Скомпилированный кодировщик признаков заемщика.
+
+    Строится один раз по списку фичей обученной модели и хранит:
+        - порядок колонок (feature_names)
+        - индексы числовых признаков в выходной матрице
+        - отображения категория -> индекс колонки для OHE
+
+    Кодирование пишет значения напрямую в предвыделенную матрицу
+    float32, без промежуточных DataFrame и без обращений к диску.
+
+    Args:
+        feature_names (list): Список фичей в порядке обучения модели
+
+    Пример:
+        >>> encoder = FeatureEncoder(joblib.load(get_artifact_path("feature_names")))
+        >>> X = encoder.transform(pd.DataFrame([request.model_dump()]))
+        >>> X.shape
+        (1, 27)
+
+    Примечания:
+        - Неизвестные категории и NaN кодируются нулями (как в OHE)
+        - Отсутствующие во входных данных числовые колонки
+          заполняются нулями
+        - Если loan_amnt или person_income нет (или значение None),
+          loan_to_income_ratio равен NaN: такие строки отклоняет
+          прогноз, как и строки с нулевым доходом
+        - Деревья моделей работают во float32, поэтому точность
+          предсказаний не меняется
+    """
+
+    def __init__(self, feature_names):
+        self.feature_names = list(feature_names)
+        self.n_features = len(self.feature_names)
+
+        index = {name: i for i, name in enumerate(self.feature_names)}
+        ohe_names = set()
+
+        # Категория -> индекс выходной колонки (-1, если фичи нет в модели)
+        self._categorical = {}
+        for col, categories in CATEGORIES.items():
+            positions = np.array(
+                [index.get(f"{col}_{cat}", -1) for cat in categories],
+                dtype=np.intp
+            )
+            self._categorical[col] = (pd.Index(categories), positions)
+            ohe_names.update(f"{col}_{cat}" for cat in categories)
+
+        # Те же отображения в виде dict — для кодирования записей (dict)
+        self._category_positions = {
+            col: {
+                cat: int(position)
+                for cat, position in zip(categories, positions)
+                if position >= 0
+            }
+            for col, (categories, positions) in self._categorical.items()
+        }
+
+        self._ratio_position = index.get(RATIO_FEATURE)
+        self._numeric = [
+            (i, name) for i, name in enumerate(self.feature_names)
+            if name not in ohe_names and name != RATIO_FEATURE
+        ]
+
+    @classmethod
+    def default(cls) -> "FeatureEncoder":
+        """
+        Кодировщик с полным набором фичей, который формирует
+        preprocess_data на исходном датасете.
+
+        Используется, если feature_names.pkl ещё не создан.
+        """
+        feature_names = NUMERIC_FEATURES + [RATIO_FEATURE] + [
+            f"{col}_{cat}"
+            for col, categories in CATEGORIES.items()
+            for cat in categories
+        ]
+        return cls(feature_names)
+
+    def transform(self, df) -> np.ndarray:
+        """
+        Кодирует заемщиков в матрицу признаков.
+
+        Args:
+            df (pd.DataFrame или list[dict]): Исходные данные (поля
+                LoanRequest). Список словарей кодируется без pandas —
+                это самый быстрый путь для одиночных запросов API
+
+        Returns:
+            np.ndarray: Матрица float32 формы (len(df), n_features)
+        """
+        if not isinstance(df, pd.DataFrame):
+            return self._transform_records(df)
+
+        n_rows = len(df)
+        X = np.zeros((n_rows, self.n_features), dtype=np.float32)
+
+        for position, name in self._numeric:
+            if name in df.columns:
+                X[:, position] = df[name].to_numpy(dtype=np.float32)
+
+        if self._ratio_position is not None:
+            # Нулевой доход даёт inf: такие строки отклоняет прогноз
+            # (см. predict_loan_status_batch), предупреждение не нужно
+            with np.errstate(divide="ignore", invalid="ignore"):
+                X[:, self._ratio_position] = (
+                    _ratio_input(df, 'loan_amnt')
+                    / _ratio_input(df, 'person_income')
+                )
+
+        rows = np.arange(n_rows)
+        for col, (categories, positions) in self._categorical.items():
+            if col not in df.columns:
+                continue
+            codes = categories.get_indexer(df[col])
+            columns = np.where(codes >= 0, positions[codes], -1)
+            mask = columns >= 0
+            X[rows[mask], columns[mask]] = 1.0
+
+        return X
+
+    def _transform_records(self, records) -> np.ndarray:
+        """Кодирует список словарей построчно, без создания DataFrame."""
+        X = np.zeros((len(records), self.n_features), dtype=np.float32)
+
+        for row, record in zip(X, records):
+            for position, name in self._numeric:
+                value = record.get(name, 0)
+                row[position] = np.nan if value is None else value
+
+            if self._ratio_position is not None:
+                loan_amnt = record.get('loan_amnt')
+                person_income = record.get('person_income')
+                with np.errstate(divide="ignore", invalid="ignore"):
+                    row[self._ratio_position] = (
+                        np.nan if loan_amnt is None or person_income is None
+                        else np.float64(loan_amnt) / person_income
+                    )
+
+            for col, mapping in self._category_positions.items():
+                position = mapping.get(record.get(col))
+                if position is not None:
+                    row[position] = 1.0
+
+        return X
+
+    def transform_frame(self, df) -> pd.DataFrame:
+        """
+        Кодирует заемщиков и оборачивает матрицу в DataFrame
+        с колонками feature_names (без копирования данных).
+
+        Нужен для моделей, обученных на DataFrame и проверяющих
+        имена признаков.
+
+        Args:
+            df (pd.DataFrame или list[dict]): Исходные данные (поля
+                LoanRequest)
+
+        Returns:
+            pd.DataFrame: Обработанные данные в порядке feature_names
+        """
+        return pd.DataFrame(
+            self.transform(df),
+            columns=self.feature_names,
+            index=df.index if isinstance(df, pd.DataFrame) else None,
+            copy=False
+        )
+
+
+def load_feature_encoder() -> FeatureEncoder:
+    """
+    Строит FeatureEncoder по feature_names.pkl текущей версии модели.
+
+    Returns:
+        FeatureEncoder: Кодировщик фичей обученной модели или
+            FeatureEncoder.default(), если файл ещё не создан
+    """
+    path = get_artifact_path("feature_names")
+    if path.exists():
+        return FeatureEncoder(joblib.load(path))
+    return FeatureEncoder.default()
+
+
+# --- 🔹 Кэш кодировщика для вызовов без явного encoder ---
+"""
+feature_names.pkl читается только при смене версии модели или
+изменении файла, а не при каждом вызове preprocess_data_for_prediction.
+"""
+_cached_encoder = None
+_cached_encoder_key = None
+
+
+def _get_cached_encoder() -> FeatureEncoder:
+    global _cached_encoder, _cached_encoder_key
+
+    path = get_artifact_path("feature_names")
+    key = (path, path.stat().st_mtime_ns if path.exists() else None)
+    if _cached_encoder is None or key != _cached_encoder_key:
+        _cached_encoder = load_feature_encoder()
+        _cached_encoder_key = key
+    return _cached_encoder
+
+
+def preprocess_data_for_prediction(
+        df: pd.DataFrame,
+        encoder: FeatureEncoder = None
+) -> pd.DataFrame:
     """
     Подготавливает данные заемщика для предсказания модели.
 
     Этапы:
         1. Создание новых признаков (feature engineering)
         2. One-Hot Encoding категориальных переменных
-        3. Удаление исходных категориальных колонок
-        4. Выравнивание с ожидаемыми фичами из обученной модели
+        3. Выравнивание с ожидаемыми фичами из обученной модели
+
+    Все этапы выполняет FeatureEncoder за один проход.
 
     Args:
         df (pd.DataFrame): Данные одного или нескольких заемщиков
+        encoder (FeatureEncoder): Кодировщик фичей модели. Если не
+            передан, используется кэшированный кодировщик по
+            feature_names.pkl
 
     Returns:
         pd.DataFrame: Обработанный датафрейм с правильным порядком и количеством фичей
 
-    Raises:
-        ValueError: Если отсутствуют обязательные колонки
-        Exception: При ошибках загрузки feature_names.pkl
-
     Особенности:
-        - Если feature_names.pkl не существует, используется текущий набор фичей
+        - Если feature_names.pkl не существует, используется полный набор фичей
         - Недостающие фичи добавляются как 0
         - Лишние фичи удаляются
         - Гарантирует совместимость с моделью, обученной ранее
     """
-
-    df = df.copy()
-    df = feature_engineering(df)
-
-    # One-Hot Encoding
-    for col, categories in CATEGORIES.items():
-        for cat in categories:
-            df[f"{col}_{cat}"] = (df[col] == cat).astype(int)
-        df = df.drop(col, axis=1)
-
-    # Выравнивание по фичам из обученной модели
-    if FEATURE_NAMES_PATH.exists():
-        expected_features = joblib.load(FEATURE_NAMES_PATH)
-        for col in expected_features:
-            if col not in df.columns:
-                df[col] = 0
-        df = df[expected_features]
-
-    return df
+    if encoder is None:
+        encoder = _get_cached_encoder()
+    return encoder.transform_frame(df)
 
 
 def preprocess_data(df: pd.DataFrame) -> (pd.DataFrame, pd.Series):
@@ -0,0 +1,273 @@
+# shared/model_store.py
+"""
+Модуль версионного хранилища артефактов модели
+
+Модуль реализует:
+- Сохранение модели, названий фичей, background_data и метаданных
+    одной версией: models/versions/<версия>/
+- Атомарное переключение текущей версии (файл models/CURRENT)
+- Поиск путей к артефактам текущей (или заданной) версии
+- Удаление старых версий (хранится MODEL_VERSIONS_KEEP последних)
+- Загрузку background_data с отображением .npy в память
+
+Зачем:
+    Раньше /train-final и /retrain перезаписывали ensemble_model.pkl
+    и остальные файлы по одному, и воркер API мог прочитать
+    недописанный pickle или модель от одного обучения с фичами
+    от другого. Теперь версия пишется во временную директорию,
+    переименовывается целиком, и только после этого CURRENT
+    указывает на неё (os.replace атомарен). Воркеры сравнивают
+    CURRENT с загруженной версией (см. app/services/utils.py).
+
+Совместимость:
+    Пока CURRENT нет, используются файлы прежней «плоской» раскладки
+    (models/ensemble_model.pkl и т.д.). background_data в версиях
+    хранится как .npy; прежний background_data.pkl тоже читается.
+
+Автор: [Кочнева Арина]
+Год: 2025
+"""
+
+import json
+import logging
+import os
+import shutil
+import time
+import uuid
+from datetime import datetime
+
+import joblib
+import numpy as np
+import pandas as pd
+
+from shared.config import (
+    MODELS_DIR,
+    MODEL_MMAP,
+    MODEL_VERSIONS_DIR,
+    MODEL_CURRENT_PATH,
+    MODEL_VERSIONS_KEEP,
+    ENSEMBLE_MODEL_PATH,
+    FEATURE_NAMES_PATH,
+    BACKGROUND_DATA_PATH,
+    MODEL_METADATA_PATH
+)
+
+
+logger = logging.getLogger(__name__)
+
+# Имена файлов артефактов внутри версии (те же, что в плоской раскладке,
+# кроме background_data: в версии это массив .npy, см. load_background_data)
+ARTIFACT_FILES = {
+    "model": ENSEMBLE_MODEL_PATH.name,
+    "feature_names": FEATURE_NAMES_PATH.name,
+    "background_data": BACKGROUND_DATA_PATH.with_suffix(".npy").name,
+    "metadata": MODEL_METADATA_PATH.name
+}
+
+# Незавершённые версии (после сбоя во время сохранения) удаляются
+# при очистке, если старше этого срока
+_STALE_TMP_SECONDS = 3600
+
+
+def get_current_version():
+    """
+    Возвращает имя текущей версии модели.
+
+    Returns:
+        str или None: Версия или None, если версий ещё нет
+            (используется плоская раскладка)
+    """
+    try:
+        return MODEL_CURRENT_PATH.read_text(encoding="utf-8").strip() or None
+    except FileNotFoundError:
+        return None
+
+
+def get_model_dir(version: str = None):
+    """
+    Возвращает директорию артефактов версии.
+
+    Args:
+        version (str): Версия (по умолчанию — текущая)
+
+    Returns:
+        Path: models/versions/<версия>/ или models/, если версий нет
+    """
+    version = version or get_current_version()
+    if version is None:
+        return MODELS_DIR
+    return MODEL_VERSIONS_DIR / version
+
+
+def get_artifact_path(name: str, version: str = None):
+    """
+    Возвращает путь к артефакту версии.
+
+    Args:
+        name (str): model | feature_names | background_data | metadata
+        version (str): Версия (по умолчанию — текущая)
+
+    Returns:
+        Path: Путь к файлу (файла может не быть)
+
+    Пример:
+        >>> model = joblib.load(get_artifact_path("model"))
+    """
+    return get_model_dir(version) / ARTIFACT_FILES[name]
+
+
+def read_metadata(version: str = None) -> dict:
+    """
+    Читает model_metadata.json версии.
+
+    Returns:
+        dict: Метаданные или пустой словарь, если файла нет
+            (модели, обученные до появления метаданных)
+    """
+    path = get_artifact_path("metadata", version)
+    if not path.exists():
+        return {}
+    with open(path, encoding="utf-8") as f:
+        return json.load(f)
+
+
+def load_background_data(version: str = None, feature_names=None,
+                         mmap: bool = MODEL_MMAP):
+    """
+    Загружает фоновые данные SHAP версии.
+
+    background_data.npy отображается в память только для чтения:
+    воркеры API делят одни страницы page cache. Если .npy нет
+    (плоская раскладка, ранние версии), читается background_data.pkl.
+
+    Args:
+        version (str): Версия (по умолчанию — текущая)
+        feature_names (list): Названия колонок (по умолчанию —
+            feature_names.pkl версии)
+        mmap (bool): Отображать .npy в память
+
+    Returns:
+        pd.DataFrame: Фоновые данные (колонки в порядке feature_names)
+
+    Raises:
+        FileNotFoundError: Если файла нет
+    """
+    path = get_artifact_path("background_data", version)
+    if not path.exists():
+        return joblib.load(path.with_suffix(".pkl"))
+
+    values = np.load(path, mmap_mode="r" if mmap else None)
+    if feature_names is None:
+        feature_names = joblib.load(get_artifact_path("feature_names", version))
+    # copy=False: DataFrame остаётся представлением отображённого массива
+    return pd.DataFrame(values, columns=list(feature_names), copy=False)
+
+
+def list_model_versions() -> list:
+    """Возвращает сохранённые версии от старых к новым."""
+    if not MODEL_VERSIONS_DIR.exists():
+        return []
+    return sorted(
+        path.name for path in MODEL_VERSIONS_DIR.iterdir()
+        if path.is_dir() and not path.name.startswith(".")
+    )
+
+
+def set_current_version(version: str):
+    """
+    Делает версию текущей (атомарно, через временный файл).
+
+    Можно использовать и для отката на одну из сохранённых версий.
+
+    Raises:
+        ValueError: Если версии нет
+    """
+    if not (MODEL_VERSIONS_DIR / version).is_dir():
+        raise ValueError(f"Версия модели не найдена: {version}")
+    tmp_path = MODEL_CURRENT_PATH.with_name(f".{MODEL_CURRENT_PATH.name}.{os.getpid()}")
+    tmp_path.write_text(version, encoding="utf-8")
+    os.replace(tmp_path, MODEL_CURRENT_PATH)
+
+
+def publish_model_version(model, feature_names, background_data, metadata: dict,
+                          write_extra=None) -> str:
+    """
+    Сохраняет артефакты новой версией и делает её текущей.
+
+    Все файлы пишутся во временную директорию, которая затем
+    переименовывается в versions/<версия>/; CURRENT переключается
+    последним. Читатели видят либо прежнюю версию, либо новую
+    целиком.
+
+    Args:
+        model: Обученная модель
+        feature_names (list): Список признаков в порядке обучения
+        background_data (pd.DataFrame): Фоновые данные для SHAP
+            (сохраняются как float64 .npy в порядке feature_names)
+        metadata (dict): Содержимое model_metadata.json
+        write_extra (callable): Дописывает производные артефакты
+            (например, массивы деревьев TreeSHAP) во временную
+            директорию версии: write_extra(directory). После
+            публикации версия не изменяется
+
+    Returns:
+        str: Имя новой версии
+    """
+    # Время с микросекундами: имена версий упорядочены по времени
+    version = f"{datetime.utcnow():%Y%m%dT%H%M%S%f}-{uuid.uuid4().hex[:6]}"
+    MODEL_VERSIONS_DIR.mkdir(parents=True, exist_ok=True)
+    tmp_dir = MODEL_VERSIONS_DIR / f".tmp-{version}"
+    tmp_dir.mkdir()
+
+    try:
+        joblib.dump(model, tmp_dir / ARTIFACT_FILES["model"])
+        joblib.dump(list(feature_names), tmp_dir / ARTIFACT_FILES["feature_names"])
+        if isinstance(background_data, pd.DataFrame):
+            background_data = background_data[list(feature_names)]
+        np.save(
+            tmp_dir / ARTIFACT_FILES["background_data"],
+            np.asarray(background_data, dtype=np.float64)
+        )
+        with open(tmp_dir / ARTIFACT_FILES["metadata"], "w", encoding="utf-8") as f:
+            json.dump({**metadata, "version": version}, f, ensure_ascii=False, indent=2)
+        if write_extra is not None:
+            write_extra(tmp_dir)
+        os.replace(tmp_dir, MODEL_VERSIONS_DIR / version)
+    except BaseException:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+        raise
+
+    set_current_version(version)
+    logger.info(f"💾 Опубликована версия модели {version}")
+
+    prune_model_versions()
+    return version
+
+
+def prune_model_versions(keep: int = MODEL_VERSIONS_KEEP) -> int:
+    """
+    Удаляет старые версии, оставляя keep последних и текущую.
+
+    Воркеры, уже загрузившие удалённую версию, продолжают работать:
+    модель держится в памяти.
+
+    Returns:
+        int: Количество удалённых версий
+    """
+    current = get_current_version()
+    versions = list_model_versions()
+    expired = [v for v in versions[:max(0, len(versions) - keep)] if v != current]
+    for version in expired:
+        shutil.rmtree(MODEL_VERSIONS_DIR / version, ignore_errors=True)
+
+    stale_before = time.time() - _STALE_TMP_SECONDS
+    for path in MODEL_VERSIONS_DIR.glob(".tmp-*"):
+        try:
+            if path.stat().st_mtime < stale_before:
+                shutil.rmtree(path, ignore_errors=True)
+        except FileNotFoundError:
+            continue
+
+    if expired:
+        logger.info(f"🧹 Удалено старых версий модели: {len(expired)}")
+    return len(expired)
@@ -17,7 +17,7 @@
 from sqlalchemy import Column, Integer, String, Boolean, Float, DateTime
 from sqlalchemy.orm import declarative_base
 from pydantic import BaseModel, ConfigDict
-from typing import Optional, List
+from typing import Optional, List, Dict, Any
 from datetime import datetime
 
 
@@ -80,6 +80,30 @@ class LoanRequest(BaseModel):
     cb_person_cred_hist_length: int
 
 
+# --- 📦 Pydantic-модель: LoanBatchRequest ---
+class LoanBatchRequest(BaseModel):
+    """
+    Модель пакетного запроса на скоринг.
+
+    Используется в эндпоинте /predict/batch.
+
+    Каждый элемент `applicants` валидируется как LoanRequest
+    по отдельности, поэтому ошибка в одной строке не отклоняет
+    весь пакет — она возвращается в результате для этой строки.
+
+    Attributes:
+        applicants (List[Dict[str, Any]]): Данные заемщиков в формате
+            LoanRequest
+
+    Пример:
+        >>> batch = LoanBatchRequest(applicants=[
+        ...     {"person_age": 35, "person_income": 75000, ...},
+        ...     {"person_age": 41, "person_income": 52000, ...}
+        ... ])
+    """
+    applicants: List[Dict[str, Any]]
+
+
 # --- 🔐 ORM-модель: User (для аутентификации) ---
 class User(Base):
     """
@@ -61,6 +61,21 @@ def db_session():
         engine.dispose()
 
 
+# --- Хранилище версий модели во временной директории ---
+@pytest.fixture
+def model_store_dir(tmp_path, monkeypatch):
+    """
+    Перенаправляет хранилище артефактов модели (shared/model_store.py)
+    во временную директорию: плоская раскладка — сама директория,
+    версии — versions/, указатель — CURRENT.
+    """
+    from shared import model_store
+
+    monkeypatch.setattr(model_store, "MODELS_DIR", tmp_path)
+    monkeypatch.setattr(model_store, "MODEL_VERSIONS_DIR", tmp_path / "versions")
+    monkeypatch.setattr(model_store, "MODEL_CURRENT_PATH", tmp_path / "CURRENT")
+    return tmp_path
+
 # --- Переопределение зависимости get_db приложения на тестовую сессию ---
 @pytest.fixture(autouse=True)
 def override_get_db(db_session):
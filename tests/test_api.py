@@ -19,6 +19,102 @@ class TestRootEndpoint:
         assert "Добро пожаловать" in response.json()["message"]
 
 
+class TestHealthProbes:
+    """Тесты для liveness/readiness проб"""
+
+    def test_liveness(self, client):
+        """Тест, что liveness отвечает без модели и авторизации"""
+        response = client.get("/health/live")
+
+        assert response.status_code == status.HTTP_200_OK
+        assert response.json() == {"status": "alive"}
+
+    def test_not_ready_while_warming_up(self, client, monkeypatch):
+        """Тест, что воркер не готов, пока идёт прогрев"""
+        from app import main
+
+        monkeypatch.setitem(main._readiness, "running", True)
+        response = client.get("/health/ready")
+
+        assert response.status_code == status.HTTP_503_SERVICE_UNAVAILABLE
+        assert response.json()["status"] == "warming_up"
+
+    def test_ready_after_warm_up(self, client, monkeypatch):
+        """Тест, что воркер готов, когда модель загружена"""
+        from app import main
+
+        monkeypatch.setattr(main, "get_loaded_model_version", lambda: "v1")
+        response = client.get("/health/ready")
+
+        assert response.status_code == status.HTTP_200_OK
+        assert response.json()["model_version"] == "v1"
+
+    def test_ready_without_warm_up(self, client, tmp_path, monkeypatch):
+        """Тест, что при MODEL_WARMUP=false модель загружается без прогрева"""
+        import time
+        from app import main
+
+        loaded = {}
+
+        def fail_warm_up():
+            raise AssertionError("прогрев при MODEL_WARMUP=false")
+
+        monkeypatch.setattr(main, "MODEL_WARMUP", False)
+        monkeypatch.setattr(main, "warm_up_model", fail_warm_up)
+        monkeypatch.setattr(main, "get_model_bundle", lambda: loaded.setdefault("version", "v1"))
+        monkeypatch.setattr(main, "get_loaded_model_version", lambda: loaded.get("version"))
+        monkeypatch.setattr(main, "get_artifact_path", lambda name: tmp_path)
+        monkeypatch.setitem(main._readiness, "running", False)
+        monkeypatch.setitem(main._readiness, "warmup", None)
+
+        # Загрузку запускает сама проба: трафика до готовности нет
+        response = client.get("/health/ready")
+        deadline = time.time() + 5
+        while response.status_code != status.HTTP_200_OK and time.time() < deadline:
+            time.sleep(0.01)
+            response = client.get("/health/ready")
+
+        assert response.status_code == status.HTTP_200_OK
+        assert response.json()["model_version"] == "v1"
+        assert main._readiness["error"] is None
+
+
+class TestLatencyMetrics:
+    """Тесты для гистограмм времени ответа"""
+
+    def test_prometheus_histogram_by_route(self, client, monkeypatch):
+        """Тест, что запросы учитываются по шаблону пути и коду ответа"""
+        from app import main
+        from app.services.latency import LatencyHistograms
+
+        monkeypatch.setattr(main, "latency", LatencyHistograms(buckets=(0.1, 1.0)))
+        client.get("/health/live")
+        client.get("/jobs/" + "0" * 32)
+
+        response = client.get("/metrics/prometheus")
+
+        assert response.status_code == status.HTTP_200_OK
+        assert response.headers["content-type"].startswith("text/plain")
+        body = response.text
+        assert "# TYPE http_request_duration_seconds histogram" in body
+        assert 'endpoint="GET /health/live",status="200",le="+Inf"} 1' in body
+        assert 'endpoint="GET /jobs/{job_id}",status="401"' in body
+        assert "0" * 32 not in body
+
+    def test_metrics_reports_percentiles(self, admin_client, monkeypatch):
+        """Тест, что /metrics возвращает p50/p95/p99 по эндпоинтам"""
+        from app import main
+        from app.services.latency import LatencyHistograms
+
+        monkeypatch.setattr(main, "latency", LatencyHistograms())
+        admin_client.get("/health/live")
+
+        data = admin_client.get("/metrics").json()
+
+        assert data["response_time_p99"] >= data["response_time_p50"] > 0
+        assert data["latency_by_endpoint"]["GET /health/live"]["200"]["count"] == 1
+
+
 class TestAuthEndpoints:
     """Тесты для эндпоинтов авторизации"""
     
@@ -101,9 +197,125 @@ class TestPredictEndpoints:
     def test_explain_requires_auth(self, client, sample_loan_request):
         """Тест, что /explain требует авторизацию"""
         response = client.post("/explain", json=sample_loan_request)
-        
+
         assert response.status_code == status.HTTP_403_FORBIDDEN
 
+    def test_explain_invalid_render(self, authenticated_client, sample_loan_request):
+        """Тест, что /explain отклоняет неизвестный формат render"""
+        response = authenticated_client.post(
+            "/explain?render=gif", json=sample_loan_request
+        )
+
+        assert response.status_code == status.HTTP_422_UNPROCESSABLE_ENTITY
+
+    def test_explain_runs_in_inference_pool(self, authenticated_client, sample_loan_request, monkeypatch):
+        """Тест, что /explain считается в пуле инференса, а /health не ждёт его"""
+        import threading
+        from app import main
+
+        started = threading.Event()
+        release = threading.Event()
+        threads = []
+
+        def fake_explain(data, render):
+            threads.append(threading.current_thread().name)
+            started.set()
+            release.wait(5)
+            return {"prediction": 0}
+
+        monkeypatch.setattr(main, "explain_prediction", fake_explain)
+        explain_thread = threading.Thread(
+            target=authenticated_client.post, args=("/explain",),
+            kwargs={"json": sample_loan_request}
+        )
+        explain_thread.start()
+        try:
+            assert started.wait(5)
+            assert main.inference_executor.stats()["running"] == 1
+            assert authenticated_client.get("/health").status_code == status.HTTP_200_OK
+        finally:
+            release.set()
+            explain_thread.join(5)
+
+        assert threads[0].startswith("inference")
+
+    def test_predict_batch_requires_auth(self, client, sample_loan_request):
+        """Тест, что /predict/batch требует авторизацию"""
+        response = client.post(
+            "/predict/batch",
+            json={"applicants": [sample_loan_request]}
+        )
+
+        assert response.status_code in [
+            status.HTTP_401_UNAUTHORIZED,
+            status.HTTP_403_FORBIDDEN
+        ]
+
+    def test_predict_batch_reports_row_errors(self, authenticated_client, sample_loan_request):
+        """Тест, что невалидные строки получают ошибки, не ломая пакет"""
+        invalid = sample_loan_request.copy()
+        del invalid["person_age"]
+
+        response = authenticated_client.post(
+            "/predict/batch",
+            json={"applicants": [invalid, {"person_age": "abc"}]}
+        )
+
+        assert response.status_code == status.HTTP_200_OK
+        data = response.json()
+        assert data["total"] == 2
+        assert data["failed"] == 2
+        assert [r["index"] for r in data["results"]] == [0, 1]
+        assert all("errors" in r for r in data["results"])
+
+    def test_predict_batch_matches_single_predictions(self, authenticated_client, sample_loan_request,
+                                                      model_store_dir, monkeypatch):
+        """Тест, что пакет скорит строки так же, как /predict, а строка с inf — только себя"""
+        import numpy as np
+        from sklearn.linear_model import LogisticRegression
+        from app.services import utils
+        from shared.model_store import publish_model_version
+
+        monkeypatch.setattr(utils, "_bundle", None)
+        monkeypatch.setattr(utils, "_failed_version", None)
+        features = ["person_age", "loan_int_rate", "loan_to_income_ratio"]
+        rng = np.random.default_rng(0)
+        X = rng.uniform([20, 5, 0.05], [60, 20, 0.6], size=(200, 3))
+        y = (X[:, 2] + rng.normal(0, 0.1, 200) > 0.3).astype(int)
+        publish_model_version(
+            LogisticRegression().fit(X, y), features, X[:20], {"decision_threshold": 0.5}
+        )
+
+        applicants = [
+            sample_loan_request,
+            {**sample_loan_request, "person_income": 0},
+            {**sample_loan_request, "person_age": 52, "loan_amnt": 40000, "loan_int_rate": 17.5}
+        ]
+        response = authenticated_client.post("/predict/batch", json={"applicants": applicants})
+
+        assert response.status_code == status.HTTP_200_OK
+        data = response.json()
+        assert (data["total"], data["succeeded"], data["failed"]) == (3, 2, 1)
+        assert "loan_to_income_ratio" in data["results"][1]["errors"][0]["msg"]
+        for i in (0, 2):
+            single = authenticated_client.post("/predict", json=applicants[i]).json()
+            row = data["results"][i]
+            assert row["prediction"] == single["prediction"]
+            assert row["probability_default"] == pytest.approx(single["probability_default"])
+        assert data["results"][0]["probability_default"] != data["results"][2]["probability_default"]
+
+    def test_predict_batch_too_large(self, authenticated_client, sample_loan_request, monkeypatch):
+        """Тест отклонения пакета больше BATCH_PREDICT_MAX_ROWS"""
+        from app import main
+        monkeypatch.setattr(main, "BATCH_PREDICT_MAX_ROWS", 1)
+
+        response = authenticated_client.post(
+            "/predict/batch",
+            json={"applicants": [sample_loan_request, sample_loan_request]}
+        )
+
+        assert response.status_code == status.HTTP_413_REQUEST_ENTITY_TOO_LARGE
+
 
 class TestFeedbackEndpoints:
     """Тесты для эндпоинтов фидбэка"""
@@ -149,12 +361,21 @@ class TestAdminEndpoints:
         assert response.status_code == status.HTTP_403_FORBIDDEN, \
             f"Expected 403, got {response.status_code}. Response: {response.json() if response.status_code != 200 else 'OK'}"
     
-    def test_train_with_admin(self, admin_client):
-        """Тест обучения модели с правами администратора"""
+    def test_train_with_admin(self, admin_client, tmp_path, monkeypatch):
+        """Тест, что /train-final ставит обучение в очередь и его можно отменить"""
+        from app.services import artifacts
+        monkeypatch.setattr(artifacts, "ARTIFACTS_DIR", tmp_path)
+
         response = admin_client.post("/train-final")
-        
-        # Может быть 200 (если данные есть) или 500 (если данных нет)
-        assert response.status_code in [status.HTTP_200_OK, status.HTTP_500_INTERNAL_SERVER_ERROR]
+
+        assert response.status_code == status.HTTP_202_ACCEPTED
+        job_id = response.json()["job_id"]
+
+        cancel_response = admin_client.post(f"/jobs/{job_id}/cancel")
+        assert cancel_response.status_code == status.HTTP_200_OK
+
+        result_response = admin_client.get(f"/jobs/{job_id}/result")
+        assert result_response.status_code == status.HTTP_409_CONFLICT
     
     def test_retrain_requires_admin_or_analyst(self, authenticated_client):
         """Тест, что /retrain требует роль admin или analyst"""
@@ -185,6 +406,16 @@ class TestAdminEndpoints:
             status.HTTP_400_BAD_REQUEST
         ]
 
+    def test_retrain_conflict_while_running(self, analyst_client, tmp_path, monkeypatch):
+        """Тест: пока идёт дообучение, /retrain возвращает 409"""
+        from app.services import scheduler
+
+        monkeypatch.setattr(scheduler, "RETRAIN_LOCK_PATH", tmp_path / ".retrain.lock")
+        with scheduler.retrain_lock():
+            response = analyst_client.post("/retrain")
+
+        assert response.status_code == status.HTTP_409_CONFLICT
+
 
 class TestAnalystEndpoints:
     """Тесты для эндпоинтов, требующих роль analyst"""
@@ -217,6 +448,92 @@ class TestAnalystEndpoints:
         assert response.status_code == status.HTTP_403_FORBIDDEN, \
             f"Expected 403, got {response.status_code}. Response: {response.json() if response.status_code != 200 else 'OK'}"
     
+    def test_report_returns_job(self, analyst_client, authenticated_client,
+                                sample_loan_request, tmp_path, monkeypatch):
+        """Тест, что /report ставит задачу в очередь и она видна только автору"""
+        from app.services import artifacts
+        monkeypatch.setattr(artifacts, "ARTIFACTS_DIR", tmp_path)
+
+        response = analyst_client.post("/report", json=sample_loan_request)
+
+        assert response.status_code == status.HTTP_202_ACCEPTED
+        job_id = response.json()["job_id"]
+        assert response.json()["status_url"] == f"/jobs/{job_id}"
+
+        job_response = analyst_client.get(f"/jobs/{job_id}")
+        assert job_response.status_code == status.HTTP_200_OK
+        assert job_response.json()["status"] in ["queued", "running", "done", "failed"]
+
+        other_response = authenticated_client.get(f"/jobs/{job_id}")
+        assert other_response.status_code == status.HTTP_404_NOT_FOUND
+
+    def test_report_waits_for_full_inference_queue(self, analyst_client, sample_loan_request,
+                                                  tmp_path, monkeypatch):
+        """Тест, что принятый отчёт ждёт места в очереди инференса, а не падает"""
+        import threading
+        import time
+        from app import main
+        from app.services import artifacts
+        from app.services.inference import InferenceExecutor
+        from app.services.jobs import get_job_status
+        monkeypatch.setattr(artifacts, "ARTIFACTS_DIR", tmp_path)
+
+        executor = InferenceExecutor(max_workers=1, max_queue=1)
+        monkeypatch.setattr(main, "inference_executor", executor)
+        monkeypatch.setattr(
+            main, "explain_prediction", lambda data, **kwargs: {"prediction": 0}
+        )
+        monkeypatch.setattr(
+            main, "generate_explanation_pdf", lambda data, result, filename: str(filename)
+        )
+
+        # Один вызов выполняется, второй занимает всю очередь
+        release = threading.Event()
+        busy = [executor.submit(release.wait, 5) for _ in range(2)]
+        try:
+            job_id = analyst_client.post("/report", json=sample_loan_request).json()["job_id"]
+            time.sleep(0.2)
+            assert get_job_status(job_id)["status"] == "running"
+
+            release.set()
+            deadline = time.time() + 5
+            while get_job_status(job_id)["status"] == "running" and time.time() < deadline:
+                time.sleep(0.01)
+            assert get_job_status(job_id)["status"] == "done"
+        finally:
+            release.set()
+            for future in busy:
+                future.result(timeout=5)
+            executor.shutdown()
+
+    def test_download_report_only_by_owner(self, analyst_client, authenticated_client,
+                                           test_analyst, tmp_path, monkeypatch):
+        """Тест, что отчёт по ID скачивает только автор задачи"""
+        import time
+        from app import main
+        from app.services import artifacts
+        from app.services.jobs import get_job_status
+        monkeypatch.setattr(artifacts, "ARTIFACTS_DIR", tmp_path)
+
+        def task(directory, set_stage):
+            (directory / "explanation_report.pdf").write_bytes(b"%PDF-1.4")
+            return {"report_id": directory.name}
+
+        job_id = main.report_jobs.submit("report", task, owner_id=test_analyst.id)
+        deadline = time.time() + 5
+        while get_job_status(job_id)["status"] != "done" and time.time() < deadline:
+            time.sleep(0.01)
+
+        assert analyst_client.get(f"/download/{job_id}").status_code == status.HTTP_200_OK
+        other_response = authenticated_client.get(f"/download/{job_id}")
+        assert other_response.status_code == status.HTTP_404_NOT_FOUND
+
+    def test_download_unknown_report_id(self, authenticated_client):
+        """Тест, что несуществующий ID отчёта возвращает 404"""
+        response = authenticated_client.get("/download/" + "0" * 32)
+
+        assert response.status_code == status.HTTP_404_NOT_FOUND
+
     def test_compare_with_analyst(self, analyst_client):
         """Тест сравнения моделей с правами аналитика"""
         response = analyst_client.get("/compare")
@@ -224,3 +541,19 @@ class TestAnalystEndpoints:
         # Может быть 200 (если данные есть) или 500 (если данных нет)
         assert response.status_code in [status.HTTP_200_OK, status.HTTP_500_INTERNAL_SERVER_ERROR]
 
+
+    def test_compare_overloaded_returns_429(self, analyst_client, monkeypatch):
+        """Тест, что /compare сверх очереди получает 429 с Retry-After"""
+        from app import main
+        from app.services.admission import AdmissionLimiter
+
+        limiter = AdmissionLimiter("compare", max_concurrent=1, max_queue=0,
+                                   retry_after=15)
+        monkeypatch.setattr(main, "compare_limiter", limiter)
+
+        with limiter.slot():
+            response = analyst_client.get("/compare")
+
+        assert response.status_code == status.HTTP_429_TOO_MANY_REQUESTS
+        assert response.headers["Retry-After"] == "15"
+        assert limiter.stats()["rejected"] == 1
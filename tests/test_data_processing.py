@@ -8,6 +8,7 @@ import pandas as pd
 import numpy as np
 
 from shared.data_processing import (
+    FeatureEncoder,
     feature_engineering,
     preprocess_data,
     preprocess_data_for_prediction
@@ -181,3 +182,92 @@ class TestPreprocessDataForPrediction:
         assert isinstance(result, pd.DataFrame)
         assert len(result) == 1
 
+    def test_preprocess_batch_matches_row_by_row(self, sample_loan_request):
+        """Тест, что пакетная предобработка совпадает с построчной"""
+        rows = [
+            sample_loan_request,
+            {**sample_loan_request, "loan_grade": "E", "person_income": 30000},
+            {**sample_loan_request, "loan_intent": "UNKNOWN"}
+        ]
+        df = pd.DataFrame(rows, index=[10, 20, 30])
+        encoder = FeatureEncoder.default()
+
+        batch = preprocess_data_for_prediction(df.reset_index(drop=True), encoder=encoder)
+        row_by_row = pd.concat(
+            [preprocess_data_for_prediction(pd.DataFrame([row]), encoder=encoder) for row in rows],
+            ignore_index=True
+        )
+
+        pd.testing.assert_frame_equal(batch, row_by_row)
+
+
+class TestFeatureEncoder:
+    """Тесты для скомпилированного кодировщика признаков"""
+
+    def test_encoder_matches_preprocess_data(self, sample_loan_request):
+        """Тест совпадения кодирования с обучающей предобработкой"""
+        rows = [sample_loan_request, dict(sample_loan_request, person_home_ownership="OWN", loan_grade="G")]
+        df = pd.DataFrame(rows)
+        X_train, _ = preprocess_data(df.assign(loan_status=[0, 1]))
+
+        encoder = FeatureEncoder(X_train.columns.tolist())
+        X = encoder.transform(df)
+
+        assert X.dtype == np.float32
+        assert X.shape == X_train.shape
+        np.testing.assert_allclose(X, X_train.to_numpy(dtype=np.float64), rtol=1e-6)
+
+    def test_encoder_default_feature_order(self):
+        """Тест порядка фичей по умолчанию: числовые, ratio, OHE"""
+        encoder = FeatureEncoder.default()
+
+        assert encoder.feature_names[0] == "person_age"
+        assert encoder.feature_names[7] == "loan_to_income_ratio"
+        assert encoder.feature_names[-1] == "cb_person_default_on_file_Y"
+        assert encoder.n_features == 27
+
+    def test_encoder_unknown_category_is_zero(self, sample_loan_request):
+        """Тест, что неизвестная категория кодируется нулями"""
+        df = pd.DataFrame([dict(sample_loan_request, loan_intent="UNKNOWN")])
+        encoder = FeatureEncoder.default()
+
+        result = encoder.transform_frame(df)
+
+        intent_columns = [c for c in result.columns if c.startswith("loan_intent_")]
+        assert result[intent_columns].to_numpy().sum() == 0
+        assert result["loan_grade_B"].iloc[0] == 1
+
+    def test_encoder_drops_features_missing_in_model(self, sample_loan_request):
+        """Тест, что фичи вне списка модели не попадают в матрицу"""
+        encoder = FeatureEncoder(["person_age", "loan_grade_B", "loan_to_income_ratio"])
+
+        X = encoder.transform(pd.DataFrame([sample_loan_request]))
+
+        assert X.shape == (1, 3)
+        assert X[0, 0] == 35
+        assert X[0, 1] == 1
+        assert X[0, 2] == pytest.approx(20000 / 75000)
+
+    def test_encoder_missing_ratio_column_is_nan(self, sample_loan_request):
+        """Тест, что без person_income DataFrame кодируется с NaN в ratio"""
+        encoder = FeatureEncoder(["person_age", "loan_amnt", "loan_to_income_ratio"])
+        df = pd.DataFrame([sample_loan_request]).drop(columns=["person_income", "loan_amnt"])
+
+        X = encoder.transform(df)
+
+        assert X[0, 0] == 35
+        assert X[0, 1] == 0
+        assert np.isnan(X[0, 2])
+
+    def test_encoder_missing_ratio_field_in_record_is_nan(self, sample_loan_request):
+        """Тест, что запись без loan_amnt или с person_income=None даёт NaN в ratio"""
+        encoder = FeatureEncoder(["person_age", "loan_to_income_ratio"])
+        records = [
+            {k: v for k, v in sample_loan_request.items() if k != "loan_amnt"},
+            dict(sample_loan_request, person_income=None)
+        ]
+
+        X = encoder.transform(records)
+
+        assert X[:, 0].tolist() == [35, 35]
+        assert np.isnan(X[:, 1]).all()
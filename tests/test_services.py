@@ -0,0 +1,1618 @@
+# tests/test_services.py
+"""
+Unit тесты для сервисов модели (app/services)
+"""
+
+import json
+from unittest.mock import MagicMock
+
+import numpy as np
+import pytest
+
+from app.services import utils
+
+
+class TestDecisionThreshold:
+    """Тесты для вывода метки из вероятностей по порогу решения"""
+
+    def test_default_threshold_matches_argmax(self):
+        """Тест, что порог 0.5 совпадает с soft voting"""
+        proba = np.array([[0.9, 0.1], [0.3, 0.7]])
+
+        assert utils._predict_from_proba(proba, 0.5).tolist() == [0, 1]
+
+    def test_custom_threshold(self):
+        """Тест, что метка определяется сохранённым порогом"""
+        proba = np.array([[0.85, 0.15], [0.75, 0.25]])
+
+        assert utils._predict_from_proba(proba, 0.2).tolist() == [0, 1]
+
+    def test_load_model_metadata(self, model_store_dir):
+        """Тест чтения порога из model_metadata.json"""
+        path = model_store_dir / "model_metadata.json"
+        path.write_text(json.dumps({"decision_threshold": 0.35}))
+
+        assert utils.load_model_metadata()["decision_threshold"] == pytest.approx(0.35)
+
+    def test_load_model_metadata_missing(self, model_store_dir):
+        """Тест, что без метаданных возвращается пустой словарь"""
+        assert utils.load_model_metadata() == {}
+
+
+class TestEnsembleTreeExplainer:
+    """Тесты для точного TreeSHAP ансамбля"""
+
+    @pytest.fixture
+    def ensemble(self):
+        """Небольшой soft voting ансамбль RF + XGBoost"""
+        from sklearn.ensemble import RandomForestClassifier, VotingClassifier
+        from xgboost import XGBClassifier
+
+        rng = np.random.RandomState(0)
+        X = rng.rand(200, 4).astype(np.float32)
+        y = (X[:, 0] + 0.5 * X[:, 1] > 0.8).astype(int)
+        model = VotingClassifier(
+            estimators=[
+                ("rf", RandomForestClassifier(n_estimators=10, max_depth=4, random_state=0)),
+                ("xgb", XGBClassifier(n_estimators=20, max_depth=3))
+            ],
+            voting="soft",
+            weights=[1, 2]
+        )
+        model.fit(X, y)
+        return model, X, ["f0", "f1", "f2", "f3"]
+
+    def test_values_are_additive_to_proba(self, ensemble):
+        """Тест, что base_value + sum(values) совпадает с predict_proba"""
+        from app.services.explainer import EnsembleTreeExplainer
+
+        model, X, feature_names = ensemble
+        values, base_value = EnsembleTreeExplainer(model, feature_names).explain(X[:20])
+
+        assert values.shape == (20, 4)
+        np.testing.assert_allclose(
+            base_value + values.sum(axis=1),
+            model.predict_proba(X[:20])[:, 1],
+            atol=1e-5
+        )
+
+    def test_unsupported_model_falls_back(self):
+        """Тест, что для не-ансамбля возвращается None"""
+        from sklearn.linear_model import LogisticRegression
+        from app.services.explainer import build_tree_explainer
+
+        assert build_tree_explainer(LogisticRegression(), ["f0"]) is None
+
+    def test_memory_mapped_tree_arrays(self, ensemble, tmp_path):
+        """Тест, что массивы деревьев из .npy дают те же значения"""
+        from app.services.explainer import EnsembleTreeExplainer
+
+        model, X, feature_names = ensemble
+        expected, _ = EnsembleTreeExplainer(model, feature_names).explain(X[:20])
+
+        assert EnsembleTreeExplainer(model, feature_names).save_tree_arrays(tmp_path) > 0
+        written = {p.name: p.stat().st_mtime_ns for p in tmp_path.iterdir()}
+
+        # Воркер только отображает уже записанные файлы
+        mapped = EnsembleTreeExplainer(model, feature_names)
+        assert mapped.memory_map(tmp_path) > 0
+        values, _ = mapped.explain(X[:20])
+
+        np.testing.assert_allclose(values, expected)
+        assert {p.name: p.stat().st_mtime_ns for p in tmp_path.iterdir()} == written
+        thresholds = mapped._components[0][2].model.thresholds
+        assert isinstance(thresholds, np.memmap) and not thresholds.flags.writeable
+
+    def test_tree_arrays_written_at_publish(self, ensemble, model_store_dir):
+        """Тест, что массивы деревьев пишутся при публикации, а загрузка версию не меняет"""
+        from app.services.explainer import TREE_ARRAYS_DIR
+        from app.services.model_training import save_model_artifacts
+        from shared.model_store import get_model_dir
+
+        model, X, feature_names = ensemble
+        version = save_model_artifacts(model, feature_names, X[:10])["version"]
+        version_dir = get_model_dir(version)
+        files = {
+            p.relative_to(version_dir): p.stat().st_mtime_ns
+            for p in version_dir.rglob("*")
+        }
+        assert any(p.parent.name == TREE_ARRAYS_DIR for p in files)
+
+        bundle = utils.ModelBundle.load(version)
+
+        assert {
+            p.relative_to(version_dir): p.stat().st_mtime_ns
+            for p in version_dir.rglob("*")
+        } == files
+        thresholds = bundle.tree_explainer._components[0][2].model.thresholds
+        assert isinstance(thresholds, np.memmap)
+
+    def test_missing_tree_arrays_stay_in_memory(self, ensemble, tmp_path):
+        """Тест, что без файлов массивы остаются в памяти и ничего не пишется"""
+        from app.services.explainer import EnsembleTreeExplainer
+
+        model, _, feature_names = ensemble
+        explainer = EnsembleTreeExplainer(model, feature_names)
+
+        assert explainer.memory_map(tmp_path / "tree_arrays") == 0
+        assert not (tmp_path / "tree_arrays").exists()
+
+
+class TestModelCache:
+    """Тесты для кэша модели, SHAP-объяснителя и смены версий"""
+
+    @staticmethod
+    def publish(threshold=0.5):
+        """Публикует версию с маленькой моделью"""
+        from sklearn.linear_model import LogisticRegression
+        from shared.model_store import publish_model_version
+
+        X = np.array([[0.0], [1.0], [2.0], [3.0]])
+        model = LogisticRegression().fit(X, [0, 0, 1, 1])
+        return publish_model_version(
+            model, ["person_age"], X, {"decision_threshold": threshold}
+        )
+
+    @pytest.fixture
+    def store(self, model_store_dir, monkeypatch):
+        """Хранилище во временной директории и чистый кэш utils"""
+        monkeypatch.setattr(utils, "_bundle", None)
+        monkeypatch.setattr(utils, "_failed_version", None)
+        return model_store_dir
+
+    def test_explainer_cached_between_calls(self, store):
+        """Тест, что набор модели не пересоздаётся без новой версии"""
+        self.publish()
+        bundle = utils.get_model_bundle()
+        bundle.shap_explainer = sentinel = object()
+
+        assert utils.get_model_bundle() is bundle
+        assert bundle.shap_explainer is sentinel
+
+    def test_new_version_swapped_in(self, store):
+        """Тест, что новая версия подменяет набор, не трогая прежний"""
+        first_version = self.publish(threshold=0.5)
+        old = utils.get_model_bundle()
+
+        second_version = self.publish(threshold=0.3)
+        new = utils.get_model_bundle()
+
+        assert new is not old
+        assert (old.version, new.version) == (first_version, second_version)
+        assert (old.decision_threshold, new.decision_threshold) == (0.5, 0.3)
+        assert utils.get_feature_encoder() is new.encoder
+
+    def test_broken_version_keeps_serving_previous(self, store):
+        """Тест, что недоступная версия не прерывает обслуживание"""
+        from shared.model_store import get_artifact_path
+
+        self.publish()
+        old = utils.get_model_bundle()
+        version = self.publish()
+        get_artifact_path("model", version).write_bytes(b"not a pickle")
+
+        assert utils.get_model_bundle() is old
+        assert utils._failed_version == version
+
+    def test_versions_published_atomically_and_pruned(self, store, monkeypatch):
+        """Тест, что CURRENT указывает на полную версию, а старые удаляются"""
+        from shared import model_store
+
+        versions = [self.publish() for _ in range(model_store.MODEL_VERSIONS_KEEP + 2)]
+
+        assert model_store.get_current_version() == versions[-1]
+        assert model_store.list_model_versions() == versions[-model_store.MODEL_VERSIONS_KEEP:]
+        assert sorted(p.name for p in model_store.get_model_dir().iterdir()) == sorted(
+            model_store.ARTIFACT_FILES.values()
+        )
+        assert not list((store / "versions").glob(".tmp-*"))
+
+    def test_background_data_memory_mapped(self, store):
+        """Тест, что background_data версии читается из .npy только для чтения"""
+        from shared.model_store import get_artifact_path, load_background_data
+
+        version = self.publish()
+        background = load_background_data(version)
+
+        assert get_artifact_path("background_data", version).suffix == ".npy"
+        assert list(background.columns) == ["person_age"]
+        assert background["person_age"].tolist() == [0.0, 1.0, 2.0, 3.0]
+        assert not background.to_numpy().flags.writeable
+
+    def test_preload_model(self, store):
+        """Тест предзагрузки модели до fork"""
+        import gc
+
+        assert utils.preload_model() is None
+
+        version = self.publish()
+        try:
+            assert utils.preload_model() == version
+        finally:
+            gc.unfreeze()
+        assert utils.get_loaded_model_version() == version
+
+    def test_legacy_layout_reloaded_on_change(self, store):
+        """Тест, что без версий читаются плоские файлы и их перезапись"""
+        import os
+        import joblib
+        from sklearn.linear_model import LogisticRegression
+
+        X = np.array([[0.0], [1.0], [2.0], [3.0]])
+        joblib.dump(LogisticRegression().fit(X, [0, 0, 1, 1]), store / "ensemble_model.pkl")
+        joblib.dump(["person_age"], store / "feature_names.pkl")
+        joblib.dump(X, store / "background_data.pkl")
+
+        bundle = utils.get_model_bundle()
+        assert bundle.version.startswith("legacy-")
+
+        path = store / "ensemble_model.pkl"
+        mtime = path.stat().st_mtime_ns + 1_000_000_000
+        os.utime(path, ns=(mtime, mtime))
+        assert utils.get_model_bundle() is not bundle
+
+    def test_warm_up_loads_model_and_runs_inference(self, store, monkeypatch):
+        """Тест, что прогрев загружает модель и делает пробные предсказания"""
+        explained = []
+        monkeypatch.setattr(
+            utils, "explain_prediction", lambda data, **kw: explained.append(kw)
+        )
+        version = self.publish()
+
+        assert utils.get_loaded_model_version() is None
+        result = utils.warm_up_model(inferences=2, batch_rows=4)
+
+        assert result["version"] == version
+        assert utils.get_loaded_model_version() == version
+        assert explained == [{"render": "png", "use_cache": False}]
+
+
+class TestWaterfallRendering:
+    """Тесты для рендеринга waterfall-графика"""
+
+    @pytest.fixture
+    def explanation(self):
+        """Объяснение одной строки из трёх признаков"""
+        import shap
+
+        return shap.Explanation(
+            values=np.array([0.1, -0.05, 0.02]),
+            base_values=0.2,
+            data=np.array([1.0, 2.0, 3.0]),
+            feature_names=["a", "b", "c"]
+        )
+
+    def test_png_and_svg_from_one_figure(self, explanation, monkeypatch):
+        """Тест, что оба формата кодируются из одного построения графика"""
+        import shap
+
+        calls = []
+        original = shap.waterfall_plot
+        monkeypatch.setattr(
+            utils.shap, "waterfall_plot",
+            lambda *a, **kw: calls.append(1) or original(*a, **kw)
+        )
+
+        images = utils._render_waterfall(explanation, ("png", "svg"))
+
+        assert len(calls) == 1
+        assert images["png"].startswith(b"\x89PNG")
+        assert b"<svg" in images["svg"]
+
+    def test_unknown_render_mode(self):
+        """Тест, что неизвестный формат render отклоняется"""
+        with pytest.raises(ValueError):
+            utils.explain_prediction({}, render="gif")
+
+
+class TestExplanationCache:
+    """Тесты для LRU-кэша объяснений"""
+
+    def test_key_is_canonical(self):
+        """Тест, что ключ не зависит от порядка полей, но зависит от версии модели"""
+        from app.services.cache import make_cache_key
+
+        assert make_cache_key({"a": 1, "b": 2}, "v1") == make_cache_key({"b": 2, "a": 1}, "v1")
+        assert make_cache_key({"a": 1}, "v1") != make_cache_key({"a": 1}, "v2")
+
+    def test_lru_eviction_by_bytes(self):
+        """Тест вытеснения давно использованных записей при превышении лимита"""
+        from app.services.cache import ExplanationCache
+
+        cache = ExplanationCache(max_bytes=250)
+        cache.put("a", 1, size=100)
+        cache.put("b", 2, size=100)
+        cache.get("a")
+        cache.put("c", 3, size=100)
+
+        assert cache.get("b") is None
+        assert cache.get("a") == 1
+        assert cache.stats()["evictions"] == 1
+        assert cache.stats()["bytes"] == 200
+
+    def test_oversized_entry_not_stored(self):
+        """Тест, что запись больше лимита не сохраняется"""
+        from app.services.cache import ExplanationCache
+
+        cache = ExplanationCache(max_bytes=10)
+        cache.put("a", 1, size=100)
+
+        assert cache.get("a") is None
+        assert cache.stats()["entries"] == 0
+
+    def test_repeat_explanation_served_from_cache(self, monkeypatch):
+        """Тест, что повторное объяснение не пересчитывает SHAP"""
+        from app.services.cache import ExplanationCache
+
+        calls = []
+
+        def fake_compute(bundle, input_data):
+            calls.append(input_data)
+            return {
+                "result": {"prediction": 0, "explanation": {"summary": []}},
+                "plot": (np.zeros(1), 0.5, np.zeros(1)),
+                "images": {}
+            }
+
+        bundle = MagicMock(version="v1", feature_names=["f"])
+        monkeypatch.setattr(utils, "get_model_bundle", lambda: bundle)
+        monkeypatch.setattr(utils, "_explanation_cache", ExplanationCache(max_bytes=1 << 20))
+        monkeypatch.setattr(utils, "_compute_explanation", fake_compute)
+
+        first = utils.explain_prediction({"person_age": 30}, render="none")
+        second = utils.explain_prediction({"person_age": 30}, render="none")
+
+        assert first == second
+        assert len(calls) == 1
+        assert utils.get_explanation_cache_stats()["hits"] == 1
+
+    def test_explanation_without_cache(self, monkeypatch):
+        """Тест, что use_cache=False не читает и не пополняет кэш"""
+        from app.services.cache import ExplanationCache
+
+        bundle = MagicMock(version="v1", feature_names=["f"])
+        monkeypatch.setattr(utils, "get_model_bundle", lambda: bundle)
+        monkeypatch.setattr(utils, "_explanation_cache", ExplanationCache(max_bytes=1 << 20))
+        monkeypatch.setattr(
+            utils, "_compute_explanation",
+            lambda bundle, input_data: {
+                "result": {"prediction": 0, "explanation": {"summary": []}},
+                "plot": (np.zeros(1), 0.5, np.zeros(1)),
+                "images": {}
+            }
+        )
+
+        utils.explain_prediction({"person_age": 30}, render="none", use_cache=False)
+        stats = utils.get_explanation_cache_stats()
+
+        assert stats["entries"] == 0
+        assert stats["hits"] == stats["misses"] == 0
+
+
+class TestReportArtifacts:
+    """Тесты для хранения артефактов отчётов"""
+
+    @pytest.fixture
+    def artifacts_dir(self, tmp_path, monkeypatch):
+        """Временная директория артефактов"""
+        from app.services import artifacts
+
+        monkeypatch.setattr(artifacts, "ARTIFACTS_DIR", tmp_path)
+        return tmp_path
+
+    def test_each_report_gets_own_directory(self, artifacts_dir):
+        """Тест, что отчёты получают разные ID и директории"""
+        from app.services.artifacts import create_artifact_dir, get_artifact_pdf
+
+        first_id, first_dir = create_artifact_dir()
+        second_id, second_dir = create_artifact_dir()
+        (first_dir / "explanation_report.pdf").write_bytes(b"%PDF")
+
+        assert first_id != second_id
+        assert first_dir.parent == second_dir.parent == artifacts_dir
+        assert get_artifact_pdf(first_id) == first_dir / "explanation_report.pdf"
+        assert get_artifact_pdf(second_id) is None
+
+    def test_invalid_id_rejected(self, artifacts_dir):
+        """Тест, что ID с обходом путей не принимается"""
+        from app.services.artifacts import get_artifact_pdf
+
+        assert get_artifact_pdf("../../etc/passwd") is None
+
+    def test_cleanup_removes_only_expired(self, artifacts_dir):
+        """Тест удаления артефактов старше TTL"""
+        import os
+        import time
+        from app.services.artifacts import create_artifact_dir, cleanup_expired_artifacts
+
+        old_id, old_dir = create_artifact_dir()
+        new_id, new_dir = create_artifact_dir()
+        expired = time.time() - 7200
+        os.utime(old_dir, (expired, expired))
+
+        assert cleanup_expired_artifacts(ttl_seconds=3600) == 1
+        assert not old_dir.exists()
+        assert new_dir.exists()
+
+
+class TestReportJobQueue:
+    """Тесты для фоновой очереди отчётов"""
+
+    @pytest.fixture
+    def queue(self, tmp_path, monkeypatch):
+        """Очередь с временной директорией артефактов"""
+        from app.services import artifacts
+        from app.services.jobs import ReportJobQueue
+
+        monkeypatch.setattr(artifacts, "ARTIFACTS_DIR", tmp_path)
+        return ReportJobQueue(max_workers=1)
+
+    def test_job_completes_with_result(self, queue):
+        """Тест, что задача выполняется в пуле и сохраняет результат"""
+        from app.services.jobs import get_job_status
+
+        stages = []
+
+        def task(directory, set_stage):
+            set_stage("rendering_pdf")
+            stages.append(get_job_status(directory.name)["stage"])
+            return {"report_id": directory.name}
+
+        job_id = queue.submit("report", task, owner_id=7)
+        queue.shutdown(wait=True)
+        job = get_job_status(job_id)
+
+        assert stages == ["rendering_pdf"]
+        assert job["status"] == "done"
+        assert job["owner_id"] == 7
+        assert job["result"] == {"report_id": job_id}
+
+    def test_failed_job_records_error(self, queue):
+        """Тест, что ошибка задачи сохраняется в статусе"""
+        from app.services.jobs import get_job_status
+
+        def task(directory, set_stage):
+            raise RuntimeError("WeasyPrint недоступен")
+
+        job_id = queue.submit("report", task)
+        queue.shutdown(wait=True)
+        job = get_job_status(job_id)
+
+        assert job["status"] == "failed"
+        assert "WeasyPrint" in job["error"]
+
+    def test_unknown_job(self, queue):
+        """Тест, что неизвестная задача не найдена"""
+        from app.services.jobs import get_job_status
+
+        assert get_job_status("0" * 32) is None
+
+    def test_cancel_running_job(self, queue):
+        """Тест, что отмена прерывает задачу на следующей стадии"""
+        import threading
+        from app.services.jobs import get_job_status, request_job_cancel
+
+        started = threading.Event()
+        proceed = threading.Event()
+
+        def task(directory, set_stage):
+            started.set()
+            proceed.wait(timeout=5)
+            set_stage("rendering_pdf")
+            return {"report_id": directory.name}
+
+        job_id = queue.submit("report", task)
+        started.wait(timeout=5)
+
+        assert request_job_cancel(job_id)
+        proceed.set()
+        queue.shutdown(wait=True)
+
+        assert get_job_status(job_id)["status"] == "cancelled"
+        assert not request_job_cancel(job_id)
+
+    def test_full_queue_rejects_job(self, tmp_path, monkeypatch):
+        """Тест, что сверх max_queue ожидающих задача отклоняется"""
+        import threading
+        from app.services import artifacts
+        from app.services.admission import Overloaded
+        from app.services.jobs import ReportJobQueue
+
+        monkeypatch.setattr(artifacts, "ARTIFACTS_DIR", tmp_path)
+        queue = ReportJobQueue(max_workers=1, max_queue=1)
+        release = threading.Event()
+
+        def task(directory, set_stage):
+            release.wait(timeout=5)
+
+        queue.submit("comparison_report", task)
+        queue.submit("comparison_report", task)
+        with pytest.raises(Overloaded) as exc_info:
+            queue.submit("comparison_report", task)
+        assert exc_info.value.status_code == 429
+        assert queue.stats()["rejected"] == 1
+
+        release.set()
+        queue.shutdown(wait=True)
+        stats = queue.stats()
+        assert (stats["queued"], stats["running"]) == (0, 0)
+
+
+class TestAdmissionLimiter:
+    """Тесты для ограничения нагрузки на тяжёлые эндпоинты"""
+
+    def test_full_queue_rejected_with_429(self):
+        """Тест, что запрос сверх очереди сразу получает 429"""
+        from app.services.admission import AdmissionLimiter, Overloaded
+
+        limiter = AdmissionLimiter("compare", max_concurrent=1, max_queue=0,
+                                   retry_after=15)
+        with limiter.slot():
+            with pytest.raises(Overloaded) as exc_info:
+                with limiter.slot():
+                    pass
+
+        assert exc_info.value.status_code == 429
+        assert exc_info.value.retry_after == 15
+        stats = limiter.stats()
+        assert (stats["running"], stats["rejected"]) == (0, 1)
+
+    def test_queue_timeout_rejected_with_503(self):
+        """Тест, что не дождавшийся места запрос получает 503"""
+        from app.services.admission import AdmissionLimiter, Overloaded
+
+        limiter = AdmissionLimiter("compare", max_concurrent=1, max_queue=1,
+                                   queue_timeout=0.05)
+        with limiter.slot():
+            with pytest.raises(Overloaded) as exc_info:
+                with limiter.slot():
+                    pass
+
+        assert exc_info.value.status_code == 503
+        assert limiter.stats()["waiting"] == 0
+
+    def test_waiting_call_admitted_after_release(self):
+        """Тест, что ожидающий вызов выполняется, когда место освобождается"""
+        import threading
+        import time
+        from app.services.admission import AdmissionLimiter
+
+        limiter = AdmissionLimiter("compare", max_concurrent=1, max_queue=1,
+                                   queue_timeout=5)
+        done = []
+
+        def waiter():
+            with limiter.slot():
+                done.append(True)
+
+        with limiter.slot():
+            thread = threading.Thread(target=waiter)
+            thread.start()
+            while limiter.stats()["waiting"] == 0:
+                time.sleep(0.01)
+            assert not done
+        thread.join(timeout=5)
+
+        assert done == [True]
+
+
+class TestTrainingJobs:
+    """Тесты для обучения ансамбля по моделям и фоновой задачи обучения"""
+
+    @pytest.fixture
+    def data(self):
+        import pandas as pd
+
+        rng = np.random.default_rng(0)
+        X = pd.DataFrame(rng.normal(size=(80, 3)), columns=["a", "b", "c"])
+        y = pd.Series((X["a"] + rng.normal(size=80) > 0).astype(int))
+        return X, y
+
+    def test_fit_ensemble_matches_voting_fit(self, data, monkeypatch):
+        """Тест, что собранный ансамбль совпадает с VotingClassifier.fit"""
+        from catboost import CatBoostClassifier
+        from sklearn.ensemble import VotingClassifier
+        from app.services import model_training
+
+        # Короткий CatBoost, чтобы тест был быстрым
+        build = model_training.build_ensemble_estimators
+        monkeypatch.setattr(
+            model_training, "build_ensemble_estimators",
+            lambda: build()[:2] + [
+                ("cb", CatBoostClassifier(iterations=20, silent=True, random_state=42))
+            ]
+        )
+
+        X, y = data
+        events = []
+        model = model_training.fit_ensemble(X, y, on_progress=events.append)
+        reference = VotingClassifier(
+            model_training.build_ensemble_estimators(), voting="soft"
+        ).fit(X, y)
+
+        np.testing.assert_allclose(
+            model.predict_proba(X), reference.predict_proba(X), atol=1e-6
+        )
+        assert list(model.named_estimators_) == ["rf", "xgb", "cb"]
+        assert [e["event"] for e in events] == [
+            "estimator_started", "estimator_finished"
+        ] * 3
+        assert all(e["seconds"] >= 0 for e in events if "seconds" in e)
+
+    def test_training_error_fails_job(self, tmp_path, monkeypatch):
+        """Тест, что ошибка в процессе обучения переводит задачу в failed"""
+        import pandas as pd
+        from app.services import artifacts
+        from app.services.jobs import ReportJobQueue, get_job_status
+        from app.services.training_jobs import make_training_task
+
+        monkeypatch.setattr(artifacts, "ARTIFACTS_DIR", tmp_path)
+        queue = ReportJobQueue(max_workers=1)
+
+        job_id = queue.submit(
+            "train_final", make_training_task(pd.DataFrame(), pd.Series(dtype=int), 0.5)
+        )
+        queue.shutdown(wait=True)
+        job = get_job_status(job_id)
+
+        assert job["status"] == "failed"
+        assert "пуста" in job["error"]
+        assert job["progress"]["completed"] == 0
+
+    def test_cancel_does_not_interrupt_saving(self, tmp_path, monkeypatch):
+        """Тест, что отмена во время сохранения модели не завершает процесс"""
+        import multiprocessing
+        import queue as queue_module
+        import threading
+        from app.services import artifacts, training_jobs
+        from app.services.jobs import ReportJobQueue, get_job_status, request_job_cancel
+
+        monkeypatch.setattr(artifacts, "ARTIFACTS_DIR", tmp_path)
+        terminated = []
+
+        class FakeProcess:
+            """Процесс, который начал сохранение, когда пришла отмена"""
+
+            def __init__(self, target, args, name, daemon):
+                self.state, self.events = args[-2:]
+                self.name, self.exitcode = name, None
+                self.alive = False
+
+            def start(self):
+                self.alive = True
+                # Процесс уже начал сохранение, но событие saving
+                # ещё не дошло до родителя
+                training_jobs._progress_reporter(self.state, queue_module.Queue())(
+                    {"event": "saving"}
+                )
+                request_job_cancel(self.name[len("train-"):])
+                threading.Timer(0.2, self.finish).start()
+
+            def finish(self):
+                self.events.put({"event": "done", "result": {"version": "v1"}})
+                self.alive = False
+
+            def is_alive(self):
+                return self.alive
+
+            def terminate(self):
+                terminated.append(self.name)
+
+            def join(self):
+                pass
+
+        class FakeContext:
+            Queue = queue_module.Queue
+            Process = FakeProcess
+            Value = staticmethod(multiprocessing.Value)
+
+        monkeypatch.setattr(
+            training_jobs.multiprocessing, "get_context", lambda method: FakeContext
+        )
+        queue = ReportJobQueue(max_workers=1)
+
+        job_id = queue.submit("train_final", training_jobs.make_training_task(None, None, 0.5))
+        queue.shutdown(wait=True)
+        job = get_job_status(job_id)
+
+        assert job["status"] == "done"
+        assert job["result"] == {"version": "v1"}
+        assert terminated == []
+
+    def test_cancelled_process_does_not_start_saving(self):
+        """Тест, что после фиксации отмены процесс не начинает сохранение"""
+        import multiprocessing
+        import queue as queue_module
+        from app.services import training_jobs
+
+        state = multiprocessing.Value("i", training_jobs.STATE_TRAINING)
+        events = queue_module.Queue()
+        report = training_jobs._progress_reporter(state, events)
+
+        report({"event": "estimator_finished", "index": 0})
+        assert training_jobs._claim_cancel(state)
+
+        with pytest.raises(training_jobs.TrainingCancelled):
+            report({"event": "saving"})
+        assert state.value == training_jobs.STATE_CANCEL_REQUESTED
+        assert [events.get_nowait()["event"]] == ["estimator_finished"]
+        assert events.empty()
+
+    def test_cancel_refused_while_saving(self):
+        """Тест, что отмена не фиксируется, когда процесс уже сохраняет модель"""
+        import multiprocessing
+        import queue as queue_module
+        from app.services import training_jobs
+
+        state = multiprocessing.Value("i", training_jobs.STATE_TRAINING)
+        training_jobs._progress_reporter(state, queue_module.Queue())({"event": "saving"})
+
+        assert not training_jobs._claim_cancel(state)
+        assert state.value == training_jobs.STATE_SAVING
+
+
+class TestReportTemplates:
+    """Тесты для шаблонов и стилей PDF-отчётов"""
+
+    def test_templates_compiled_once(self):
+        """Тест, что шаблоны берутся из кэша Environment"""
+        from app.services import reporting
+
+        first = reporting._jinja_env.get_template("explanation_report.html")
+        second = reporting._jinja_env.get_template("explanation_report.html")
+
+        assert first is second
+
+    def test_stylesheet_cached(self):
+        """Тест, что таблица стилей разбирается один раз"""
+        from app.services import reporting
+
+        assert reporting.get_report_stylesheet() is reporting.get_report_stylesheet()
+
+    def test_comparison_template_renders(self):
+        """Тест рендеринга шаблона сравнения моделей"""
+        from app.services import reporting
+
+        html = reporting._jinja_env.get_template("model_comparison_report.html").render(
+            results=[{"model": "XGBoost", "accuracy": 0.9312, "auc": 0.9456}],
+            roc_auc_path="roc_auc.png",
+            now="01.01.2025 10:00"
+        )
+
+        assert "XGBoost" in html
+        assert "0.9456" in html
+        assert "<style>" not in html
+
+
+class TestComparisonCache:
+    """Тесты для кэша сравнения моделей"""
+
+    @pytest.fixture
+    def data(self):
+        import pandas as pd
+
+        rng = np.random.default_rng(0)
+        X = pd.DataFrame(rng.normal(size=(60, 3)), columns=["a", "b", "c"])
+        y = pd.Series((X["a"] > 0).astype(int), name="loan_status")
+        return X, y
+
+    @pytest.fixture
+    def cache_dir(self, tmp_path, monkeypatch):
+        from app.services import model_comparison
+
+        monkeypatch.setattr(model_comparison, "COMPARISON_CACHE_DIR", tmp_path)
+        monkeypatch.setattr(model_comparison, "_memory_cache", {})
+        return tmp_path
+
+    def test_roc_plot_concurrent_without_pyplot(self, data, tmp_path):
+        """Тест, что ROC-графики строятся параллельно и не трогают фигуры pyplot"""
+        import matplotlib.pyplot as plt
+        from concurrent.futures import ThreadPoolExecutor
+        from pathlib import Path
+        from sklearn.linear_model import LogisticRegression
+        from app.services.model_comparison import generate_roc_auc_plot
+
+        X, y = data
+        models = {"LogReg": LogisticRegression().fit(X, y)}
+        figures_before = plt.get_fignums()
+
+        with ThreadPoolExecutor(max_workers=4) as pool:
+            paths = list(pool.map(
+                lambda i: generate_roc_auc_plot(X, y, models, tmp_path / f"roc_{i}.png"),
+                range(4)
+            ))
+
+        assert plt.get_fignums() == figures_before
+        signatures = {Path(path).read_bytes()[:8] for path in paths}
+        assert signatures == {b"\x89PNG\r\n\x1a\n"}
+
+    def test_fingerprint_stable(self, data):
+        """Тест, что отпечаток не зависит от экземпляров моделей"""
+        from app.services.model_comparison import (
+            build_comparison_models, comparison_fingerprint
+        )
+
+        X, y = data
+        first = comparison_fingerprint(X, y, build_comparison_models())
+        second = comparison_fingerprint(X.copy(), y.copy(), build_comparison_models())
+
+        assert first == second
+
+    def test_fingerprint_changes_with_data_and_params(self, data):
+        """Тест, что отпечаток меняется при изменении данных или гиперпараметров"""
+        from app.services.model_comparison import (
+            build_comparison_models, comparison_fingerprint
+        )
+
+        X, y = data
+        base = comparison_fingerprint(X, y, build_comparison_models())
+
+        changed_X = X.copy()
+        changed_X.iloc[0, 0] += 1
+        models = build_comparison_models()
+        models["RandomForest"].set_params(n_estimators=10)
+
+        assert comparison_fingerprint(changed_X, y, build_comparison_models()) != base
+        assert comparison_fingerprint(X, y, models) != base
+
+    def test_repeat_comparison_served_from_cache(self, data, cache_dir, monkeypatch):
+        """Тест, что повторное сравнение не переобучает модели"""
+        from sklearn.linear_model import LogisticRegression
+        from app.services import model_comparison
+
+        fits = []
+        original_fit = LogisticRegression.fit
+
+        def counting_fit(self, X, y):
+            fits.append(1)
+            return original_fit(self, X, y)
+
+        monkeypatch.setattr(LogisticRegression, "fit", counting_fit)
+        monkeypatch.setattr(
+            model_comparison, "build_comparison_models",
+            lambda: {"LogReg": LogisticRegression()}
+        )
+
+        X, y = data
+        first = model_comparison.compare_models(X, y)
+        second = model_comparison.compare_models(X, y)
+
+        assert len(fits) == 1
+        assert second is first
+        assert (cache_dir / f"{first['fingerprint']}.joblib").exists()
+
+        # Кэш на диске переживает перезапуск процесса
+        monkeypatch.setattr(model_comparison, "_memory_cache", {})
+        restored = model_comparison.compare_models(X, y)
+
+        assert len(fits) == 1
+        assert restored["results"] == first["results"]
+
+    def test_thread_budget_applied_to_nested_models(self):
+        """Тест, что бюджет потоков задаётся всем моделям ансамбля"""
+        from app.services.model_comparison import (
+            apply_thread_budget, build_comparison_models
+        )
+
+        models = build_comparison_models()
+        for model in models.values():
+            apply_thread_budget(model, 3)
+
+        assert models["RandomForest"].n_jobs == 3
+        assert models["CatBoost"].get_params()["thread_count"] == 3
+        assert models["Ensemble"].n_jobs == 1
+        assert all(est.n_jobs == 3 for _, est in models["Ensemble"].estimators)
+
+    def test_parallel_matches_sequential(self, data, monkeypatch):
+        """Тест, что параллельное обучение даёт те же метрики"""
+        from sklearn.linear_model import LogisticRegression
+        from sklearn.tree import DecisionTreeClassifier
+        from app.services import model_comparison
+
+        monkeypatch.setattr(model_comparison, "COMPARISON_WORKERS", 2)
+        monkeypatch.setattr(
+            model_comparison, "build_comparison_models",
+            lambda: {
+                "LogReg": LogisticRegression(),
+                "Tree": DecisionTreeClassifier(random_state=0)
+            }
+        )
+
+        X, y = data
+        sequential = model_comparison.compare_models(X, y, use_cache=False, parallel=False)
+        parallel = model_comparison.compare_models(X, y, use_cache=False, parallel=True)
+
+        assert parallel["results"] == sequential["results"]
+        assert list(parallel["trained_models"]) == ["LogReg", "Tree"]
+
+
+class TestFeedbackLoading:
+    """Тесты для потоковой загрузки фидбэков"""
+
+    @pytest.fixture
+    def feedback_rows(self, db_session, sample_feedback_request):
+        from shared.models import FeedbackDB
+
+        rows = [
+            {**sample_feedback_request, "actual_status": i % 2,
+             "person_income": 40000 + i, "loan_grade": "ABCDEFG"[i % 7]}
+            for i in range(7)
+        ]
+        rows[3]["loan_intent"] = "UNKNOWN"
+        rows[4]["person_emp_length"] = None
+        db_session.add_all(FeedbackDB(**row) for row in rows)
+        db_session.commit()
+        return rows
+
+    def test_chunked_load_matches_rows(self, db_session, feedback_rows):
+        """Тест, что загрузка порциями даёт те же признаки, что и исходные строки"""
+        import pandas as pd
+        from app.services.retrain import load_feedback_frame
+        from shared.data_processing import FeatureEncoder
+
+        df, last_id = load_feedback_frame(db_session, chunk_size=3)
+        # Как при прежней загрузке: DataFrame из словарей
+        expected = pd.DataFrame(feedback_rows)
+        encoder = FeatureEncoder.default()
+
+        assert last_id == len(feedback_rows)
+        assert df["actual_status"].tolist() == expected["actual_status"].tolist()
+        np.testing.assert_array_equal(
+            encoder.transform(df), encoder.transform(expected)
+        )
+
+    def test_rows_deleted_during_load(self, db_session, feedback_rows, monkeypatch):
+        """Тест, что строки, удалённые после подсчёта, не дают мусорных строк"""
+        from app.services.retrain import load_feedback_frame
+        from shared.models import FeedbackDB
+
+        execute = db_session.execute
+        calls = []
+
+        def execute_and_delete(stmt, *args, **kwargs):
+            # Удаление между подсчётом строк и потоковым чтением
+            calls.append(stmt)
+            if len(calls) == 2:
+                db_session.query(FeedbackDB).filter(FeedbackDB.id.in_([2, 5])).delete()
+            return execute(stmt, *args, **kwargs)
+
+        monkeypatch.setattr(db_session, "execute", execute_and_delete)
+
+        df, last_id = load_feedback_frame(db_session, chunk_size=2)
+
+        assert last_id == len(feedback_rows)
+        assert len(df) == len(feedback_rows) - 2
+        assert df["person_income"].tolist() == [40000, 40002, 40003, 40005, 40006]
+        assert not df["loan_grade"].isna().any()
+
+    def test_large_income_is_exact(self, db_session, sample_feedback_request):
+        """Тест, что доход больше 2^24 загружается без потери точности"""
+        from app.services.retrain import load_feedback_frame
+        from shared.models import FeedbackDB
+
+        income = 2 ** 24 + 1
+        db_session.add(FeedbackDB(
+            **{**sample_feedback_request, "person_income": income, "actual_status": 1}
+        ))
+        db_session.commit()
+
+        df, _ = load_feedback_frame(db_session)
+
+        assert df["person_income"].iloc[0] == income
+
+    def test_empty_table(self, db_session):
+        """Тест загрузки пустой таблицы"""
+        from app.services.retrain import load_feedback_frame
+
+        df, last_id = load_feedback_frame(db_session)
+
+        assert df.empty
+        assert last_id is None
+
+
+class TestIncrementalRetrain:
+    """Тесты для инкрементального дообучения по водяному знаку"""
+
+    @pytest.fixture
+    def model_dir(self, model_store_dir, monkeypatch):
+        """Артефакты модели во временной директории и маленький ансамбль"""
+        from catboost import CatBoostClassifier
+        from sklearn.ensemble import RandomForestClassifier
+        from xgboost import XGBClassifier
+        from app.services import model_training, retrain
+        from shared.data_processing import FeatureEncoder
+
+        monkeypatch.setattr(retrain, "get_feature_encoder", FeatureEncoder.default)
+        monkeypatch.setattr(retrain, "RETRAIN_BOOST_ROUNDS", 3)
+        monkeypatch.setattr(retrain, "RETRAIN_RF_REBUILD_ROWS", 15)
+        monkeypatch.setattr(
+            model_training, "build_ensemble_estimators",
+            lambda: [
+                ("rf", RandomForestClassifier(n_estimators=5, random_state=42)),
+                ("xgb", XGBClassifier(n_estimators=5, random_state=42)),
+                ("cb", CatBoostClassifier(iterations=10, silent=True, random_state=42))
+            ]
+        )
+        return model_store_dir
+
+    @staticmethod
+    def add_feedback(db_session, sample_feedback_request, n):
+        from shared.models import FeedbackDB
+
+        db_session.add_all(
+            FeedbackDB(**{
+                **sample_feedback_request,
+                "actual_status": i % 2,
+                "person_income": 30000 + 7919 * i
+            })
+            for i in range(n)
+        )
+        db_session.commit()
+
+    def test_watermark_and_incremental_updates(self, db_session, sample_feedback_request, model_dir):
+        """Тест: полное обучение, up_to_date, продолжение бустинга, перестройка RF"""
+        import joblib
+        from shared.model_store import get_artifact_path
+        from app.services.retrain import retrain_model_from_feedback
+
+        self.add_feedback(db_session, sample_feedback_request, 10)
+        first = retrain_model_from_feedback(db_session)
+
+        assert first["mode"] == "full"
+        assert first["feedback_watermark"] == 10
+        assert retrain_model_from_feedback(db_session)["status"] == "up_to_date"
+
+        rf_before = joblib.load(get_artifact_path("model")).named_estimators_["rf"]
+        self.add_feedback(db_session, sample_feedback_request, 10)
+        second = retrain_model_from_feedback(db_session)
+        model = joblib.load(get_artifact_path("model"))
+
+        assert second["mode"] == "incremental"
+        assert second["samples_used"] == 10
+        assert second["feedback_watermark"] == 20
+        assert not second["rf_rebuilt"]
+        assert model.named_estimators_["xgb"].get_booster().num_boosted_rounds() == 5 + 3
+        assert model.named_estimators_["cb"].tree_count_ == 10 + 3
+        np.testing.assert_array_equal(
+            model.named_estimators_["rf"].feature_importances_,
+            rf_before.feature_importances_
+        )
+
+        # Накопилось 10 + 10 >= 15 новых строк — RF перестраивается
+        self.add_feedback(db_session, sample_feedback_request, 10)
+        third = retrain_model_from_feedback(db_session)
+
+        assert third["rf_rebuilt"]
+        assert utils.load_model_metadata()["rows_since_rf_rebuild"] == 0
+
+    def test_single_class_increment_is_deferred(self, db_session, sample_feedback_request, model_dir):
+        """Тест: инкремент из одного класса откладывается, водяной знак не сдвигается"""
+        from shared.models import FeedbackDB
+        from app.services.retrain import retrain_model_from_feedback
+
+        self.add_feedback(db_session, sample_feedback_request, 10)
+        retrain_model_from_feedback(db_session)
+
+        db_session.add_all(
+            FeedbackDB(**{
+                **sample_feedback_request, "actual_status": 1, "person_income": 50000 + 1000 * i
+            })
+            for i in range(6)
+        )
+        db_session.commit()
+        deferred = retrain_model_from_feedback(db_session)
+
+        assert deferred["status"] == "deferred"
+        assert deferred["pending_samples"] == 6
+        assert deferred["feedback_watermark"] == 10
+        assert utils.load_model_metadata()["feedback_watermark"] == 10
+
+        # С новыми фидбэками другого класса отложенные учитываются
+        db_session.add_all(
+            FeedbackDB(**{
+                **sample_feedback_request, "actual_status": 0, "person_income": 50000 + 1000 * i
+            })
+            for i in range(4)
+        )
+        db_session.commit()
+        result = retrain_model_from_feedback(db_session)
+
+        assert result["status"] == "retrained"
+        assert result["mode"] == "incremental"
+        assert result["samples_used"] == 10
+        assert result["feedback_watermark"] == 20
+
+    def test_full_fit_rejects_single_class(self, db_session, sample_feedback_request, model_dir):
+        """Тест: полное обучение на одном классе отклоняется ValueError"""
+        from shared.models import FeedbackDB
+        from app.services.retrain import retrain_model_from_feedback
+
+        db_session.add_all(
+            FeedbackDB(**{**sample_feedback_request, "actual_status": 0}) for _ in range(6)
+        )
+        db_session.commit()
+
+        with pytest.raises(ValueError, match="один класс"):
+            retrain_model_from_feedback(db_session)
+
+    def test_replay_mode_adds_base_sample(self, db_session, sample_feedback_request, model_dir,
+                                          tmp_path, monkeypatch):
+        """Тест: в режиме replay к фидбэкам добавляется выборка базового датасета"""
+        from app.services import replay, retrain
+        from app.services.retrain import retrain_model_from_feedback
+
+        monkeypatch.setattr(
+            retrain, "get_base_reservoir",
+            lambda encoder: replay.get_base_reservoir(
+                encoder, capacity=50, path=tmp_path / "reservoir.npz"
+            )
+        )
+
+        self.add_feedback(db_session, sample_feedback_request, 10)
+        first = retrain_model_from_feedback(db_session, replay=True)
+        assert first["mode"] == "full"
+        assert first["replay_samples"] == 50
+        assert first["samples_used"] == 10
+
+        self.add_feedback(db_session, sample_feedback_request, 20)
+        second = retrain_model_from_feedback(db_session, replay=True)
+        assert second["mode"] == "incremental"
+        assert second["replay_samples"] == 50
+        assert second["rf_rebuilt"]
+        assert utils.load_model_metadata()["rf_watermark"] == 30
+
+
+class TestReplayReservoir:
+    """Тесты для выборки базового датасета (replay)"""
+
+    def test_reservoir_fill_and_capacity(self):
+        """Тест: выборка заполняется первыми строками и не превышает capacity"""
+        from app.services.replay import ReplayReservoir
+
+        reservoir = ReplayReservoir(capacity=10, n_features=2)
+        X = np.arange(14, dtype=np.float32).reshape(7, 2)
+        reservoir.add(X, np.arange(7))
+        assert reservoir.size == 7
+        np.testing.assert_array_equal(reservoir.X, X)
+
+        stream = np.arange(1000, dtype=np.float32)
+        for chunk in np.array_split(stream, 7):
+            reservoir.add(np.column_stack([chunk, chunk]), chunk.astype(np.int8))
+        assert reservoir.size == 10
+        assert reservoir.seen == 1007
+        # Строки выборки не смешиваются: признаки взяты из одной строки
+        np.testing.assert_array_equal(reservoir.X[:, 0], reservoir.X[:, 1])
+
+    def test_reservoir_is_uniform(self):
+        """Тест: каждая строка потока попадает в выборку с вероятностью capacity / n"""
+        from app.services.replay import ReplayReservoir
+
+        hits = np.zeros(100)
+        for seed in range(400):
+            reservoir = ReplayReservoir(capacity=10, n_features=1, seed=seed)
+            for chunk in np.array_split(np.arange(100, dtype=np.float32), 4):
+                reservoir.add(chunk[:, None], np.zeros(len(chunk)))
+            hits[reservoir.X[:, 0].astype(int)] += 1
+
+        frequency = hits / 400
+        assert abs(frequency[:50].mean() - frequency[50:].mean()) < 0.03
+        assert abs(frequency.mean() - 0.1) < 1e-9
+
+    def test_base_reservoir_persisted_and_rebuilt(self, tmp_path):
+        """Тест: выборка сохраняется на диск и пересобирается при смене датасета"""
+        import pandas as pd
+        from app.services import replay
+        from shared.data_processing import FeatureEncoder
+        from shared.config import DATA_SOURCE
+
+        source = tmp_path / "dataset.csv"
+        source.write_bytes(DATA_SOURCE.read_bytes())
+        path = tmp_path / "reservoir.npz"
+        encoder = FeatureEncoder.default()
+
+        X, y = replay.get_base_reservoir(encoder, capacity=100, source=source, path=path)
+        assert path.exists()
+        assert list(X.columns) == encoder.feature_names
+        assert len(X) == len(y) == 100
+        assert set(y.unique()) <= {0, 1}
+
+        mtime = path.stat().st_mtime_ns
+        X_cached, _ = replay.get_base_reservoir(encoder, capacity=100, source=source, path=path)
+        assert path.stat().st_mtime_ns == mtime
+        pd.testing.assert_frame_equal(X, X_cached)
+
+        with open(source, "a") as f:
+            f.write(source.read_text().splitlines()[1] + "\n")
+        replay.get_base_reservoir(encoder, capacity=100, source=source, path=path)
+        assert path.stat().st_mtime_ns != mtime
+
+
+class TestRetrainScheduler:
+    """Тесты для автоматического дообучения по накоплению фидбэков"""
+
+    @pytest.fixture
+    def scheduler_env(self, model_store_dir, monkeypatch):
+        """Метаданные и блокировка во временной директории, маленькие пороги"""
+        from app.services import scheduler
+
+        metadata_path = model_store_dir / "model_metadata.json"
+        monkeypatch.setattr(scheduler, "RETRAIN_LOCK_PATH", model_store_dir / ".retrain.lock")
+        monkeypatch.setattr(scheduler, "RETRAIN_TRIGGER_ROWS", 5)
+        monkeypatch.setattr(scheduler, "RETRAIN_TRIGGER_MAX_AGE_SECONDS", 3600)
+        monkeypatch.setattr(scheduler, "RETRAIN_MIN_INTERVAL_SECONDS", 600)
+        return metadata_path
+
+    @staticmethod
+    def add_feedback(db_session, sample_feedback_request, n, created_at=None):
+        from datetime import datetime
+        from shared.models import FeedbackDB
+
+        db_session.add_all(
+            FeedbackDB(**sample_feedback_request, created_at=created_at or datetime.utcnow())
+            for _ in range(n)
+        )
+        db_session.commit()
+
+    def test_due_reason(self, db_session, sample_feedback_request, scheduler_env):
+        """Тест: дообучение по количеству, по возрасту и не чаще интервала"""
+        from datetime import datetime, timedelta
+        from app.services.scheduler import retrain_due_reason
+
+        now = datetime.utcnow()
+        self.add_feedback(db_session, sample_feedback_request, 2, now - timedelta(minutes=5))
+        assert retrain_due_reason(db_session, now) is None
+
+        self.add_feedback(db_session, sample_feedback_request, 1, now - timedelta(hours=2))
+        assert retrain_due_reason(db_session, now) == "age"
+
+        self.add_feedback(db_session, sample_feedback_request, 2)
+        assert retrain_due_reason(db_session, now) == "rows"
+
+        # Учтённые фидбэки (до водяного знака) не считаются;
+        # модель сохранена недавно — дообучать рано
+        scheduler_env.write_text(json.dumps({
+            "feedback_watermark": 3,
+            "saved_at": (now - timedelta(minutes=1)).isoformat()
+        }))
+        assert retrain_due_reason(db_session, now) is None
+        assert retrain_due_reason(db_session, now + timedelta(hours=2)) == "age"
+
+    def test_check_and_retrain_skips_while_locked(self, db_session, sample_feedback_request,
+                                                  scheduler_env, monkeypatch):
+        """Тест: при занятой блокировке дообучение не запускается повторно"""
+        from app.services import scheduler
+
+        calls = []
+        monkeypatch.setattr(
+            scheduler, "retrain_model_from_feedback",
+            lambda db, **kwargs: calls.append(kwargs) or {"status": "retrained"}
+        )
+        self.add_feedback(db_session, sample_feedback_request, 5)
+
+        with scheduler.retrain_lock():
+            with pytest.raises(scheduler.RetrainInProgress):
+                with scheduler.retrain_lock():
+                    pass
+            assert scheduler.check_and_retrain(db_session) is None
+        assert calls == []
+
+        assert scheduler.check_and_retrain(db_session) == {"status": "retrained"}
+        assert len(calls) == 1
+
+    def test_notifications_coalesce(self, db_session, monkeypatch):
+        """Тест: сигналы во время проверки схлопываются в одну следующую"""
+        import threading
+        import time
+        from app.services import scheduler
+
+        started = threading.Event()
+        release = threading.Event()
+        calls = []
+
+        def fake_check(db):
+            calls.append(db)
+            started.set()
+            release.wait(5)
+
+        monkeypatch.setattr(scheduler, "check_and_retrain", fake_check)
+        retrain_scheduler = scheduler.RetrainScheduler(
+            check_interval=3600, isolated=False, session_factory=lambda: db_session
+        )
+        retrain_scheduler.start()
+        try:
+            retrain_scheduler.notify()
+            assert started.wait(5)
+            for _ in range(10):
+                retrain_scheduler.notify()
+            release.set()
+            time.sleep(0.3)
+        finally:
+            retrain_scheduler.stop()
+
+        assert len(calls) == 2
+
+
+    def test_backoff_after_failures(self, db_session, scheduler_env, monkeypatch):
+        """Тест: после ошибки дообучение не повторяется до конца удваивающейся паузы"""
+        from app.services import scheduler
+
+        clock = [1000.0]
+        calls = []
+
+        def failing_check(db):
+            calls.append(db)
+            raise RuntimeError("CatBoostError")
+
+        monkeypatch.setattr(scheduler.time, "monotonic", lambda: clock[0])
+        monkeypatch.setattr(scheduler, "RETRAIN_FAILURE_BACKOFF_SECONDS", 60)
+        monkeypatch.setattr(scheduler, "check_and_retrain", failing_check)
+        retrain_scheduler = scheduler.RetrainScheduler(
+            isolated=False, session_factory=lambda: db_session
+        )
+
+        with pytest.raises(RuntimeError):
+            retrain_scheduler.run_once()
+        clock[0] += 59
+        assert retrain_scheduler.run_once() is None
+        assert len(calls) == 1
+
+        # Пауза истекла — новая попытка и вдвое большая пауза
+        clock[0] += 2
+        with pytest.raises(RuntimeError):
+            retrain_scheduler.run_once()
+        clock[0] += 100
+        assert retrain_scheduler.run_once() is None
+        assert len(calls) == 2
+
+        # Водяной знак сдвинулся (ручной /retrain) — пауза снимается
+        scheduler_env.write_text(json.dumps({"feedback_watermark": 7}))
+        monkeypatch.setattr(
+            scheduler, "check_and_retrain",
+            lambda db: calls.append(db) or {"status": "retrained"}
+        )
+        assert retrain_scheduler.run_once() == {"status": "retrained"}
+        assert len(calls) == 3
+
+    def test_failed_process_is_not_respawned(self, db_session, scheduler_env, monkeypatch):
+        """Тест: процесс дообучения, завершившийся с ошибкой, не перезапускается сразу"""
+        from app.services import scheduler
+
+        started = []
+
+        class FakeProcess:
+            exitcode = 1
+
+            def __init__(self, **kwargs):
+                pass
+
+            def start(self):
+                started.append(self)
+
+            def join(self):
+                pass
+
+        class FakeContext:
+            Process = FakeProcess
+
+        monkeypatch.setattr(scheduler, "retrain_due_reason", lambda db: "rows")
+        monkeypatch.setattr(scheduler.multiprocessing, "get_context", lambda method: FakeContext)
+        retrain_scheduler = scheduler.RetrainScheduler(session_factory=lambda: db_session)
+
+        retrain_scheduler.run_once()
+        retrain_scheduler.run_once()
+
+        assert len(started) == 1
+
+
+class TestMicroBatcher:
+    """Тесты для микропакетирования /predict"""
+
+    @staticmethod
+    def predict_concurrently(batcher, rows):
+        """Отправляет строки из отдельных потоков, возвращает результаты по порядку"""
+        from concurrent.futures import ThreadPoolExecutor
+
+        with ThreadPoolExecutor(len(rows)) as executor:
+            futures = [executor.submit(batcher.predict, row) for row in rows]
+            return [future.result(timeout=5) for future in futures]
+
+    def test_concurrent_requests_share_batch(self):
+        """Тест, что конкурентные запросы считаются одним пакетом"""
+        from app.services.batching import MicroBatcher
+
+        batch_sizes = []
+
+        def predict_batch(df):
+            batch_sizes.append(len(df))
+            return [{"id": row_id} for row_id in df["id"]]
+
+        # Пакет закрывается по max_rows, не дожидаясь max_wait_ms
+        batcher = MicroBatcher(predict_batch, max_rows=4, max_wait_ms=5000)
+        results = self.predict_concurrently(batcher, [{"id": i} for i in range(4)])
+
+        assert results == [{"id": i} for i in range(4)]
+        assert batch_sizes == [4]
+        assert batcher.stats()["avg_batch_rows"] == 4
+
+    def test_single_request_waits_at_most_max_wait(self):
+        """Тест, что одиночный запрос не ждёт дольше max_wait_ms"""
+        import time
+        from app.services.batching import MicroBatcher
+
+        batcher = MicroBatcher(lambda df: [{"ok": True}] * len(df), max_rows=64, max_wait_ms=20)
+
+        start = time.perf_counter()
+        assert batcher.predict({"id": 0}) == {"ok": True}
+        assert time.perf_counter() - start < 1
+
+    def test_failing_row_does_not_fail_batch(self):
+        """Тест, что ошибка одной строки достаётся только её запросу"""
+        from concurrent.futures import ThreadPoolExecutor
+        from app.services.batching import MicroBatcher
+
+        def predict_batch(df):
+            if (df["id"] < 0).any():
+                raise ValueError("Ошибка при пакетном предсказании")
+            return [{"id": row_id} for row_id in df["id"]]
+
+        batcher = MicroBatcher(predict_batch, max_rows=3, max_wait_ms=5000)
+        rows = [{"id": 1}, {"id": -1}, {"id": 2}]
+
+        with ThreadPoolExecutor(3) as executor:
+            futures = [executor.submit(batcher.predict, row) for row in rows]
+
+        assert futures[0].result(timeout=5) == {"id": 1}
+        assert futures[2].result(timeout=5) == {"id": 2}
+        with pytest.raises(ValueError):
+            futures[1].result(timeout=5)
+
+    def test_cancelled_request_does_not_fail_batch(self):
+        """Тест, что отмена одного запроса не мешает остальным запросам пакета"""
+        import threading
+        from app.services.batching import MicroBatcher
+
+        started, release = threading.Event(), threading.Event()
+        batch_ids = []
+
+        def predict_batch(df):
+            started.set()
+            release.wait(5)
+            batch_ids.append(list(df["id"]))
+            return [{"id": row_id} for row_id in df["id"]]
+
+        batcher = MicroBatcher(predict_batch, max_rows=3, max_wait_ms=0)
+        # Пока считается первый пакет, следующие запросы ждут в очереди
+        first = batcher.submit({"id": 0})
+        assert started.wait(5)
+        futures = [batcher.submit({"id": i}) for i in range(1, 4)]
+        assert futures[0].cancel()
+        release.set()
+
+        assert first.result(timeout=5) == {"id": 0}
+        assert [future.result(timeout=5) for future in futures[1:]] == [
+            {"id": 2}, {"id": 3}
+        ]
+        assert batch_ids == [[0], [2, 3]]
+
+
+class TestInferenceExecutor:
+    """Тесты для пула потоков инференса"""
+
+    def test_queue_depth(self):
+        """Тест, что вызовы сверх max_workers видны как очередь"""
+        import threading
+        import time
+        from app.services.inference import InferenceExecutor
+
+        executor = InferenceExecutor(max_workers=1)
+        release = threading.Event()
+        try:
+            futures = [executor.submit(release.wait, 5) for _ in range(3)]
+            time.sleep(0.1)
+            assert executor.stats()["running"] == 1
+            assert executor.queue_depth == 2
+
+            assert futures[2].cancel()
+            assert executor.queue_depth == 1
+
+            release.set()
+            futures[1].result(timeout=5)
+            stats = executor.stats()
+            assert (stats["queued"], stats["running"], stats["completed"]) == (0, 0, 2)
+            assert stats["max_queued"] == 2
+        finally:
+            release.set()
+            executor.shutdown()
+
+    def test_full_queue_rejects(self):
+        """Тест, что вызов сверх max_queue отклоняется с 429"""
+        import threading
+        import time
+        from app.services.admission import Overloaded
+        from app.services.inference import InferenceExecutor
+
+        executor = InferenceExecutor(max_workers=1, max_queue=1, retry_after=7)
+        release = threading.Event()
+        try:
+            futures = [executor.submit(release.wait, 5) for _ in range(2)]
+            time.sleep(0.1)
+
+            with pytest.raises(Overloaded) as exc_info:
+                executor.submit(release.wait, 5)
+            assert (exc_info.value.status_code, exc_info.value.retry_after) == (429, 7)
+            assert executor.stats()["rejected"] == 1
+
+            release.set()
+            for future in futures:
+                future.result(timeout=5)
+            assert executor.submit(lambda: 1).result(timeout=5) == 1
+        finally:
+            release.set()
+            executor.shutdown()
+
+    def test_run_from_event_loop(self):
+        """Тест, что async-вызов получает результат из пула"""
+        import asyncio
+        import threading
+        from app.services.inference import InferenceExecutor
+
+        executor = InferenceExecutor(max_workers=1)
+        try:
+            name = asyncio.run(executor.run(lambda: threading.current_thread().name))
+        finally:
+            executor.shutdown()
+
+        assert name.startswith("inference")
+
+
+class TestLatencyHistograms:
+    """Тесты для гистограмм времени ответа"""
+
+    def test_quantiles_interpolated_within_bucket(self):
+        """Тест, что квантили оцениваются по корзинам, как в Prometheus"""
+        from app.services.latency import LatencyHistograms
+
+        latency = LatencyHistograms(buckets=(0.1, 1.0))
+        for _ in range(90):
+            latency.observe("POST /predict", 200, 0.05)
+        for _ in range(10):
+            latency.observe("POST /predict", 200, 0.5)
+
+        summary = latency.summary()
+        stats = summary["by_endpoint"]["POST /predict"]["200"]
+
+        assert stats["count"] == summary["count"] == 100
+        assert stats["avg"] == pytest.approx(0.095)
+        assert stats["p50"] == pytest.approx(0.1 * 50 / 90, abs=1e-4)
+        assert stats["p95"] == pytest.approx(0.1 + 0.9 * 0.5, abs=1e-4)
+
+    def test_tail_beyond_last_bucket(self):
+        """Тест, что значения больше последней границы попадают в +Inf"""
+        from app.services.latency import LatencyHistograms
+
+        latency = LatencyHistograms(buckets=(0.1, 1.0))
+        latency.observe("GET /compare", 503, 45.0)
+
+        ((cumulative, total),) = latency.snapshot().values()
+        assert cumulative == [0, 0, 1]
+        assert total == 45.0
+        assert latency.summary()["p99"] == 1.0
+
+    def test_render_prometheus_text(self):
+        """Тест текстового формата Prometheus"""
+        from app.services.latency import LatencyHistograms
+
+        latency = LatencyHistograms(buckets=(0.1, 1.0))
+        latency.observe("GET /health", 200, 0.1)
+        latency.observe("GET /health", 200, 0.5)
+
+        lines = latency.render().splitlines()
+
+        assert lines[1] == "# TYPE http_request_duration_seconds histogram"
+        assert lines[2:] == [
+            'http_request_duration_seconds_bucket{endpoint="GET /health",status="200",le="0.1"} 1',
+            'http_request_duration_seconds_bucket{endpoint="GET /health",status="200",le="1.0"} 2',
+            'http_request_duration_seconds_bucket{endpoint="GET /health",status="200",le="+Inf"} 2',
+            'http_request_duration_seconds_sum{endpoint="GET /health",status="200"} 0.6',
+            'http_request_duration_seconds_count{endpoint="GET /health",status="200"} 2',
+        ]